@@ -0,0 +1,272 @@
+"""
+Compressed, rotating archives of old conversation turns
+
+Turns that leave the live memory file (compacted into a summary, or past
+``MEMORY_LIVE_MESSAGES``) are appended to JSONL segments in
+``<memory file>.archive/``, one message per line, compressed with gzip
+(or zstd, see ``ARCHIVE_COMPRESSION``).  Segments are partitioned by the
+month (or day) they were written in and rotate once they pass
+``ARCHIVE_SEGMENT_BYTES``; segments not written to for
+``ARCHIVE_RETENTION_DAYS`` are deleted.
+
+Export and import stream one message at a time, so archives of any size
+move in constant memory:
+    python archive.py export chatbot_memory.json history.jsonl.gz
+    python archive.py import history.jsonl.gz chatbot_memory.json
+"""
+import io
+import os
+import re
+import sys
+import json
+import gzip
+import time
+
+# gzip (stdlib), zstd (needs the zstandard package) or none
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'gzip')
+# Partition segments by the "month" or "day" they were written in
+ARCHIVE_PARTITION = os.getenv('ARCHIVE_PARTITION', 'month')
+ARCHIVE_SEGMENT_BYTES = int(os.getenv('ARCHIVE_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# Delete segments untouched for this many days (0 keeps everything)
+ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '0'))
+
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', 'none': '.jsonl'}
+PARTITION_FORMATS = {'month': '%Y-%m', 'day': '%Y-%m-%d'}
+_SEGMENT = re.compile(r'^(?P<period>\d{4}-\d{2}(?:-\d{2})?)\.(?P<part>\d+)\.jsonl(?:\.gz|\.zst)?$')
+
+_warned = False
+
+
+def compression_for(path):
+    """Compression of a file, from its extension"""
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return 'none'
+
+
+def _zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def available_compression(compression=ARCHIVE_COMPRESSION):
+    """``compression``, or gzip when zstd is asked for but not installed"""
+    global _warned
+    if compression == 'zstd' and _zstandard() is None:
+        if not _warned:
+            _warned = True
+            print("⚠️ zstd archives need zstandard - run: pip install zstandard (using gzip)")
+        return 'gzip'
+    return compression if compression in EXTENSIONS else 'gzip'
+
+
+def open_write(path, compression=None):
+    """Binary stream appending to ``path``; each open adds a gzip member or zstd frame"""
+    compression = compression or compression_for(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'ab', compresslevel=6)
+    if compression == 'zstd':
+        raw = open(path, 'ab')
+        return _zstandard().ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+    return open(path, 'ab')
+
+
+def open_read(path):
+    """Text stream over a possibly compressed JSONL file, read incrementally"""
+    compression = compression_for(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if compression == 'zstd':
+        raw = open(path, 'rb')
+        reader = _zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_jsonl(path):
+    """Messages in a JSONL file, one at a time; a torn last line is ignored"""
+    with open_read(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                break
+
+
+class ArchiveWriter:
+    """Appends messages to the current segment, starting a new one when it fills up"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self._stream = None
+        self._raw_size = 0
+        self._path = None
+        self.written = 0
+
+    def _open(self):
+        self._path = self.archive.current_segment()
+        self._stream = open_write(self._path, self.archive.compression)
+        self._raw_size = 0
+        self._next_check = 0
+
+    def write(self, message):
+        if self._stream is None:
+            self._open()
+        line = (json.dumps(dict(message), ensure_ascii=False) + '\n').encode('utf-8')
+        self._stream.write(line)
+        self._raw_size += len(line)
+        self.written += 1
+        # Check the size every so often; what is still buffered counts at a guessed 4:1 ratio
+        if self._raw_size >= self._next_check:
+            self._next_check = self._raw_size + min(65536, self.archive.segment_bytes)
+            if os.path.getsize(self._path) + self._raw_size // 4 >= self.archive.segment_bytes:
+                self.close()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConversationArchive:
+    """The archive segments of one conversation"""
+
+    def __init__(self, memory_file, compression=ARCHIVE_COMPRESSION, partition=ARCHIVE_PARTITION,
+                 segment_bytes=ARCHIVE_SEGMENT_BYTES, retention_days=ARCHIVE_RETENTION_DAYS, clock=time.time):
+        self.memory_file = memory_file
+        self.path = memory_file + '.archive'
+        # What the history compactor used to append to, read as the oldest segment
+        self.legacy_file = memory_file + '.archive.jsonl'
+        self.compression = available_compression(compression)
+        self.partition = PARTITION_FORMATS.get(partition, PARTITION_FORMATS['month'])
+        self.segment_bytes = segment_bytes
+        self.retention_days = retention_days
+        self.clock = clock
+
+    def segments(self):
+        """Segment paths, oldest first"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        matches = [(m.group('period'), int(m.group('part')), name)
+                   for name, m in ((name, _SEGMENT.match(name)) for name in names) if m]
+        return [os.path.join(self.path, name) for _, _, name in sorted(matches)]
+
+    def current_segment(self):
+        """The segment to append to: this period's newest, or a new one once it is full"""
+        os.makedirs(self.path, exist_ok=True)
+        self.expire()
+        period = time.strftime(self.partition, time.localtime(self.clock()))
+        extension = EXTENSIONS[self.compression]
+        current = [m for m in map(_SEGMENT.match, os.listdir(self.path)) if m and m.group('period') == period]
+        if not current:
+            return os.path.join(self.path, f"{period}.0000{extension}")
+        newest = max(current, key=lambda m: int(m.group('part')))
+        path = os.path.join(self.path, newest.group(0))
+        # A full segment, or one in another compression, is left as it is
+        if not path.endswith(extension) or os.path.getsize(path) >= self.segment_bytes:
+            path = os.path.join(self.path, f"{period}.{int(newest.group('part')) + 1:04d}{extension}")
+        return path
+
+    def expire(self):
+        """Delete segments older than the retention period"""
+        if not self.retention_days:
+            return 0
+        cutoff = self.clock() - self.retention_days * 86400
+        expired = [path for path in self.segments() if os.path.getmtime(path) < cutoff]
+        for path in expired:
+            os.remove(path)
+        return len(expired)
+
+    def writer(self):
+        return ArchiveWriter(self)
+
+    def append(self, messages):
+        """Archive ``messages``, oldest first"""
+        with self.writer() as writer:
+            for message in messages:
+                writer.write(message)
+
+    def __iter__(self):
+        """Every archived message, oldest first, read one at a time"""
+        if os.path.exists(self.legacy_file):
+            yield from iter_jsonl(self.legacy_file)
+        for path in self.segments():
+            yield from iter_jsonl(path)
+
+    def size(self):
+        """Bytes on disk"""
+        paths = self.segments() + ([self.legacy_file] if os.path.exists(self.legacy_file) else [])
+        return sum(os.path.getsize(path) for path in paths)
+
+
+def export_conversation(memory_file, output):
+    """Write the archived plus the live history of a conversation to one JSONL file (compressed by extension).
+
+    Reads the conversation from the configured memory backend (``MEMORY_BACKEND``).
+    """
+    from memory_store import open_memory_store
+
+    count = 0
+    store = open_memory_store(memory_file)
+    try:
+        # open_write appends: start over from whatever an interrupted export left behind
+        open(output + '.tmp', 'wb').close()
+        with open_write(output + '.tmp', compression_for(output)) as out:
+            for message in store.iter_messages():
+                out.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+                count += 1
+    finally:
+        store.close()
+    os.replace(output + '.tmp', output)
+    return count
+
+
+def import_conversation(source, memory_file, live_messages=None, compression=ARCHIVE_COMPRESSION):
+    """Append the messages of a JSONL file to a conversation in the configured memory backend.
+
+    With the JSON backend only the newest ``live_messages`` (default
+    ``MEMORY_LIVE_MESSAGES``) of the conversation stay in the live file; the
+    rest stream into the archive.  Only a bounded batch of messages is held
+    in memory either way (see ``MemoryStore.extend``).
+    """
+    from memory_store import open_memory_store, MEMORY_LIVE_MESSAGES
+
+    store = open_memory_store(memory_file, live_messages=MEMORY_LIVE_MESSAGES if live_messages is None
+                              else live_messages)
+    try:
+        return store.extend(({"role": message.get("role", "user"), "content": message.get("content", "")}
+                             for message in iter_jsonl(source)), compression)
+    finally:
+        store.close()
+
+
+def main():
+    """python archive.py export MEMORY_FILE OUTPUT | import SOURCE MEMORY_FILE"""
+    if len(sys.argv) != 4 or sys.argv[1] not in ('export', 'import'):
+        print(main.__doc__)
+        raise SystemExit(2)
+    started = time.perf_counter()
+    if sys.argv[1] == 'export':
+        count = export_conversation(sys.argv[2], sys.argv[3])
+        print(f"📦 Exported {count} messages from {sys.argv[2]} to {sys.argv[3]}")
+    else:
+        count = import_conversation(sys.argv[2], sys.argv[3])
+        print(f"📦 Imported {count} messages from {sys.argv[2]} into {sys.argv[3]}")
+    print(f"   in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Asyncio-native (ASGI) serving mode for the chatbots
+
+Serves the same routes as the Flask apps, but every request is a coroutine:
+model calls, web searches and session waits suspend instead of holding a
+worker thread, so one process can keep many conversations in flight.
+Run it with any ASGI server, e.g. ``python chatbot.py --async`` (uvicorn).
+"""
+import os
+import json
+import asyncio
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import metrics
+from sse import format_sse
+from jobs import get_jobs, result_response, JOB_KEEPALIVE
+from prefetch import get_prefetcher
+from scheduler import SchedulerBusy
+from session_store import SESSION_COOKIE, new_session_id, is_valid_session_id
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+class ASGIChatApp:
+    """Minimal ASGI application over a SessionStore of async-capable chatbots"""
+
+    def __init__(self, sessions, jobs=None, prefetcher=None):
+        self.sessions = sessions
+        self.jobs = jobs or get_jobs()
+        self.prefetcher = prefetcher or get_prefetcher()
+        self.routes = {
+            ('GET', '/'): self.index,
+            ('POST', '/chat'): self.chat,
+            ('POST', '/chat/stream'): self.chat_stream,
+            ('POST', '/clear'): self.clear_chat,
+            ('POST', '/search/prefetch'): self.search_prefetch,
+            ('GET', '/metrics'): self.metrics_page,
+        }
+        # /jobs/<job_id>[/<action>]
+        self.job_routes = {
+            ('GET', ''): self.job_status,
+            ('GET', 'stream'): self.job_stream,
+            ('POST', 'cancel'): self.job_cancel,
+            ('GET', 'result'): self.job_result,
+        }
+        self._index_html = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'].startswith('/jobs/'):
+            job_id, _, action = scope['path'][len('/jobs/'):].partition('/')
+            handler = self.job_routes.get((scope['method'], action))
+            if handler is not None:
+                await handler(scope, receive, send, job_id)
+                return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            await self._send_json(send, {'error': 'Not found'}, status=404)
+            return
+        await handler(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # -- request helpers ---------------------------------------------------
+
+    @staticmethod
+    async def _read_json(receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _session_id(scope):
+        """Return the caller's session id, issuing a new one if needed"""
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                morsel = SimpleCookie(value.decode('latin-1')).get(SESSION_COOKIE)
+                if morsel and is_valid_session_id(morsel.value):
+                    return morsel.value
+        return new_session_id()
+
+    @staticmethod
+    def _cookie_session_id(scope):
+        """The session id from the cookie, without issuing a new one"""
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                morsel = SimpleCookie(value.decode('latin-1')).get(SESSION_COOKIE)
+                if morsel:
+                    return morsel.value
+        return None
+
+    @staticmethod
+    def _query_int(scope, name, default=0):
+        values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get(name)
+        try:
+            return int(values[0]) if values else default
+        except ValueError:
+            return default
+
+    @staticmethod
+    def _header(scope, name):
+        for key, value in scope.get('headers', []):
+            if key == name:
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    def _headers(content_type, session_id=None):
+        headers = [(b'content-type', content_type.encode())]
+        if session_id:
+            cookie = f"{SESSION_COOKIE}={session_id}; HttpOnly; Path=/; SameSite=Lax"
+            headers.append((b'set-cookie', cookie.encode()))
+        return headers
+
+    async def _send_json(self, send, data, status=200, session_id=None, headers=()):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': self._headers('application/json', session_id) + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    # -- routes ------------------------------------------------------------
+
+    async def index(self, scope, receive, send):
+        if self._index_html is None:
+            with open(os.path.join(TEMPLATE_DIR, 'index.html'), 'rb') as f:
+                self._index_html = f.read()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': self._headers('text/html; charset=utf-8')})
+        await send({'type': 'http.response.body', 'body': self._index_html})
+
+    async def chat(self, scope, receive, send):
+        try:
+            data = await self._read_json(receive)
+            user_message = data.get('message', '')
+            if not user_message:
+                await self._send_json(send, {'error': 'No message provided'}, status=400)
+                return
+
+            session_id = self._session_id(scope)
+            if data.get('job'):
+                # Answer now; the response is generated by a task on this loop
+                chunks = self._stream_turn(session_id, user_message, not data.get('no_cache'))
+                job = await self.jobs.submit_async(session_id, chunks)
+                await self._send_json(send, {'job_id': job.id, 'status': job.status},
+                                      status=202, session_id=session_id)
+                return
+
+            async with self.sessions.async_session(session_id) as bot:
+                response = await bot.get_response_async(user_message, use_cache=not data.get('no_cache'))
+            await self._send_json(send, {'response': response}, session_id=session_id)
+
+        except SchedulerBusy as e:
+            await self._send_json(send, {'error': str(e)}, status=503,
+                                  headers=[(b'retry-after', str(e.retry_after).encode())])
+
+        except Exception as e:
+            await self._send_json(send, {'error': str(e)}, status=500)
+
+    async def chat_stream(self, scope, receive, send):
+        data = await self._read_json(receive)
+        user_message = data.get('message', '')
+        if not user_message:
+            await self._send_json(send, {'error': 'No message provided'}, status=400)
+            return
+
+        session_id = self._session_id(scope)
+        chunks = self._stream_turn(session_id, user_message, not data.get('no_cache'))
+        try:
+            # Wait for the model's first chunk before the 200 goes out, so an
+            # overloaded server can still answer 503 like /chat does
+            try:
+                first = [await chunks.__anext__()]
+            except StopAsyncIteration:
+                first = []
+            except SchedulerBusy as e:
+                await self._send_json(send, {'error': str(e)}, status=503,
+                                      headers=[(b'retry-after', str(e.retry_after).encode())])
+                return
+            except Exception as e:
+                await self._send_json(send, {'error': str(e)}, status=500)
+                return
+
+            headers = self._headers('text/event-stream', session_id)
+            headers += [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            for chunk in first:
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': format_sse({'delta': chunk}).encode('utf-8')})
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': format_sse({'delta': chunk}).encode('utf-8')})
+        finally:
+            await chunks.aclose()
+        await send({'type': 'http.response.body',
+                    'body': format_sse({}, event='done').encode('utf-8')})
+
+    async def _stream_turn(self, session_id, user_message, use_cache):
+        """Generate one streamed response, holding the session until it ends or is closed"""
+        async with self.sessions.async_session(session_id) as bot:
+            chunks = bot.get_response_stream_async(user_message, use_cache=use_cache)
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                # Let the turn clean up while the session is still held
+                await chunks.aclose()
+
+    async def _find_job(self, scope, job_id):
+        return await self.jobs.get_async(job_id, self._cookie_session_id(scope))
+
+    async def job_status(self, scope, receive, send, job_id):
+        job = await self._find_job(scope, job_id)
+        if job is None:
+            await self._send_json(send, {'error': 'Job not found'}, status=404)
+            return
+        await self._send_json(send, job.info(self._query_int(scope, 'since')))
+
+    async def job_stream(self, scope, receive, send, job_id):
+        job = await self._find_job(scope, job_id)
+        if job is None:
+            await self._send_json(send, {'error': 'Job not found'}, status=404)
+            return
+
+        # Resume after the last chunk the client saw
+        last_id = self._header(scope, b'last-event-id')
+        index = int(last_id) + 1 if last_id and last_id.isdigit() else self._query_int(scope, 'from')
+        headers = self._headers('text/event-stream')
+        headers += [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        # Stop reading (and touching the job) once the client has gone
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while not disconnected.done():
+                chunks, done = await job.wait_async(index, JOB_KEEPALIVE)
+                body = ""
+                for chunk in chunks:
+                    body += format_sse({'delta': chunk}, id=index)
+                    index += 1
+                if done:
+                    body += format_sse({'status': job.status, 'error': job.error}, event='done')
+                    await send({'type': 'http.response.body', 'body': body.encode('utf-8')})
+                    return
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': (body or ": keepalive\n\n").encode('utf-8')})
+        finally:
+            disconnected.cancel()
+
+    async def job_cancel(self, scope, receive, send, job_id):
+        job = await self.jobs.cancel_async(job_id, self._cookie_session_id(scope))
+        if job is None:
+            await self._send_json(send, {'error': 'Job not found'}, status=404)
+            return
+        await self._send_json(send, {'job_id': job.id, 'status': job.status})
+
+    async def job_result(self, scope, receive, send, job_id):
+        job = await self._find_job(scope, job_id)
+        if job is None:
+            await self._send_json(send, {'error': 'Job not found'}, status=404)
+            return
+        body, status = result_response(job)
+        await self._send_json(send, body, status=status)
+
+    async def search_prefetch(self, scope, receive, send):
+        if self.prefetcher is None:
+            await self._send_json(send, {'error': 'Search prefetch is off'}, status=404)
+            return
+        data = await self._read_json(receive)
+        client = self._cookie_session_id(scope) or (scope.get('client') or ('',))[0]
+        # Only submits to the prefetch threads, so it doesn't block the loop
+        await self._send_json(send, self.prefetcher.prefetch(client, data.get('text', '')), status=202)
+
+    async def clear_chat(self, scope, receive, send):
+        try:
+            session_id = self._session_id(scope)
+            async with self.sessions.async_session(session_id) as bot:
+                await asyncio.to_thread(bot.clear)
+            await self._send_json(send, {'success': True}, session_id=session_id)
+        except Exception as e:
+            await self._send_json(send, {'error': str(e)}, status=500)
+
+    async def metrics_page(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': self._headers('text/plain; version=0.0.4; charset=utf-8')})
+        await send({'type': 'http.response.body', 'body': metrics.render().encode('utf-8')})
+
+
+def run(app, host='0.0.0.0', port=5000):
+    """Serve an ASGI app with uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ Async mode needs an ASGI server - run: pip install uvicorn httpx")
+        raise SystemExit(1)
+    uvicorn.run(app, host=host, port=port, log_level='warning')
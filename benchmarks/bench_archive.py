@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: load time and disk size of a 1M-message history
+
+Compares the original memory file (one pretty-printed JSON document), the
+journal store's compact snapshot with every message in it, and the live
+file plus compressed archive segments (gzip, and zstd when zstandard is
+installed).  Also times streaming export and import of the whole history
+and reports their peak Python memory, which stays flat however long the
+history is.
+Usage: python benchmarks/bench_archive.py [messages] [live_messages]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_store import JournalMemoryStore
+from archive import ConversationArchive, export_conversation, import_conversation, _zstandard
+
+WORDS = "the quick brown fox jumps over a lazy dog while the chatbot answers questions about python".split()
+
+
+def message(i):
+    words = " ".join(WORDS[(i + j) % len(WORDS)] for j in range(8 + i % 40))
+    return {"role": "user" if i % 2 else "assistant", "content": f"message {i}: {words}"}
+
+
+def write_source(path, messages):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"role": "system", "content": "You are a benchmark bot."}) + '\n')
+        for i in range(messages):
+            f.write(json.dumps(message(i)) + '\n')
+
+
+def du(*paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def traced(func):
+    """Result, seconds and peak traced memory of func()"""
+    tracemalloc.start()
+    result, seconds = timed(func)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    live = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    mb = 2 ** 20
+
+    print(f"{messages} messages, live file keeps {live}\n")
+    print(f"{'Format':<34} {'disk MB':>8} {'load s':>8} {'loaded':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.jsonl")
+        write_source(source, messages)
+
+        # The original format: every message in one indented JSON document
+        original = os.path.join(tmp, "original.json")
+        with open(source, encoding='utf-8') as f:
+            history = [json.loads(line) for line in f]
+        with open(original, 'w', encoding='utf-8') as f:
+            json.dump({'conversations': history}, f, indent=2, ensure_ascii=False)
+        del history
+        loaded, seconds = timed(lambda: JournalMemoryStore(original, live_messages=0).load())
+        print(f"{'pretty JSON, whole history':<34} {du(original) / mb:>8.1f} {seconds:>8.2f} {len(loaded):>9}")
+
+        compact = os.path.join(tmp, "compact.json")
+        JournalMemoryStore(compact, live_messages=0).replace(loaded)
+        del loaded
+        loaded, seconds = timed(lambda: JournalMemoryStore(compact, live_messages=0).load())
+        print(f"{'compact JSON, whole history':<34} {du(compact) / mb:>8.1f} {seconds:>8.2f} {len(loaded):>9}")
+        del loaded
+
+        results = []
+        for compression in ['gzip', 'zstd'] if _zstandard() else ['gzip']:
+            memory_file = os.path.join(tmp, f"{compression}.json")
+            archive = ConversationArchive(memory_file, compression=compression)
+            # Imported straight into the archive, as rotation would have left it
+            _, import_seconds = timed(lambda: import_conversation(source, memory_file, live, compression))
+            loaded, seconds = timed(lambda: JournalMemoryStore(memory_file).load())
+            print(f"{f'live file + {compression} archive':<34} "
+                  f"{du(memory_file, memory_file + '.journal', archive.path) / mb:>8.1f} "
+                  f"{seconds:>8.3f} {len(loaded):>9}")
+            print(f"{'  of which archive':<34} {archive.size() / mb:>8.1f}")
+
+            output = os.path.join(tmp, f"export.jsonl{'.gz' if compression == 'gzip' else '.zst'}")
+            count, export_seconds = timed(lambda: export_conversation(memory_file, output))
+            # Peak memory in separate runs: tracing slows everything down
+            _, _, export_peak = traced(lambda: export_conversation(memory_file, output))
+            _, _, import_peak = traced(lambda: import_conversation(
+                source, os.path.join(tmp, f"traced-{compression}.json"), live, compression))
+            results.append((compression, import_seconds, import_peak, export_seconds, export_peak, count))
+
+        print(f"\n{'Streaming':<10} {'import s':>9} {'peak MB':>8} {'export s':>9} {'peak MB':>8} {'messages':>9}")
+        for compression, import_seconds, import_peak, export_seconds, export_peak, count in results:
+            print(f"{compression:<10} {import_seconds:>9.1f} {import_peak / mb:>8.1f} "
+                  f"{export_seconds:>9.1f} {export_peak / mb:>8.1f} {count:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Load test: thread-per-request Flask vs the asyncio (ASGI) serving mode
+
+Both apps run in-process against the offline FakeProvider with a fixed
+latency, so the numbers show how many conversations each serving model
+keeps in flight, not model speed.  The Flask app is driven through a
+bounded thread pool, like a WSGI server with that many worker threads.
+Usage: python benchmarks/bench_async_load.py [clients] [latency_seconds]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot
+from asgi_app import ASGIChatApp
+from providers import FakeProvider
+from session_store import SessionStore, new_session_id
+
+TURNS = 3
+WORKER_THREADS = 8
+
+
+def make_sessions(tmp, latency):
+    provider = FakeProvider(latency=latency)
+
+    def factory(session_id):
+        return chatbot.ChatBot(memory_file=os.path.join(tmp, f"{session_id}.json"), provider=provider)
+    return SessionStore(factory, max_sessions=10000)
+
+
+def summarize(name, latencies, wall):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<24} {len(latencies) / wall:>8.1f} req/s   p50 {statistics.median(latencies) * 1000:>7.1f} ms"
+          f"   p99 {p99 * 1000:>7.1f} ms")
+
+
+def run_flask(clients, latency, threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        chatbot.app.config['CHAT_SESSIONS'] = make_sessions(tmp, latency)
+        client = chatbot.app.test_client()
+        session_ids = [new_session_id() for _ in range(clients)]
+
+        def conversation(session_id):
+            # The first request has been waiting since the start of the run,
+            # so time spent queued for a worker thread counts as latency
+            latencies = []
+            ready = t0
+            for _ in range(TURNS):
+                response = client.post('/chat', json={'message': 'hello'},
+                                       headers={'Cookie': f'chat_session={session_id}'})
+                assert response.status_code == 200
+                done = time.perf_counter()
+                latencies.append(done - ready)
+                ready = done
+            return latencies
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = [l for per_client in pool.map(conversation, session_ids) for l in per_client]
+        summarize(f"flask, {threads} threads", latencies, time.perf_counter() - t0)
+
+
+async def asgi_request(app, session_id):
+    body = json.dumps({'message': 'hello'}).encode()
+    scope = {'type': 'http', 'method': 'POST', 'path': '/chat',
+             'headers': [(b'cookie', f'chat_session={session_id}'.encode())]}
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    t0 = time.perf_counter()
+    await app(scope, receive, send)
+    assert status == [200]
+    return time.perf_counter() - t0
+
+
+def run_asgi(clients, latency):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = ASGIChatApp(make_sessions(tmp, latency))
+        session_ids = [new_session_id() for _ in range(clients)]
+
+        async def client(session_id):
+            return [await asgi_request(app, session_id) for _ in range(TURNS)]
+
+        async def main():
+            results = await asyncio.gather(*(client(s) for s in session_ids))
+            return [latency for per_client in results for latency in per_client]
+
+        t0 = time.perf_counter()
+        latencies = asyncio.run(main())
+        summarize("asyncio (ASGI)", latencies, time.perf_counter() - t0)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    print(f"{clients} concurrent conversations x {TURNS} turns, fake model latency {latency * 1000:.0f} ms\n")
+    run_flask(clients, latency, WORKER_THREADS)
+    run_flask(clients, latency, clients)
+    run_asgi(clients, latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark: repeated /files on large directories
+
+Creates directories of 1k to 100k files and times ``/files`` through the
+command registry when every call lists the directory again (the old
+behaviour: a glob plus a stat per entry) and when the result is cached
+until the directory's mtime changes, which costs one stat however many
+files there are.
+Usage: python benchmarks/bench_commands.py [max_files] [runs]
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_engine import ChatEngine
+from providers import FakeProvider
+from history_compactor import HistoryCompactor
+from commands import COMMANDS
+
+
+def timed(func, runs):
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+
+def main():
+    max_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print(f"{'Files':>8} {'uncached ms':>12} {'cached ms':>10} {'speedup':>9}")
+    cwd = os.getcwd()
+    count = 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = ChatEngine(FakeProvider(), os.path.join(tmp, "memory.json"), "system",
+                            compactor=HistoryCompactor(threshold=0), recall=False)
+        while count <= max_files:
+            directory = os.path.join(tmp, f"files-{count}")
+            os.mkdir(directory)
+            for i in range(count):
+                open(os.path.join(directory, f"file{i:06d}.txt"), 'w').close()
+            # Old enough that its listing can be cached
+            past = time.time() - 60
+            os.utime(directory, (past, past))
+            os.chdir(directory)
+            try:
+                uncached = timed(lambda: (COMMANDS.clear_cache(), engine.expand_commands("/files")), runs)
+                engine.expand_commands("/files")
+                cached = timed(lambda: engine.expand_commands("/files"), runs * 50)
+            finally:
+                os.chdir(cwd)
+            print(f"{count:>8} {uncached * 1000:>12.2f} {cached * 1000:>10.4f} {uncached / cached:>8.0f}x")
+            count *= 10
+        engine.memory_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-turn save cost as conversation history grows
+
+Compares the legacy full JSON rewrite against JournalMemoryStore and
+SQLiteMemoryStore.
+Usage: python benchmarks/bench_memory.py [max_messages]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_store import JournalMemoryStore, SQLiteMemoryStore
+
+CHECKPOINTS = [1000, 10000, 50000, 100000]
+SAMPLES = 5
+
+
+def make_message(i):
+    """Build a realistic-looking chat message"""
+    role = "user" if i % 2 == 0 else "assistant"
+    return {"role": role, "content": f"Message {i}: " + "lorem ipsum dolor sit amet " * 8}
+
+
+def legacy_save(memory_file, history):
+    """The pre-journal save_memory: rewrite the whole file every turn"""
+    memory_data = {
+        'conversations': history,
+        'last_updated': datetime.now().isoformat()
+    }
+    with open(memory_file, 'w', encoding='utf-8') as f:
+        json.dump(memory_data, f, indent=2, ensure_ascii=False)
+
+
+def time_turns(save, history, start):
+    """Average seconds to save one user + assistant turn"""
+    elapsed = 0.0
+    for i in range(SAMPLES):
+        history.append(make_message(start + 2 * i))
+        history.append(make_message(start + 2 * i + 1))
+        t0 = time.perf_counter()
+        save(history)
+        elapsed += time.perf_counter() - t0
+    return elapsed / SAMPLES
+
+
+def main():
+    max_messages = int(sys.argv[1]) if len(sys.argv) > 1 else CHECKPOINTS[-1]
+    checkpoints = [c for c in CHECKPOINTS if c <= max_messages]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, "legacy_memory.json")
+        store = JournalMemoryStore(os.path.join(tmp, "journal_memory.json"))
+        db_store = SQLiteMemoryStore(os.path.join(tmp, "memory.db"), "bench")
+
+        history = []
+        store.save(history)
+
+        print(f"{'messages':>10} {'legacy ms/turn':>16} {'journal ms/turn':>16} "
+              f"{'max ms (compact)':>17} {'sqlite ms/turn':>15}")
+        for checkpoint in checkpoints:
+            # Grow the history to the checkpoint, saving every turn as the bot does
+            worst = 0.0
+            while len(history) < checkpoint:
+                history.append(make_message(len(history)))
+                history.append(make_message(len(history)))
+                t0 = time.perf_counter()
+                store.save(history)
+                worst = max(worst, time.perf_counter() - t0)
+                db_store.save(history)
+
+            legacy_history = list(history)
+            legacy = time_turns(lambda h: legacy_save(legacy_file, h), legacy_history, len(history))
+            journal = time_turns(store.save, history, len(history))
+            sqlite = time_turns(db_store.save, history, len(history))
+            # Keep the journal in step with the messages added for SQLite
+            store.save(history)
+            print(f"{len(history):>10} {legacy * 1000:>16.3f} {journal * 1000:>16.3f} "
+                  f"{worst * 1000:>17.3f} {sqlite * 1000:>15.3f}")
+
+        # Startup cost of replaying snapshot + journal
+        t0 = time.perf_counter()
+        loaded = JournalMemoryStore(store.memory_file).load()
+        print(f"\nJournal: replayed {len(loaded)} messages in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+        t0 = time.perf_counter()
+        tail = SQLiteMemoryStore(db_store.db_path, "bench").load()
+        print(f"SQLite: loaded newest {len(tail)} messages in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        db_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark: time from Enter to search results, with and without prefetch
+
+Replays users typing ``/search`` messages against the local stub search
+server.  Each user pauses once mid-query (the page prefetches the partial
+text, which is then superseded), finishes typing, pauses again (the full
+query is prefetched) and presses Enter ``think`` seconds later.  Reports
+the median and p95 wait after Enter, and how many prefetches a search used
+(hits) against how many were never used (wasted).
+Usage: python benchmarks/bench_prefetch.py [latency_seconds] [think_seconds] [searches]
+"""
+import os
+import sys
+import time
+import statistics
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_search import SearchCache, fetch_results
+from prefetch import SearchPrefetcher
+from stub_search_server import StubSearchServer
+
+TOPICS = ["python asyncio tutorial", "rust borrow checker", "sqlite wal mode", "flask streaming",
+          "numpy memmap", "gzip vs zstd", "http keep alive", "lru cache eviction"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(fetch, searches, think, prefetch):
+    cache = SearchCache()
+    prefetcher = SearchPrefetcher(cache, fetch)
+    waits = []
+    for i in range(searches):
+        query = f"{TOPICS[i % len(TOPICS)]} {i}"
+        if prefetch:
+            prefetcher.prefetch("user", "/search " + query[:len(query) // 2])
+            # Typing the rest of the query
+            time.sleep(think)
+            prefetcher.prefetch("user", "/search " + query)
+        time.sleep(think)
+        started = time.perf_counter()
+        cache.get_or_fetch(query, fetch)
+        waits.append(time.perf_counter() - started)
+    prefetcher.close()
+    return waits, prefetcher.stats(), cache.prefetch_stats()
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.3
+    think = float(sys.argv[2]) if len(sys.argv) > 2 else 0.15
+    searches = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+
+    print(f"search latency {latency * 1000:.0f}ms, Enter {think * 1000:.0f}ms after the last pause, "
+          f"{searches} searches\n")
+    print(f"{'Mode':<12} {'median ms':>10} {'p95 ms':>8} {'hits':>6} {'wasted':>7} {'cancelled':>10}")
+    with StubSearchServer(latency=latency, filler=200) as server:
+        fetch = partial(fetch_results, search_url=server.url)
+        fetch("warm up")
+        for mode, prefetch in (("no prefetch", False), ("prefetch", True)):
+            waits, stats, usage = run(fetch, searches, think, prefetch)
+            wasted = usage['wasted'] + usage['unused']
+            print(f"{mode:<12} {statistics.median(waits) * 1000:>10.1f} {percentile(waits, 0.95) * 1000:>8.1f} "
+                  f"{usage['hits']:>6} {wasted:>7} {stats['cancelled']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: time and peak memory of /read on a large generated log file
+
+Compares the original whole-file read against the bounded readers in
+file_reader (head, line range, byte range, tail, grep and the sections
+picked for chunked summarization).
+Usage: python benchmarks/bench_read_large.py [size_mb]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_reader import read_head, read_lines, read_bytes, read_tail, grep_file, summary_chunks
+
+DEFAULT_SIZE_MB = 1024
+
+
+def generate_log(path, size_mb):
+    """Write a log file of roughly ``size_mb`` MB with a rare ERROR line"""
+    target = size_mb * 1024 * 1024
+    block = "".join(f"2024-01-01 12:00:{i % 60:02d} INFO request {i} served in {i % 97} ms\n"
+                    for i in range(20000)).encode()
+    written = 0
+    with open(path, 'wb') as f:
+        while written < target:
+            f.write(block)
+            written += len(block)
+        f.write(b"2024-01-01 12:01:00 ERROR disk full\n")
+    return written
+
+
+def legacy_read(path):
+    """The original read_file: load everything, keep 2000 characters"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return content[:2000]
+
+
+def measure(func):
+    """Seconds and peak Python-allocated MB for one call"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.log")
+        print(f"Generating {size_mb} MB log file...")
+        size = generate_log(path, size_mb)
+        lines = size // 50
+
+        cases = [
+            ("legacy f.read()[:2000]", lambda: legacy_read(path)),
+            ("head (first bytes)", lambda: read_head(path)),
+            ("lines 100-200", lambda: read_lines(path, 100, 200)),
+            (f"lines {lines // 2}-{lines // 2 + 100}", lambda: read_lines(path, lines // 2, lines // 2 + 100)),
+            ("bytes (middle 4 KB)", lambda: read_bytes(path, size // 2, size // 2 + 4096)),
+            ("tail 50", lambda: read_tail(path, 50)),
+            ("grep ERROR (full scan)", lambda: grep_file(path, "ERROR")),
+            ("summary sections", lambda: summary_chunks(path)),
+        ]
+
+        print(f"{'operation':>28} {'seconds':>9} {'peak MB':>9}")
+        for name, func in cases:
+            elapsed, peak = measure(func)
+            print(f"{name:>28} {elapsed:>9.3f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark: long-term recall search cost and prompt size
+
+Times top-k search over memory-mapped float32 indexes of 10k to 1M turns
+(cold open plus first search, then warm searches), the cost of embedding
+and appending one turn, and compares the prompt a long conversation sends
+when the whole history fits the token budget against a small window plus
+recalled turns: the recalled prompt is a fraction of the size and still
+carries the one early fact the question is about.
+Usage: python benchmarks/bench_recall.py [max_rows] [dim] [turns]
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from chat_engine import ChatEngine
+from providers import FakeProvider
+from prompt_builder import PromptBuilder
+from history_compactor import HistoryCompactor
+from recall import HashEmbedder, VectorIndex, ConversationRecall
+
+TOPICS = ["weather", "python", "trains", "chess", "cooking", "music", "gardening", "football",
+          "astronomy", "taxes", "painting", "hiking", "databases", "poetry", "coffee", "sailing"]
+
+
+def build_index(path, rows, dim, chunk=100000):
+    index = VectorIndex(path, dim)
+    rng = np.random.default_rng(rows)
+    for start in range(0, rows, chunk):
+        count = min(chunk, rows - start)
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(vectors, np.arange(start, start + count, dtype=np.uint32),
+                  [{'user': f"turn {i}", 'assistant': ""} for i in range(start, start + count)])
+
+
+def bench_search(max_rows, dim, runs=20):
+    print(f"{'Rows':>9} {'index MB':>9} {'cold ms':>8} {'search p50 ms':>14} {'p99 ms':>7}")
+    rows = 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        while rows <= max_rows:
+            path = os.path.join(tmp, f"index-{rows}")
+            build_index(path, rows, dim)
+            query = np.random.default_rng(0).standard_normal(dim).astype(np.float32)
+
+            started = time.perf_counter()
+            index = VectorIndex(path, dim)
+            index.search(query, 3)
+            cold = time.perf_counter() - started
+            latencies = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                index.search(query, 3, exclude_keys={1, 2, 3})
+                latencies.append(time.perf_counter() - started)
+            size = os.path.getsize(os.path.join(path, 'vectors.f32')) / 2 ** 20
+            latencies.sort()
+            print(f"{rows:>9} {size:>9.0f} {cold * 1000:>8.1f} {statistics.median(latencies) * 1000:>14.2f} "
+                  f"{latencies[int(len(latencies) * 0.99)] * 1000:>7.2f}")
+            index.clear()
+            rows *= 10
+
+
+def conversation(engine, turns):
+    engine.get_response("My cat is named Whiskers and she only eats salmon on Sundays")
+    for i in range(turns - 1):
+        topic = TOPICS[i % len(TOPICS)]
+        engine.get_response(f"Question {i} about {topic}: " + f"some detail on {topic} " * 20)
+
+
+def bench_prompt(turns, dim):
+    question = "What does my cat Whiskers eat on Sundays?"
+    print(f"\nPrompt for a question about turn 1 of {turns}:")
+    print(f"{'Prompt':<28} {'tokens':>8} {'build ms':>9} {'has fact':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, budget, use_recall in [("whole history", 10 ** 9, False),
+                                          ("8000-token window", 8000, False),
+                                          ("1000-token window + recall", 1000, True)]:
+            memory_file = os.path.join(tmp, f"{budget}.json")
+            recall = ConversationRecall(os.path.join(tmp, f"{budget}.recall"), embedder=HashEmbedder(dim)) \
+                if use_recall else False
+            engine = ChatEngine(FakeProvider(), memory_file, "You are a benchmark bot.",
+                                compactor=HistoryCompactor(threshold=0), recall=recall)
+            engine.prompt_builder = PromptBuilder(token_budget=budget)
+            conversation(engine, turns)
+            engine.add_message("user", question)
+            started = time.perf_counter()
+            prompt = engine.build_prompt()
+            elapsed = time.perf_counter() - started
+            print(f"{label:<28} {engine.prompt_builder.last_token_count:>8} {elapsed * 1000:>9.2f} "
+                  f"{'yes' if 'salmon' in prompt else 'no':>9}")
+            engine.memory_store.close()
+
+        # The last answered turn, indexed again
+        history = engine.conversation_history[:-1]
+        started = time.perf_counter()
+        for _ in range(100):
+            recall.remember(history)
+        print(f"\nEmbed and append one turn: {(time.perf_counter() - started) * 10:.2f} ms")
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    turns = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    bench_search(max_rows, dim)
+    bench_prompt(turns, dim)
+
+
+if __name__ == "__main__":
+    main()
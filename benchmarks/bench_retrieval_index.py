@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: building, refreshing and querying the /ask retrieval index
+
+Generates a tree of small text files, then times a full index build, a
+no-op refresh, an incremental refresh after touching 1% of the files and
+BM25 queries, and compares the prompt size of /ask with pasting the
+matching files whole.
+Usage: python benchmarks/bench_retrieval_index.py [file_count]
+"""
+import os
+import sys
+import time
+import random
+import itertools
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval_index import RetrievalIndex, ask_prompt
+
+DEFAULT_FILES = 100000
+FILES_PER_DIR = 500
+TOPIC_WORDS = ("cache session memory prompt search index token stream provider model server request "
+               "latency budget history journal sqlite retrieval chunk query answer file directory").split()
+# Zipf-like vocabulary: a few very common words and a long tail of rare ones
+VOCABULARY = ["the", "a", "to", "of", "and", "is", "in"] + TOPIC_WORDS + [f"term{i}" for i in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(VOCABULARY))))
+QUERIES = ["how is the prompt token budget enforced", "sqlite journal memory", "stream provider latency"]
+
+
+def generate_tree(root, count, rng):
+    """Write ``count`` small markdown/python files spread over subdirectories"""
+    for i in range(count):
+        directory = os.path.join(root, f"dir{i // FILES_PER_DIR:04d}")
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(directory)
+        ext = '.md' if i % 2 else '.py'
+        lines = [" ".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=10)) + f" doc{i}" for _ in range(rng.randint(10, 60))]
+        with open(os.path.join(directory, f"file{i}{ext}"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def timed(func):
+    t0 = time.perf_counter()
+    result = func()
+    return time.perf_counter() - t0, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILES
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {count} files...")
+        generate_tree(tmp, count, rng)
+        index = RetrievalIndex(root=tmp)
+
+        elapsed, stats = timed(index.refresh)
+        print(f"Full build:          {elapsed:8.2f} s  {stats}")
+        print(f"Index size:          {os.path.getsize(index.db_path) / 1e6:8.1f} MB")
+
+        elapsed, stats = timed(index.refresh)
+        print(f"No-op refresh:       {elapsed:8.2f} s  {stats}")
+
+        # Touch 1% of the files
+        for i in rng.sample(range(count), max(1, count // 100)):
+            path = os.path.join(tmp, f"dir{i // FILES_PER_DIR:04d}", f"file{i}{'.md' if i % 2 else '.py'}")
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write("appended retrieval line\n")
+        elapsed, stats = timed(index.refresh)
+        print(f"Refresh after 1%:    {elapsed:8.2f} s  {stats}")
+
+        for query in QUERIES:
+            elapsed, results = timed(lambda: index.search(query))
+            prompt = ask_prompt(query, results)
+            whole = 0
+            for path in {r['path'] for r in results}:
+                whole += os.path.getsize(os.path.join(tmp, path))
+            print(f"Query {query!r}: {elapsed * 1000:7.1f} ms, "
+                  f"/ask prompt {len(prompt)} chars vs {whole} chars of whole files")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
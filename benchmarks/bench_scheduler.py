@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: a burst of concurrent chat requests against a rate-limited backend
+
+The fake backend accepts at most ``limit`` calls in flight and answers any
+more with a 429-style error, like a hosted model API.  A burst of clients
+calls it directly (every extra call fails), through the scheduler (calls
+queue instead), and through the scheduler with micro-batching; a mix of
+short and long prompts shows the short-prompt priority.
+Usage: python benchmarks/bench_scheduler.py [clients] [limit] [latency_s]
+"""
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import FakeProvider
+from scheduler import Scheduler, ScheduledProvider
+
+
+class RateLimitedBackend(FakeProvider):
+    """FakeProvider that rejects calls beyond ``limit`` in flight"""
+
+    def __init__(self, limit, latency, batching):
+        super().__init__(latency=latency, token_rate=20000)
+        self.limit = limit
+        self.supports_batching = batching
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def _call(self, func, *args):
+        with self.lock:
+            if self.running >= self.limit:
+                raise RuntimeError("429 Too Many Requests")
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def generate(self, prompt):
+        return self._call(super().generate, prompt)
+
+    def generate_batch(self, prompts):
+        return self._call(super().generate_batch, prompts)
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+def burst(provider, prompts):
+    """Fire all prompts at once; returns (latencies by prompt kind, errors, wall seconds)"""
+    def call(item):
+        kind, prompt = item
+        started = time.perf_counter()
+        try:
+            provider.generate(prompt)
+            return kind, time.perf_counter() - started, None
+        except Exception as e:
+            return kind, time.perf_counter() - started, e
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(prompts)) as pool:
+        outcomes = list(pool.map(call, prompts))
+    wall = time.perf_counter() - started
+    latencies = {}
+    for kind, seconds, error in outcomes:
+        if error is None:
+            latencies.setdefault(kind, []).append(seconds)
+    return latencies, sum(1 for *_, error in outcomes if error is not None), wall
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+
+    # One in four clients sends a long prompt (~4000 tokens)
+    prompts = [("long", "x" * 16000 + f"\nUser: long {i}") if i % 4 == 0 else ("short", f"User: short {i}")
+               for i in range(clients)]
+
+    setups = [
+        ("direct (no scheduler)", lambda backend: backend, False),
+        ("scheduler, FIFO", lambda backend: ScheduledProvider(
+            backend, Scheduler(concurrency=limit, queue_size=clients, token_defer=0, batch_size=1)), False),
+        ("scheduler, short first", lambda backend: ScheduledProvider(
+            backend, Scheduler(concurrency=limit, queue_size=clients, batch_size=1)), False),
+        ("scheduler + batching", lambda backend: ScheduledProvider(
+            backend, Scheduler(concurrency=limit, queue_size=clients, batch_size=8)), True),
+    ]
+
+    print(f"{clients} concurrent requests, backend allows {limit} in flight, {latency * 1000:.0f} ms per call\n")
+    print(f"{'Setup':<24} {'ok':>4} {'errors':>6} {'wall s':>7} {'short p50':>10} {'short p99':>10}"
+          f" {'long p50':>9} {'calls':>6}")
+    for label, wrap, batching in setups:
+        backend = RateLimitedBackend(limit, latency, batching)
+        latencies, errors, wall = burst(wrap(backend), prompts)
+        short, long_ = latencies.get("short", []), latencies.get("long", [])
+        print(f"{label:<24} {len(short) + len(long_):>4} {errors:>6} {wall:>7.2f} "
+              f"{percentile(short, 0.5) * 1000:>8.0f}ms {percentile(short, 0.99) * 1000:>8.0f}ms "
+              f"{percentile(long_, 0.5) * 1000:>7.0f}ms {backend.calls:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark: web search latency with and without the result cache
+
+Runs against the local stub search server, so no network access is needed.
+Usage: python benchmarks/bench_search_cache.py [latency_seconds]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_search import SearchCache, fetch_results
+from stub_search_server import StubSearchServer
+
+CONCURRENCY = 16
+REPEATS = 20
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+
+    with StubSearchServer(latency=latency, filler=200) as server:
+        fetch = partial(fetch_results, search_url=server.url)
+
+        # Uncached: every search goes to the server
+        t0 = time.perf_counter()
+        for _ in range(REPEATS):
+            fetch("python news")
+        uncached = (time.perf_counter() - t0) / REPEATS
+
+        # Cached: first search fetches, the rest are hits
+        cache = SearchCache()
+        t0 = time.perf_counter()
+        for _ in range(REPEATS):
+            cache.get_or_fetch("python news", fetch)
+        cached = (time.perf_counter() - t0) / REPEATS
+
+        # Concurrent identical searches share one fetch
+        cache = SearchCache()
+        served_before = server.request_count
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            t0 = time.perf_counter()
+            list(pool.map(lambda _: cache.get_or_fetch("breaking news", fetch), range(CONCURRENCY)))
+            burst = time.perf_counter() - t0
+        burst_requests = server.request_count - served_before
+
+    print(f"Stub latency:                 {latency * 1000:.0f} ms")
+    print(f"Uncached search:              {uncached * 1000:.2f} ms/query")
+    print(f"Cached search ({REPEATS} repeats):   {cached * 1000:.2f} ms/query")
+    print(f"{CONCURRENCY} concurrent identical:      {burst * 1000:.2f} ms wall, "
+          f"{burst_requests} upstream request(s)")
+    print(f"Cache stats: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
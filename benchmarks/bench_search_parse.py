@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark: parse time of search result pages
+
+Compares the original BeautifulSoup/html.parser extraction with the lxml
+XPath parser in web_search.parse_results, on the saved pages in
+benchmarks/fixtures/.
+Usage: python benchmarks/bench_search_parse.py [iterations]
+"""
+import os
+import sys
+import glob
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from web_search import parse_results
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def legacy_parse(page):
+    """The original extraction: full soup tree with the pure-Python parser"""
+    soup = BeautifulSoup(page, 'html.parser')
+    results = []
+    for result in soup.find_all('div', class_='result')[:5]:
+        title_elem = result.find('a', class_='result__a')
+        snippet_elem = result.find('a', class_='result__snippet')
+        if title_elem and snippet_elem:
+            results.append({
+                'title': title_elem.get_text().strip(),
+                'snippet': snippet_elem.get_text().strip(),
+                'url': title_elem.get('href', '')
+            })
+    return results
+
+
+def time_parse(parse, page, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        parse(page)
+    return (time.perf_counter() - t0) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"{'fixture':<28} {'size KB':>8} {'html.parser ms':>15} {'lxml ms':>9} {'speedup':>8}")
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "results_*.html"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            page = f.read()
+        assert parse_results(page) == legacy_parse(page), f"parsers disagree on {path}"
+        legacy = time_parse(legacy_parse, page, iterations)
+        fast = time_parse(parse_results, page, iterations)
+        print(f"{os.path.basename(path):<28} {len(page) / 1024:>8.1f} {legacy * 1000:>15.2f} "
+              f"{fast * 1000:>9.2f} {legacy / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
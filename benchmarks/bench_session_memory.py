@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: resident memory of many loaded conversations
+
+Loads the same conversation (as if from separate memory files) into many
+sessions, each with its prompt builder warmed up by one prompt, and
+reports the RSS growth per 10k sessions:
+
+- dicts:   the previous representation, JSON dicts plus a prompt builder
+           that cached every message's rendered text
+- compact: Message records with interned roles, the shared system prompt
+           and cold bodies compressed, and the token-only prompt cache
+
+Each representation is measured in a fresh interpreter (Linux /proc RSS).
+Usage: python benchmarks/bench_session_memory.py [sessions] [messages]
+"""
+import os
+import sys
+import json
+import random
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_builder import PromptBuilder, ROLE_LABELS, estimate_tokens
+from messages import Message, compress_cold
+
+SYSTEM_PROMPT = ("You are an intelligent and helpful AI assistant. You have access to web search, "
+                 "file reading and conversation memory. " * 6)
+
+WORDS = ("the model answer search file memory prompt token python server request cache index query "
+         "result session history summary user question detail example error fix performance data "
+         "value function class module test benchmark latency stream batch window budget").split()
+
+
+def conversation(messages, seed=0):
+    """JSON text of a memory file: system prompt plus alternating turns"""
+    rng = random.Random(seed)
+    history = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for i in range(messages - 1):
+        if i % 2 == 0:
+            history.append({"role": "user", "content": " ".join(rng.choices(WORDS, k=15)) + "?"})
+        else:
+            history.append({"role": "assistant", "content": " ".join(rng.choices(WORDS, k=rng.randint(60, 250)))})
+    return json.dumps({"conversations": history})
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def load_dicts(text):
+    history = json.loads(text)["conversations"]
+    # What PromptBuilder used to keep: (message, rendered text, token estimate) per message
+    segments = []
+    for msg in history:
+        rendered = f"{ROLE_LABELS.get(msg['role'], 'Assistant')}: {msg['content']}"
+        segments.append((msg, rendered, estimate_tokens(rendered)))
+    return history, segments
+
+
+def load_compact(text):
+    history = [Message.from_dict(m, (SYSTEM_PROMPT,)) for m in json.loads(text)["conversations"]]
+    compress_cold(history)
+    builder = PromptBuilder()
+    builder.build(history)
+    return history, builder
+
+
+def measure(mode, sessions, messages):
+    """Run in a child process: RSS growth from loading ``sessions`` conversations"""
+    text = conversation(messages)
+    load = load_dicts if mode == 'dicts' else load_compact
+    before = rss_bytes()
+    held = [load(text) for _ in range(sessions)]
+    grown = rss_bytes() - before
+    print(json.dumps({'bytes': grown, 'sessions': len(held)}))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    print(f"{sessions} sessions x {messages} messages "
+          f"({len(conversation(messages)) / 1024:.1f} KB of JSON each)\n")
+    results = {}
+    for mode in ('dicts', 'compact'):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode,
+                                 str(sessions), str(messages)],
+                                capture_output=True, text=True, check=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])['bytes']
+        per_10k = results[mode] / sessions * 10000
+        print(f"{mode:<8} {per_10k / 2**20:>9.1f} MB per 10k sessions"
+              f" {results[mode] / (sessions * messages):>8.0f} bytes/message")
+    print(f"\ncompact uses {results['compact'] / results['dicts']:.0%} of the dict representation")
+
+
+if __name__ == "__main__":
+    main()
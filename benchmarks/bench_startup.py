@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold-start cost of the chatbot entry points
+
+Runs each entry point in a fresh interpreter under ``python -X importtime``
+and compares terminal mode and web mode against the eager imports
+chatbot.py used to do at load (Flask, requests, lxml, asyncio, webbrowser
+and the Gemini SDK), then times constructing a chatbot over a large memory
+file, which no longer parses the history until it is first used.
+Usage: python benchmarks/bench_startup.py [runs] [messages]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_engine import ChatEngine
+from providers import FakeProvider
+from history_compactor import HistoryCompactor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_MODULES = ['asyncio', 'requests', 'lxml.html', 'webbrowser', 'web_app', 'asgi_app',
+                 'session_store', 'google.generativeai']
+
+SCENARIOS = [
+    ("eager imports (before)", "import chatbot, " + ", ".join(
+        m for m in EAGER_MODULES if importlib.util.find_spec(m.split('.')[0]))),
+    ("web mode", "import chatbot; chatbot.app"),
+    ("terminal mode", "import chatbot"),
+]
+
+
+def import_profile(code):
+    """Wall time, total import time (us) and chatbot's direct imports (us) of a fresh interpreter"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    total, children, pending = 0, {}, {}
+    # Children are logged before their parent, one indent level deeper
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            # Top-level entry: its cumulative time covers everything it pulled in
+            total += int(cumulative_us)
+            if name == 'chatbot':
+                children = pending
+            pending = {}
+        elif depth == 1:
+            pending[name] = int(cumulative_us)
+    return wall, total, children
+
+
+def median_profile(code, runs):
+    walls, totals, children = [], [], {}
+    for _ in range(runs):
+        wall, total, children = import_profile(code)
+        walls.append(wall)
+        totals.append(total)
+    return statistics.median(walls), statistics.median(totals), children
+
+
+def bench_imports(runs):
+    _, base_total, _ = median_profile("pass", runs)
+    print(f"{'Entry point':<26} {'process ms':>11} {'imports ms':>11}")
+    for label, code in SCENARIOS:
+        wall, total, children = median_profile(code, runs)
+        print(f"{label:<26} {wall * 1000:>11.1f} {(total - base_total) / 1000:>11.1f}")
+
+    print("\nHeaviest imports of chatbot.py in terminal mode:")
+    for name, us in sorted(children.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {name:<24} {us / 1000:>7.1f} ms")
+
+
+def bench_memory_load(messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        with open(memory_file, 'w', encoding='utf-8') as f:
+            json.dump({'conversations': [{"role": "user" if i % 2 else "assistant",
+                                          "content": f"message {i} " + "lorem ipsum " * 20}
+                                         for i in range(messages)]}, f)
+
+        started = time.perf_counter()
+        engine = ChatEngine(FakeProvider(), memory_file, "system", compactor=HistoryCompactor(threshold=0))
+        constructed = time.perf_counter() - started
+        started = time.perf_counter()
+        engine.conversation_history
+        loaded = time.perf_counter() - started
+        engine.memory_store.close()
+
+    print(f"\nChatbot over a {messages}-message memory file:")
+    print(f"  construct (before first message) {constructed * 1000:>8.1f} ms")
+    print(f"  history loaded on first use      {loaded * 1000:>8.1f} ms")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    bench_imports(runs)
+    bench_memory_load(messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /chat throughput of the production server by worker count
+
+Starts the gunicorn server from serving.py with 1, 2, 4 ... worker
+processes around the offline fake model, with conversations, response
+cache and jobs in shared SQLite files, and drives it with concurrent
+clients, each its own browser session.  Requests/sec should grow with the
+worker count up to the number of CPU cores, since one process is bound by
+its interpreter lock.
+Usage: python benchmarks/bench_workers.py [max_workers] [clients] [seconds] [model_latency_s]
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import tempfile
+import subprocess
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_wsgi_app():
+    """App factory the workers load: gunicorn 'bench_workers:create_wsgi_app()'"""
+    from providers import FakeProvider
+    from chat_engine import ChatEngine
+    from history_compactor import HistoryCompactor
+    from session_store import SessionStore, session_memory_file
+    from scheduler import scheduled
+    from web_app import create_app as create_web_app
+
+    provider = scheduled(FakeProvider(latency=float(os.getenv('BENCH_MODEL_LATENCY', '0'))))
+    return create_web_app(SessionStore(lambda session_id: ChatEngine(
+        provider, session_memory_file(session_id), "You are a benchmark bot.",
+        compactor=HistoryCompactor(threshold=0))))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{url}/metrics", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def load(url, clients, seconds):
+    """Each client posts messages in its own session until time is up; returns latencies and wall time"""
+    import requests
+
+    deadline = time.perf_counter() + seconds
+
+    def client(index):
+        latencies = []
+        with requests.Session() as http:
+            i = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = http.post(f"{url}/chat", json={'message': f"client {index} message {i} " + "words " * 30})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                i += 1
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        latencies = [l for per_client in pool.map(client, range(clients)) for l in per_client]
+    return latencies, time.perf_counter() - started
+
+
+def run(workers, clients, seconds, model_latency, tmp):
+    from serving import server_command
+
+    port = free_port()
+    command, env = server_command('bench_workers', workers, '127.0.0.1', port)
+    env['PYTHONPATH'] = os.pathsep.join([BENCH_DIR, env['PYTHONPATH']])
+    env.update({
+        'CHAT_SESSION_DIR': os.path.join(tmp, f"sessions-{workers}"),
+        'MEMORY_DB': os.path.join(tmp, f"memory-{workers}.db"),
+        'RESPONSE_CACHE_DB': os.path.join(tmp, f"cache-{workers}.db"),
+        'JOB_DB': os.path.join(tmp, f"jobs-{workers}.db"),
+        'BENCH_MODEL_LATENCY': str(model_latency),
+        'METRICS': '0',
+    })
+    server = subprocess.Popen(command, env=env, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(url)
+        load(url, clients, min(1.0, seconds))  # warm up every worker
+        return load(url, clients, seconds)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    model_latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+
+    print(f"{clients} clients for {seconds:.0f}s per run, model latency {model_latency * 1000:.0f} ms, "
+          f"{os.cpu_count()} CPUs\n")
+    print(f"{'Workers':>7} {'req/s':>8} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in counts:
+            latencies, wall = run(workers, clients, seconds, model_latency, tmp)
+            rps = len(latencies) / wall
+            baseline = baseline or rps
+            p99 = sorted(latencies)[int(len(latencies) * 0.99)]
+            print(f"{workers:>7} {rps:>8.1f} {rps / baseline:>7.2f}x "
+                  f"{statistics.median(latencies) * 1000:>8.1f} {p99 * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite: turn latency, concurrent load and history scaling
+
+Everything runs locally: FakeProvider stands in for the model (fixed
+latency plus a token rate) and StubSearchServer for DuckDuckGo, so runs are
+repeatable and cost nothing.  Results are written as JSON; compare them
+with an earlier run to catch regressions between versions.
+
+Usage:
+    python benchmarks/run_suite.py [--quick] [--output results.json]
+    python benchmarks/run_suite.py --compare baseline.json [--threshold 0.2] [--min-delta 1.0]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import requests
+from werkzeug.serving import make_server
+
+import web_search
+from web_app import create_app
+from chat_engine import ChatEngine
+from providers import FakeProvider
+from session_store import SessionStore
+from history_compactor import HistoryCompactor
+from stub_search_server import StubSearchServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYSTEM_PROMPT = "You are a helpful benchmark assistant."
+
+CONFIGS = {
+    'full': {
+        'model_latency': 0.05,
+        'token_rate': 2000,
+        'search_latency': 0.05,
+        'turns': 50,
+        'clients': 32,
+        'requests_per_client': 10,
+        'history_sizes': [100, 1000, 10000, 50000],
+    },
+    'quick': {
+        'model_latency': 0.02,
+        'token_rate': 5000,
+        'search_latency': 0.02,
+        'turns': 15,
+        'clients': 8,
+        'requests_per_client': 4,
+        'history_sizes': [100, 1000, 5000],
+    },
+}
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds"""
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'p50_ms': pick(0.5),
+        'p90_ms': pick(0.9),
+        'p99_ms': pick(0.99),
+    }
+
+
+def make_engine(memory_file, provider):
+    # No background compaction, so runs measure the request path only
+    return ChatEngine(provider, memory_file, SYSTEM_PROMPT, compactor=HistoryCompactor(threshold=0))
+
+
+def timed(func):
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def bench_single_turn(cfg, tmp):
+    """One conversation, one turn at a time: chat, first streamed chunk, search"""
+    provider = FakeProvider(latency=cfg['model_latency'], token_rate=cfg['token_rate'])
+    engine = make_engine(os.path.join(tmp, "single.json"), provider)
+    results = {}
+
+    results['chat'] = summarize([timed(lambda: engine.get_response(f"question {i} " + "words " * 20))
+                                 for i in range(cfg['turns'])])
+
+    first_chunk = []
+    for i in range(cfg['turns']):
+        t0 = time.perf_counter()
+        stream = engine.get_response_stream(f"stream {i} " + "words " * 20)
+        next(stream)
+        first_chunk.append(time.perf_counter() - t0)
+        for _ in stream:
+            pass
+    results['stream_first_chunk'] = summarize(first_chunk)
+
+    with StubSearchServer(latency=cfg['search_latency'], filler=300) as server:
+        search_url = web_search.SEARCH_URL
+        web_search.SEARCH_URL = server.url
+        web_search.search_cache.clear()
+        try:
+            # Distinct queries miss the cache: network + parse + model
+            results['search_uncached'] = summarize([timed(lambda: engine.get_response(f"/search topic {i}"))
+                                                    for i in range(cfg['turns'])])
+            results['search_cached'] = summarize([timed(lambda: engine.get_response(f"/search topic {i}"))
+                                                  for i in range(cfg['turns'])])
+            results['search_fanout_3'] = summarize(
+                [timed(lambda: engine.get_response(f"/search a{i} | b{i} | c{i}")) for i in range(cfg['turns'])])
+        finally:
+            web_search.SEARCH_URL = search_url
+    engine.memory_store.close()
+    return results
+
+
+def bench_flask_concurrency(cfg, tmp):
+    """p50/p99 of /chat over real HTTP with N concurrent clients"""
+    provider = FakeProvider(latency=cfg['model_latency'], token_rate=cfg['token_rate'])
+    sessions = SessionStore(lambda session_id: make_engine(os.path.join(tmp, f"{session_id}.json"), provider),
+                            max_sessions=10000)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, create_app(sessions), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    def client(index):
+        # One browser: its own cookie jar, so its own conversation
+        latencies = []
+        with requests.Session() as http:
+            for i in range(cfg['requests_per_client']):
+                t0 = time.perf_counter()
+                response = http.post(f"{url}/chat", json={'message': f"client {index} message {i}"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+        return latencies
+
+    results = {}
+    try:
+        for clients in sorted({1, cfg['clients']}):
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                latencies = [l for per_client in pool.map(client, range(clients)) for l in per_client]
+            wall = time.perf_counter() - t0
+            stats = summarize(latencies)
+            stats['throughput_rps'] = round(len(latencies) / wall, 2)
+            results[f'clients_{clients}'] = stats
+    finally:
+        server.shutdown()
+    return results
+
+
+def bench_history_scaling(cfg, tmp):
+    """Startup, save, prompt building and a full turn as the history grows"""
+    rng = random.Random(0)
+    results = {}
+    for size in cfg['history_sizes']:
+        memory_file = os.path.join(tmp, f"history_{size}.json")
+        engine = make_engine(memory_file, FakeProvider())
+        for i in range(size):
+            role = "user" if i % 2 == 0 else "assistant"
+            engine.add_message(role, f"message {i} " + " ".join(str(rng.random()) for _ in range(12)))
+        engine.save_memory()
+        engine.memory_store.close()
+
+        startup = timed(lambda: make_engine(memory_file, FakeProvider()).memory_store.close())
+        engine = make_engine(memory_file, FakeProvider())
+        saves, prompts, turns = [], [], []
+        for i in range(20):
+            engine.add_message("user", f"extra {i}")
+            engine.add_message("assistant", f"reply {i}")
+            saves.append(timed(engine.save_memory))
+            prompts.append(timed(engine.build_prompt))
+            turns.append(timed(lambda: engine.get_response(f"turn {i}")))
+        engine.memory_store.close()
+
+        results[f'messages_{size}'] = {
+            'startup_ms': round(startup * 1000, 3),
+            'save_p50_ms': summarize(saves)['p50_ms'],
+            'prompt_p50_ms': summarize(prompts)['p50_ms'],
+            'turn_p50_ms': summarize(turns)['p50_ms'],
+            'memory_bytes': sum(os.path.getsize(path) for path in (memory_file, memory_file + '.journal')
+                                if os.path.exists(path)),
+        }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current, baseline, threshold, min_delta_ms=1.0):
+    """Print changes against a baseline run and return the regressed metrics.
+
+    A timing only counts as a regression when it is both ``threshold``
+    slower relatively and ``min_delta_ms`` slower absolutely, so jitter on
+    sub-millisecond stages doesn't fail the run.
+    """
+    now, before = flatten(current['results']), flatten(baseline['results'])
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('revision') or 'baseline'} "
+          f"({baseline['meta'].get('timestamp', '?')}):")
+    for name in sorted(now):
+        if name not in before or not before[name]:
+            continue
+        higher_is_better = name.endswith('throughput_rps')
+        if not (name.endswith('_ms') or higher_is_better):
+            continue
+        change = (now[name] - before[name]) / before[name]
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold and (higher_is_better or now[name] - before[name] >= min_delta_ms):
+            flag = '  <-- regression'
+            regressions.append(name)
+        print(f"  {name:<48} {before[name]:>10.2f} -> {now[name]:>10.2f}  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline chatbot benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="smaller run for CI")
+    parser.add_argument('--output', help="where to write the JSON results")
+    parser.add_argument('--compare', help="earlier results JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown counted as a regression (default 0.2)")
+    parser.add_argument('--min-delta', type=float, default=1.0,
+                        help="smallest slowdown in ms counted as a regression (default 1.0)")
+    args = parser.parse_args()
+
+    mode = 'quick' if args.quick else 'full'
+    cfg = CONFIGS[mode]
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'mode': mode,
+            'config': cfg,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in (('single_turn', bench_single_turn),
+                            ('flask_concurrency', bench_flask_concurrency),
+                            ('history_scaling', bench_history_scaling)):
+            print(f"Running {name}...")
+            workdir = os.path.join(tmp, name)
+            os.makedirs(workdir)
+            report['results'][name] = bench(cfg, workdir)
+            print(json.dumps(report['results'][name], indent=2))
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         f"{datetime.now():%Y%m%d-%H%M%S}-{mode}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📊 Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"\n❌ {len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+Provider-independent conversation engine shared by the chatbots
+"""
+import os
+import glob
+import time
+
+from memory_store import open_memory_store
+import metrics
+from prompt_builder import PromptBuilder, estimate_tokens
+from web_search import search_web
+from file_reader import read_file, READ_MAX_BYTES, READ_SUMMARY_CHUNKS
+from fanout import fan_out
+from retrieval_index import get_index
+from commands import COMMANDS
+from response_cache import get_response_cache, prompt_key
+from history_compactor import get_compactor, SUMMARY_HEADER
+from scheduler import SchedulerBusy
+from messages import Message, compress_cold
+from recall import open_recall
+
+
+def prompt_size(prompt):
+    """Characters in a text prompt or a message-list prompt"""
+    if isinstance(prompt, list):
+        return sum(len(m.get("content", "")) for m in prompt)
+    return len(prompt)
+
+
+class ChatEngine:
+    """Conversation state, commands, memory and prompting for one conversation.
+
+    The model call goes through an ``LLMProvider``, so every optimization in
+    here (prompt windowing, search caching, streaming, memory journaling)
+    applies to Gemini, OpenAI and the offline fake backend alike.
+    """
+
+    def __init__(self, provider, memory_file, system_prompt, response_cache=None, compactor=None, recall=None):
+        self.provider = provider
+        # Optional cache of responses to byte-identical prompts (see RESPONSE_CACHE)
+        self.response_cache = response_cache if response_cache is not None else get_response_cache()
+        # Background summarization of old turns (see COMPACT_THRESHOLD)
+        self.compactor = compactor if compactor is not None else get_compactor()
+        self.pending_compaction = None
+        self.memory_file = memory_file
+        self.memory_store = open_memory_store(self.memory_file)
+        # Features the backend lacks natively are done here once, for every backend
+        capabilities = provider.capabilities()
+        self.streaming = capabilities['streaming']
+        self.prompt_builder = PromptBuilder(
+            count_tokens=self.count_tokens if capabilities['token_counting'] else estimate_tokens)
+        # Earlier turns recalled by similarity once they leave the prompt window (see RECALL)
+        self.recall = recall if recall is not None else open_recall(self.memory_file)
+
+        # System prompt for better behavior
+        self.system_prompt = system_prompt
+
+        # Read from the memory store on first use rather than at startup
+        self._history = None
+        # Messages before this index have been offered for compression
+        self._cold_mark = 0
+
+    @property
+    def conversation_history(self):
+        """The conversation so far, loaded from memory on first access"""
+        if self._history is None:
+            self.load_memory()
+        return self._history
+
+    @conversation_history.setter
+    def conversation_history(self, messages):
+        self._history = messages
+        self._cold_mark = 0
+
+    def loaded_history(self):
+        """The history if it is loaded, else None; never loads it, so other threads can call it"""
+        return self._history
+
+    def add_message(self, role, content):
+        """Add a message to conversation history"""
+        self.conversation_history.append(Message(role, content))
+
+    def load_memory(self):
+        """Load conversation memory from the configured store"""
+        try:
+            # Every session shares the one system prompt string instead of a loaded copy
+            shared = (self.system_prompt,)
+            self.conversation_history = [Message.from_dict(m, shared) for m in self.memory_store.load()]
+            if self.conversation_history:
+                print(f"📚 Loaded {len(self.conversation_history)} previous messages from memory")
+        except Exception as e:
+            print(f"⚠️ Could not load memory: {e}")
+            self.conversation_history = []
+
+        # Add system prompt to conversation unless the reloaded history already has it
+        system_messages = [m for m in self.conversation_history if m.get("role") == "system"]
+        if not system_messages or system_messages[-1].get("content") not in (
+                self.system_prompt, self.summary_message(self.current_summary())["content"]):
+            self.add_message("system", self.system_prompt)
+        self.compress_cold()
+
+    def save_memory(self):
+        """Persist new messages to the configured store"""
+        try:
+            self.memory_store.save(self.conversation_history)
+        except Exception as e:
+            print(f"⚠️ Could not save memory: {e}")
+
+    def reload_if_changed(self):
+        """Forget the loaded history if another worker process has saved this conversation since"""
+        if self._history is not None and self.memory_store.changed():
+            self._history = None
+            self.pending_compaction = None
+
+    def compress_cold(self):
+        """Compress long messages that have scrolled out of the prompt window"""
+        self._cold_mark = compress_cold(self._history, self._cold_mark)
+
+    def clear(self):
+        """Start over with only the system prompt"""
+        self.conversation_history = [Message("system", self.system_prompt)]
+        self.save_memory()
+        if self.recall:
+            self.recall.clear()
+
+    def current_summary(self, history=None):
+        """The rolling summary of compacted turns (of ``history``, default the conversation), or an empty string"""
+        prefix = f"{self.system_prompt}\n\n{SUMMARY_HEADER}\n"
+        for message in reversed(self.conversation_history if history is None else history):
+            if message.get("role") == "system":
+                content = message.get("content", "")
+                return content[len(prefix):] if content.startswith(prefix) else ""
+        return ""
+
+    def summary_message(self, summary):
+        """System message carrying the system prompt plus the compaction summary"""
+        if not summary:
+            return Message("system", self.system_prompt)
+        return Message("system", f"{self.system_prompt}\n\n{SUMMARY_HEADER}\n{summary}")
+
+    def apply_compaction(self):
+        """Swap a finished background summary in for the turns it covers"""
+        compaction, self.pending_compaction = self.pending_compaction, None
+        history = self.conversation_history
+        # Discard it if the history was replaced (e.g. /clear) in the meantime
+        if compaction is None or compaction.history is not history or len(history) < compaction.cut:
+            return False
+        # The summary message replaces any copy of the system prompt in the kept turns
+        recent = [m for m in history[compaction.cut:]
+                  if m.get("role") != "system" or m.get("content") != self.system_prompt]
+        self.conversation_history = [self.summary_message(compaction.summary)] + recent
+        try:
+            # The summarized turns are archived now that they leave the history
+            self.memory_store.replace(self.conversation_history, dropped=history[:compaction.cut])
+        except Exception as e:
+            print(f"⚠️ Could not save memory: {e}")
+        return True
+
+    def maybe_compact(self):
+        """Hand the conversation to the background compactor if it is too long"""
+        if self.compactor is not None:
+            self.compactor.submit(self)
+
+    def web_search(self, query):
+        """Perform web search and return results (cached across sessions)"""
+        return search_web(query)
+
+    def read_file(self, file_path, limit=READ_MAX_BYTES, summarize_over=None, max_chunks=READ_SUMMARY_CHUNKS):
+        """Read and analyze a file (optionally a range or slice, see file_reader)"""
+        return read_file(file_path, summarize_batch=self.provider.generate_batch, limit=limit,
+                         summarize_over=summarize_over, max_chunks=max_chunks)
+
+    def read_files(self, file_paths):
+        """Read several files concurrently, sharing the /read size budget.
+
+        Only files too large for the whole budget are summarized, and the
+        files share ``READ_SUMMARY_CHUNKS`` summary sections between them, so
+        one command asks the model for at most that many summaries.
+        """
+        limit = READ_MAX_BYTES // len(file_paths)
+        max_chunks = max(1, READ_SUMMARY_CHUNKS // len(file_paths))
+        return fan_out(lambda path: self.read_file(path, limit, READ_MAX_BYTES, max_chunks), file_paths)
+
+    def ask_files(self, question):
+        """Most relevant chunks of the local files for a question"""
+        return get_index().search(question)
+
+    def list_files(self):
+        """List available files in current directory"""
+        try:
+            files = []
+            for file_path in glob.glob("*"):
+                if os.path.isfile(file_path) and not file_path.startswith('.'):
+                    files.append(file_path)
+            return files
+        except Exception as e:
+            return f"Error listing files: {str(e)}"
+
+    def expand_commands(self, user_input):
+        """Expand /search, /read, /ask, /files and other registered commands into a prompt for the model"""
+        return COMMANDS.expand(self, user_input)
+
+    async def expand_commands_async(self, user_input):
+        """Like expand_commands, but without blocking the event loop"""
+        return await COMMANDS.expand_async(self, user_input)
+
+    def recalled_messages(self, history, selected):
+        """Earlier turns relevant to the new user message that are outside the prompt window"""
+        if not self.recall or not history or history[-1].get("role") != "user":
+            return ()
+        try:
+            with metrics.stage('recall'):
+                self.recall.sync(history[:-1])
+                message = self.recall.message(history[-1].get("content", ""), [history[i] for i in selected])
+        except Exception as e:
+            print(f"⚠️ Could not recall earlier turns: {e}")
+            return ()
+        metrics.inc('chat_recall_total', result='miss' if message is None else 'hit')
+        return () if message is None else (message,)
+
+    def remember_turn(self):
+        """Add the turn that just completed to long-term recall"""
+        if self.recall:
+            try:
+                self.recall.remember(self.conversation_history)
+            except Exception as e:
+                print(f"⚠️ Could not index turn for recall: {e}")
+
+    def build_prompt(self):
+        """Token-budgeted prompt in the shape the provider expects"""
+        history = self.conversation_history
+        selected = self.prompt_builder.select(history)
+        recalled = self.recalled_messages(history, selected)
+        if self.provider.prompt_style == 'messages':
+            return self.prompt_builder.messages(history, recalled, selected)
+        return self.prompt_builder.build(history, recalled, selected)
+
+    def cache_key(self, prompt, use_cache=True):
+        """Response cache key for a prompt, or None when caching is off"""
+        if self.response_cache is None or not use_cache:
+            return None
+        return prompt_key(self.provider, prompt)
+
+    def _begin_turn(self, user_input, use_cache):
+        """Record the user's message and build the prompt.
+
+        Returns the prompt, its response cache key and the cached response
+        (None on a miss or when caching is off).
+        """
+        # Add user message to conversation
+        self.add_message("user", user_input)
+        return self._prepare_prompt(use_cache)
+
+    def _prepare_prompt(self, use_cache):
+        """The prompt for the conversation so far, its cache key and cached response"""
+        with metrics.stage('prompt'):
+            prompt = self.build_prompt()
+        metrics.inc('chat_prompt_bytes_total', prompt_size(prompt))
+        metrics.inc('chat_prompt_tokens_total', self.prompt_builder.last_token_count)
+
+        key = self.cache_key(prompt, use_cache)
+        cached = None
+        if key:
+            cached = self.response_cache.get(key)
+            metrics.inc('chat_response_cache_total', result='miss' if cached is None else 'hit')
+        return prompt, key, cached
+
+    def _end_turn(self, assistant_response, key, from_cache):
+        """Record the model's response (saving is left to the caller)"""
+        if key and not from_cache:
+            self.response_cache.put(key, assistant_response)
+        metrics.inc('chat_completion_tokens_total', estimate_tokens(assistant_response))
+
+        # Add assistant response to conversation
+        self.add_message("assistant", assistant_response)
+        self.remember_turn()
+        self.compress_cold()
+
+    def count_tokens(self, text):
+        """Token count of prompt text from the backend, or an estimate if it can't be reached"""
+        try:
+            return self.provider.count_tokens(text)
+        except Exception:
+            return estimate_tokens(text)
+
+    def _model_stream(self, prompt):
+        """Response chunks; a backend that can't stream answers in one chunk"""
+        if self.streaming:
+            return self.provider.stream(prompt)
+        # A plain call can also be micro-batched by the scheduler
+        return iter([self.provider.generate(prompt)])
+
+    async def _model_stream_async(self, prompt):
+        if self.streaming:
+            async for text in self.provider.stream_async(prompt):
+                yield text
+        else:
+            yield await self.provider.generate_async(prompt)
+
+    def drop_turn(self, turn_start, metric='chat_rejected_total'):
+        """Forget an unfinished turn (turned away or cancelled), so retrying it doesn't repeat the message"""
+        del self.conversation_history[turn_start:]
+        metrics.inc(metric)
+
+    def get_response(self, user_input, use_cache=True):
+        """Get response from the model with enhanced features"""
+        with metrics.trace('chat'):
+            try:
+                self.apply_compaction()
+                turn_start = len(self.conversation_history)
+
+                # Check for special commands
+                with metrics.stage('commands'):
+                    user_input = self.expand_commands(user_input)
+
+                prompt, key, assistant_response = self._begin_turn(user_input, use_cache)
+                from_cache = assistant_response is not None
+                if not from_cache:
+                    with metrics.stage('model'):
+                        assistant_response = self.provider.generate(prompt)
+                self._end_turn(assistant_response, key, from_cache)
+
+                # Save memory after each interaction
+                with metrics.stage('save'):
+                    self.save_memory()
+                self.maybe_compact()
+
+                return assistant_response
+
+            except SchedulerBusy:
+                self.drop_turn(turn_start)
+                raise
+
+            except Exception as e:
+                metrics.inc('chat_errors_total')
+                return f"Error: {str(e)}"
+
+    def get_response_stream(self, user_input, use_cache=True):
+        """Stream response text from the model chunk by chunk.
+
+        Raises ``SchedulerBusy`` (before the first chunk) when the model is overloaded.
+        """
+        with metrics.trace('stream'):
+            try:
+                self.apply_compaction()
+                turn_start = len(self.conversation_history)
+
+                # Check for special commands
+                with metrics.stage('commands'):
+                    user_input = self.expand_commands(user_input)
+
+                prompt, key, cached = self._begin_turn(user_input, use_cache)
+                if cached is not None:
+                    chunks = [cached]
+                    yield cached
+                else:
+                    chunks = []
+                    with metrics.stage('model'):
+                        started = time.perf_counter()
+                        for text in self._model_stream(prompt):
+                            if not chunks:
+                                metrics.observe('chat_time_to_first_chunk_seconds', time.perf_counter() - started)
+                            chunks.append(text)
+                            yield text
+
+                # Store the full response once the stream completes
+                self._end_turn("".join(chunks), key, cached is not None)
+                with metrics.stage('save'):
+                    self.save_memory()
+                self.maybe_compact()
+
+            except GeneratorExit:
+                # The client went away or the job was cancelled mid-stream
+                self.drop_turn(turn_start, 'chat_cancelled_total')
+                raise
+
+            except SchedulerBusy:
+                self.drop_turn(turn_start)
+                raise
+
+            except Exception as e:
+                metrics.inc('chat_errors_total')
+                yield f"Error: {str(e)}"
+
+    async def get_response_async(self, user_input, use_cache=True):
+        """Get response from the model without blocking the event loop"""
+        import asyncio
+
+        with metrics.trace('chat'):
+            try:
+                await asyncio.to_thread(self.apply_compaction)
+                turn_start = len(self.conversation_history)
+
+                # Check for special commands
+                with metrics.stage('commands'):
+                    user_input = await self.expand_commands_async(user_input)
+
+                # Recall embeds and searches, and the response cache may hit disk: off the loop
+                self.add_message("user", user_input)
+                prompt, key, assistant_response = await asyncio.to_thread(self._prepare_prompt, use_cache)
+                from_cache = assistant_response is not None
+                if not from_cache:
+                    with metrics.stage('model'):
+                        assistant_response = await self.provider.generate_async(prompt)
+                await asyncio.to_thread(self._end_turn, assistant_response, key, from_cache)
+
+                with metrics.stage('save'):
+                    await asyncio.to_thread(self.save_memory)
+                self.maybe_compact()
+
+                return assistant_response
+
+            except SchedulerBusy:
+                self.drop_turn(turn_start)
+                raise
+
+            except Exception as e:
+                metrics.inc('chat_errors_total')
+                return f"Error: {str(e)}"
+
+    async def get_response_stream_async(self, user_input, use_cache=True):
+        """Stream response text from the model without blocking the event loop.
+
+        Raises ``SchedulerBusy`` (before the first chunk) when the model is overloaded.
+        """
+        import asyncio
+
+        turn_start = None
+        with metrics.trace('stream'):
+            try:
+                await asyncio.to_thread(self.apply_compaction)
+                turn_start = len(self.conversation_history)
+
+                # Check for special commands
+                with metrics.stage('commands'):
+                    user_input = await self.expand_commands_async(user_input)
+
+                # Recall embeds and searches, and the response cache may hit disk: off the loop
+                self.add_message("user", user_input)
+                prompt, key, cached = await asyncio.to_thread(self._prepare_prompt, use_cache)
+                if cached is not None:
+                    chunks = [cached]
+                    yield cached
+                else:
+                    chunks = []
+                    with metrics.stage('model'):
+                        started = time.perf_counter()
+                        async for text in self._model_stream_async(prompt):
+                            if not chunks:
+                                metrics.observe('chat_time_to_first_chunk_seconds', time.perf_counter() - started)
+                            chunks.append(text)
+                            yield text
+
+                # Store the full response once the stream completes; the turn is
+                # kept even if cancelled now, as the thread still records it
+                turn_start = None
+                await asyncio.to_thread(self._end_turn, "".join(chunks), key, cached is not None)
+                with metrics.stage('save'):
+                    await asyncio.to_thread(self.save_memory)
+                self.maybe_compact()
+
+            except (GeneratorExit, asyncio.CancelledError):
+                # The client went away or the job was cancelled mid-stream;
+                # a turn that already has its answer is kept
+                if turn_start is not None:
+                    self.drop_turn(turn_start, 'chat_cancelled_total')
+                raise
+
+            except SchedulerBusy:
+                self.drop_turn(turn_start)
+                raise
+
+            except Exception as e:
+                metrics.inc('chat_errors_total')
+                yield f"Error: {str(e)}"
+
+    def start_chat(self):
+        """Start the interactive chat session"""
+        print("🤖 Enhanced ChatGPT Bot - Type 'quit' to exit")
+        print("=" * 60)
+        print("🚀 NEW FEATURES:")
+        for line in COMMANDS.help_lines():
+            print(f"• {line}")
+        print("• Memory persistence - Remembers previous conversations")
+        print("• Enhanced responses - More detailed and informative")
+        print("=" * 60)
+
+        while True:
+            try:
+                user_input = input("\nYou: ").strip()
+
+                if user_input.lower() in ['quit', 'exit', 'bye']:
+                    print("👋 Goodbye!")
+                    break
+
+                if not user_input:
+                    print("Please enter a message.")
+                    continue
+
+                print("🤖 Bot: ", end="", flush=True)
+                for chunk in self.get_response_stream(user_input):
+                    print(chunk, end="", flush=True)
+                print()
+
+            except KeyboardInterrupt:
+                print("\n👋 Goodbye!")
+                break
+            except Exception as e:
+                print(f"An error occurred: {str(e)}")
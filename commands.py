@@ -0,0 +1,320 @@
+"""
+Registry of the chat commands (/search, /read, /ask, /files)
+
+A command is a handler that turns ``/name args`` into a prompt for the
+model.  Each one is registered with what the dispatcher needs to know about
+it, so adding a command doesn't touch ``ChatEngine``:
+
+- ``version(args)``: a value that changes whenever the result would (e.g. a
+  directory's mtime).  Results are cached while it stays the same, so a
+  repeated ``/files`` costs one stat; ``None`` means don't cache
+- ``concurrency``: most runs of the command at once across all sessions
+- ``timeout``: seconds before the user gets a timeout message instead
+  (``None`` runs the handler inline).  Timed commands run on their own
+  pool of ``concurrency`` threads, so a slow command that has used up its
+  slots can't starve the others of threads
+
+Usage:
+    from commands import command
+
+    @command('/time', args='none', help="/time - The server's clock")
+    def time_command(engine, args):
+        return f"The time is {time.ctime()}. Answer the user's question about it."
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import metrics
+from web_search import search_web_async, search_prompt, split_queries, multi_search_prompt
+from file_reader import parse_read_spec, split_read_args
+from fanout import fan_out, fan_out_async, FANOUT_MAX_ITEMS
+from retrieval_index import get_index, ask_prompt
+
+# Default limits for a command; each command can set its own
+COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '60'))
+COMMAND_CONCURRENCY = int(os.getenv('COMMAND_CONCURRENCY', '8'))
+# Cached command results kept across sessions
+COMMAND_CACHE_SIZE = int(os.getenv('COMMAND_CACHE_SIZE', '256'))
+
+
+class Command:
+    """One registered command and its dispatch settings"""
+
+    __slots__ = ('name', 'handler', 'async_handler', 'args', 'version', 'concurrency', 'timeout',
+                 'help', 'slots', 'executor')
+
+    def __init__(self, name, handler, args='required', version=None, concurrency=COMMAND_CONCURRENCY,
+                 timeout=COMMAND_TIMEOUT, help='', async_handler=None):
+        self.name = name
+        self.handler = handler
+        self.async_handler = async_handler
+        # 'required' (/name <args>), 'optional' (/name or /name <args>) or 'none' (/name)
+        self.args = args
+        self.version = version
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.help = help
+        self.slots = threading.BoundedSemaphore(concurrency)
+        # One thread per slot, started on first use
+        self.executor = None
+
+
+class CommandRegistry:
+    """Commands by name, with a shared result cache and the worker threads that enforce timeouts"""
+
+    def __init__(self, cache_size=COMMAND_CACHE_SIZE):
+        self.commands = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.hits = 0
+        self.timeouts = 0
+        self.busy = 0
+        self.errors = 0
+
+    def command(self, name, **settings):
+        """Decorator registering ``handler(engine, args)`` as ``name``; see ``Command`` for settings"""
+        def register(handler):
+            self.commands[name.lower()] = Command(name.lower(), handler, **settings)
+            return handler
+        return register
+
+    def match(self, user_input):
+        """(command, args) for a command message, or (None, None) for anything else"""
+        if not user_input.startswith('/'):
+            return None, None
+        name, sep, args = user_input.partition(' ')
+        command = self.commands.get(name.lower())
+        if command is None or (command.args == 'required' and not sep) or (command.args == 'none' and sep):
+            return None, None
+        return command, (args if sep else None)
+
+    def help_lines(self):
+        return [c.help for c in self.commands.values() if c.help]
+
+    def _get_executor(self, command):
+        # Sized to the command's slots: a run holds its slot until its thread is free again
+        with self._lock:
+            if command.executor is None:
+                command.executor = ThreadPoolExecutor(max_workers=command.concurrency,
+                                                      thread_name_prefix='command' + command.name.replace('/', '-'))
+        return command.executor
+
+    def _cached(self, command, args):
+        """(key, cached result): the key is None when the result can't be cached"""
+        if command.version is None:
+            return None, None
+        try:
+            version = command.version(args)
+        except OSError:
+            version = None
+        if version is None:
+            return None, None
+        key = (command.name, args, version)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        return key, result
+
+    def _store(self, key, result):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _call(self, command, engine, args):
+        """Run the handler under the command's concurrency limit"""
+        started = time.monotonic()
+        if not command.slots.acquire(timeout=command.timeout):
+            with self._lock:
+                self.busy += 1
+            return f"Error: {command.name} is busy, please try again"
+        if command.timeout is None:
+            try:
+                return command.handler(engine, args)
+            finally:
+                command.slots.release()
+
+        # The handler runs in a copy of the caller's context so its stages land in the caller's trace
+        try:
+            future = self._get_executor(command).submit(contextvars.copy_context().run, command.handler, engine, args)
+        except BaseException:
+            command.slots.release()
+            raise
+        # A run that timed out keeps its slot until it really finishes
+        future.add_done_callback(lambda _: command.slots.release())
+        try:
+            return future.result(timeout=max(0.0, command.timeout - (time.monotonic() - started)))
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            return f"Error: {command.name} timed out after {command.timeout:g}s"
+
+    def expand(self, engine, user_input):
+        """The prompt for a command message; any other message is returned as is"""
+        command, args = self.match(user_input)
+        if command is None:
+            return user_input
+        with self._lock:
+            self.runs += 1
+        key, result = self._cached(command, args)
+        if result is not None:
+            return result
+        try:
+            result = self._call(command, engine, args)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        if key is not None and not result.startswith("Error: "):
+            self._store(key, result)
+        return result
+
+    async def expand_async(self, engine, user_input):
+        """Like expand, without blocking the event loop"""
+        import asyncio
+
+        command, args = self.match(user_input)
+        if command is None:
+            return user_input
+        if command.async_handler is None:
+            return await asyncio.to_thread(self.expand, engine, user_input)
+
+        with self._lock:
+            self.runs += 1
+        # Poll for a slot rather than park a thread on the semaphore
+        deadline = None if command.timeout is None else time.monotonic() + command.timeout
+        while not command.slots.acquire(blocking=False):
+            if deadline is not None and time.monotonic() >= deadline:
+                with self._lock:
+                    self.busy += 1
+                return f"Error: {command.name} is busy, please try again"
+            await asyncio.sleep(0.01)
+        try:
+            return await asyncio.wait_for(command.async_handler(engine, args), command.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            return f"Error: {command.name} timed out after {command.timeout:g}s"
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            command.slots.release()
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'runs': self.runs, 'cache_hits': self.hits, 'timeouts': self.timeouts,
+                    'busy': self.busy, 'errors': self.errors, 'cache_size': len(self._cache)}
+
+
+# The commands every chatbot understands
+COMMANDS = CommandRegistry()
+command = COMMANDS.command
+metrics.register_stats('chat_commands', COMMANDS.stats,
+                       counters=('runs', 'cache_hits', 'timeouts', 'busy', 'errors'))
+
+
+# Timestamps only move in clock ticks (up to 2s on some filesystems), so a
+# change made in the same tick as the last look would go unnoticed; nothing
+# changed this recently is cached
+RACY_SECONDS = 2
+
+
+def _settled(st):
+    return time.time() - st.st_mtime >= RACY_SECONDS
+
+
+def directory_version(path='.'):
+    """Changes whenever an entry is added to, removed from or renamed in a directory"""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_ino) if _settled(st) else None
+
+
+def files_version(paths):
+    """Changes whenever one of the files is written; None if one is missing or just changed"""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not _settled(st):
+            return None
+        version.append((os.path.abspath(path), st.st_mtime_ns, st.st_size))
+    return tuple(version)
+
+
+def _search(engine, args):
+    queries = split_queries(args, FANOUT_MAX_ITEMS)
+    if len(queries) > 1:
+        # /search q1 | q2 - run the searches in parallel
+        return multi_search_prompt(queries, fan_out(engine.web_search, queries))
+    return search_prompt(args, engine.web_search(args))
+
+
+async def _search_async(engine, args):
+    queries = split_queries(args, FANOUT_MAX_ITEMS)
+    if len(queries) > 1:
+        return multi_search_prompt(queries, await fan_out_async(search_web_async, queries))
+    return search_prompt(args, await search_web_async(args))
+
+
+# Search results are cached per query in web_search, so there is nothing to version here
+command('/search', async_handler=_search_async,
+        help="/search <query> - Search the web for real-time information")(_search)
+
+
+def _read_version(args):
+    return files_version([parse_read_spec(spec)[0] for spec in split_read_args(args)[:FANOUT_MAX_ITEMS]])
+
+
+@command('/read', version=_read_version, help="/read <filename> - Read and analyze files")
+def _read(engine, args):
+    file_paths = split_read_args(args)[:FANOUT_MAX_ITEMS]
+    if len(file_paths) > 1:
+        file_contents = "\n\n".join(engine.read_files(file_paths))
+        return f"Please analyze these files:\n{file_contents}"
+    return f"Please analyze this file content:\n{engine.read_file(file_paths[0])}"
+
+
+@command('/ask', help="/ask <question> - Answer from the most relevant parts of local files")
+def _ask(engine, args):
+    return ask_prompt(args, engine.ask_files(args))
+
+
+def _files_version(args):
+    # Ranked results come from the retrieval index, which keeps itself current
+    return directory_version() if args is None else None
+
+
+@command('/files', args='optional', version=_files_version,
+         help="/files - List available files (/files <query> ranks them)")
+def _files(engine, args):
+    if args is not None:
+        paths = list(dict.fromkeys(r['path'] for r in get_index().search(args, k=20)))
+        if paths:
+            files_info = f"Files matching '{args}':\n" + "\n".join(paths)
+        else:
+            files_info = f"No files match '{args}'"
+        return f"{files_info}\n\nYou can use '/read filename' to read any file."
+
+    files = engine.list_files()
+    if isinstance(files, list):
+        files_info = "Available files:\n" + "\n".join(files)
+        return f"Here are the available files:\n{files_info}\n\nYou can use '/read filename' to read any file."
+    return f"Error listing files: {files}"
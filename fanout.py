@@ -0,0 +1,67 @@
+"""
+Bounded parallel fan-out for commands that take several items
+
+``/search q1 | q2`` and ``/read a.md b.py`` run their items concurrently on
+one shared, bounded thread pool (or as concurrent tasks in async mode), so a
+command costs about as long as its slowest item instead of the sum.
+"""
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', '8'))
+# Seconds from the start of a fan-out until unfinished items are given up on
+FANOUT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT', '15'))
+# Most items a single command may fan out to
+FANOUT_MAX_ITEMS = int(os.getenv('FANOUT_MAX_ITEMS', '8'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The shared fan-out thread pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+    return _executor
+
+
+def fan_out(func, items, timeout=FANOUT_TIMEOUT):
+    """Call ``func`` on every item concurrently and return the results in order.
+
+    An item that raises or is still running after ``timeout`` seconds gets
+    an error string instead of a result, so one slow item can't hold up
+    the others' answer.
+    """
+    # Each item runs in a copy of the caller's context so its stages land in the caller's trace
+    futures = [get_executor().submit(contextvars.copy_context().run, func, item) for item in items]
+    deadline = time.monotonic() + timeout
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeoutError:
+            future.cancel()
+            results.append(f"Timed out after {timeout:g}s")
+        except Exception as e:
+            results.append(f"Error: {str(e)}")
+    return results
+
+
+async def fan_out_async(func, items, timeout=FANOUT_TIMEOUT):
+    """Like fan_out for a coroutine function, using tasks instead of threads"""
+    import asyncio
+
+    async def run(item):
+        try:
+            return await asyncio.wait_for(func(item), timeout)
+        except asyncio.TimeoutError:
+            return f"Timed out after {timeout:g}s"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    return await asyncio.gather(*(run(item) for item in items))
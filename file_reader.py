@@ -0,0 +1,303 @@
+"""
+Bounded-memory file reading for the /read command
+
+Nothing here loads a whole file: byte ranges and tails are sliced from a
+memory map, and line ranges and grep scan the file in fixed-size blocks,
+so memory use stays flat whether the file is 2 KB or 2 GB.
+
+``/read`` accepts an optional selector after the last colon:
+
+    /read app.log              whole file, or chunked summary if too large
+    /read app.log:100-200      lines 100 to 200 (1-based, inclusive)
+    /read app.log:5000-        line 5000 onwards
+    /read app.log:b0-4096      bytes 0 to 4096
+    /read app.log:head=50      first 50 lines (default 20)
+    /read app.log:tail=50      last 50 lines (default 20)
+    /read app.log:grep=ERROR   lines matching a regular expression
+"""
+import os
+import re
+import mmap
+import shlex
+
+from prompt_builder import DEFAULT_TOKEN_BUDGET
+
+# Most text returned to the model for one /read (about half the prompt budget)
+READ_MAX_BYTES = int(os.getenv('READ_MAX_BYTES', str(DEFAULT_TOKEN_BUDGET * 2)))
+# Sections summarized for files larger than READ_MAX_BYTES
+READ_SUMMARY_CHUNKS = int(os.getenv('READ_SUMMARY_CHUNKS', '8'))
+BLOCK_SIZE = 1 << 20
+DEFAULT_SLICE_LINES = 20
+MAX_GREP_MATCHES = 50
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml',
+                   '.log', '.csv', '.jsonl')
+
+_SELECTOR = re.compile(r'^(?:(?P<bytes>b)?(?P<start>\d+)(?:-(?P<end>\d*))?|(?P<slice>head|tail)(?:=(?P<count>\d+))?)$')
+
+
+def parse_read_spec(spec):
+    """Split a /read argument into (path, selector) where selector is a dict or None"""
+    spec = spec.strip()
+    path, sep, pattern = spec.partition(':grep=')
+    if sep and pattern:
+        return path, {'kind': 'grep', 'pattern': pattern}
+
+    path, sep, tail = spec.rpartition(':')
+    match = _SELECTOR.match(tail) if sep else None
+    if not match or not path:
+        return spec, None
+    if match.group('slice'):
+        count = int(match.group('count') or DEFAULT_SLICE_LINES)
+        return path, {'kind': match.group('slice'), 'count': count}
+
+    kind = 'bytes' if match.group('bytes') else 'lines'
+    # Bytes count from 0, lines from 1
+    first = 0 if kind == 'bytes' else 1
+    start = max(int(match.group('start')), first)
+    end = match.group('end')
+    if end is None:
+        end = start  # a single line or byte
+    elif end:
+        end = max(int(end), first)
+    else:
+        end = None  # "N-": to the end of the file
+    return path, {'kind': kind, 'start': start, 'end': end}
+
+
+def split_read_args(args):
+    """Split a /read argument into one or more file specs.
+
+    A single existing path is taken as-is even if it contains spaces;
+    otherwise the argument is split on whitespace, honouring quotes.
+    """
+    args = args.strip()
+    if os.path.exists(parse_read_spec(args)[0]):
+        return [args]
+    try:
+        parts = shlex.split(args, posix=False)
+    except ValueError:
+        return [args]
+    # Non-POSIX mode keeps Windows backslashes but leaves the quotes on
+    return [p[1:-1] if len(p) > 1 and p[0] == p[-1] and p[0] in '"\'' else p for p in parts] or [args]
+
+
+def _decode(data):
+    return data.decode('utf-8', errors='replace')
+
+
+def _clip(data, limit):
+    """Trim bytes to ``limit`` and report whether anything was cut"""
+    if len(data) > limit:
+        return data[:limit], True
+    return data, False
+
+
+def read_head(path, limit=READ_MAX_BYTES):
+    """The first ``limit`` bytes of a file as text, and whether it was truncated"""
+    with open(path, 'rb') as f:
+        data = f.read(limit + 1)
+    data, truncated = _clip(data, limit)
+    return _decode(data), truncated
+
+
+def read_bytes(path, start, end=None, limit=READ_MAX_BYTES):
+    """Bytes ``start``..``end`` (exclusive) of a file, capped at ``limit``"""
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)
+    if start >= end:
+        return '', False
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data, truncated = _clip(mm[start:min(end, start + limit + 1)], limit)
+    return _decode(data), truncated or end - start > limit
+
+
+def _line_offset(f, line_no):
+    """Byte offset where 1-based line ``line_no`` starts, or None past the end"""
+    remaining = line_no - 1
+    offset = 0
+    f.seek(0)
+    while remaining:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return None
+        count = block.count(b'\n')
+        if count < remaining:
+            remaining -= count
+            offset += len(block)
+            continue
+        pos = -1
+        for _ in range(remaining):
+            pos = block.index(b'\n', pos + 1)
+        return offset + pos + 1
+    return offset
+
+
+def read_lines(path, start, end=None, limit=READ_MAX_BYTES):
+    """Lines ``start``..``end`` (1-based, inclusive) of a file, capped at ``limit`` bytes"""
+    with open(path, 'rb') as f:
+        offset = _line_offset(f, max(start, 1))
+        if offset is None:
+            return '', False
+        f.seek(offset)
+        wanted = None if end is None else end - max(start, 1) + 1
+        chunks, size, truncated = [], 0, False
+        for line in f:
+            if wanted is not None and wanted <= 0:
+                break
+            if size + len(line) > limit:
+                chunks.append(line[:limit - size])
+                truncated = True
+                break
+            chunks.append(line)
+            size += len(line)
+            if wanted is not None:
+                wanted -= 1
+    return _decode(b''.join(chunks)), truncated
+
+
+def read_tail(path, count=DEFAULT_SLICE_LINES, limit=READ_MAX_BYTES):
+    """The last ``count`` lines of a file, capped at ``limit`` bytes"""
+    size = os.path.getsize(path)
+    if not size:
+        return '', False
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # Ignore a trailing newline so it doesn't count as an empty last line
+        end = size - 1 if mm[size - 1:size] == b'\n' else size
+        start = end
+        for _ in range(count):
+            start = mm.rfind(b'\n', max(0, end - limit - 1), start)
+            if start < 0:
+                break
+        start += 1
+        truncated = size - start > limit
+        data = mm[max(start, size - limit):size]
+    return _decode(data), truncated
+
+
+def grep_file(path, pattern, max_matches=MAX_GREP_MATCHES, limit=READ_MAX_BYTES):
+    """Lines matching a regular expression, prefixed with their line numbers"""
+    regex = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    out, size, line_no, carry = [], 0, 1, b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block and not carry:
+                break
+            data = carry + block
+            # Only scan whole lines; the partial last line waits for the next block
+            cut = data.rfind(b'\n') + 1 if block else len(data)
+            data, carry = data[:cut], data[cut:]
+            last, last_line = 0, None
+            for match in regex.finditer(data):
+                line_start = data.rfind(b'\n', 0, match.start()) + 1
+                if line_start == last_line:
+                    continue  # several matches on one line
+                line_no += data.count(b'\n', last, line_start)
+                last, last_line = line_start, line_start
+                line_end = data.find(b'\n', match.start())
+                line = _decode(data[line_start:line_end if line_end >= 0 else len(data)])
+                entry = f"{line_no}: {line}\n"
+                if len(out) >= max_matches or size + len(entry) > limit:
+                    return ''.join(out), True
+                out.append(entry)
+                size += len(entry)
+            line_no += data.count(b'\n', last)
+            if not block:
+                break
+    return ''.join(out), False
+
+
+def summary_chunks(path, chunk_bytes=READ_MAX_BYTES, max_chunks=READ_SUMMARY_CHUNKS):
+    """Up to ``max_chunks`` evenly spaced, line-aligned sections of a large file.
+
+    Returns ``(start, end, text)`` tuples; files with more sections than
+    ``max_chunks`` are sampled rather than read in full.
+    """
+    size = os.path.getsize(path)
+    total = max(1, -(-size // chunk_bytes))
+    picks = range(total) if total <= max_chunks else [i * total // max_chunks for i in range(max_chunks)]
+    chunks, end, previous = [], 0, -1
+    with open(path, 'rb') as f:
+        for index in picks:
+            start = index * chunk_bytes
+            if index == previous + 1:
+                # Continue exactly where the previous section stopped
+                start = end
+                f.seek(start)
+                data = f.read(chunk_bytes)
+            else:
+                # A sampled section starts on the next line boundary
+                f.seek(start)
+                data = f.read(chunk_bytes)
+                skip = data.find(b'\n') + 1
+                data, start = data[skip:], start + skip
+            if start + len(data) < size:
+                data = data[:data.rfind(b'\n') + 1] or data
+            end, previous = start + len(data), index
+            chunks.append((start, end, _decode(data)))
+    return chunks
+
+
+def read_file(path, summarize_batch=None, limit=READ_MAX_BYTES, summarize_over=None,
+              max_chunks=READ_SUMMARY_CHUNKS):
+    """Text of a /read request (path plus optional selector) for the model.
+
+    Files larger than ``summarize_over`` (default ``limit``) without a
+    selector are summarized in up to ``max_chunks`` sections with
+    ``summarize_batch`` (a list of prompts -> list of replies) when one is
+    given; other files are previewed from the start, up to ``limit`` bytes.
+    """
+    summarize_over = summarize_over or limit
+    path, selector = parse_read_spec(path)
+    try:
+        if not os.path.exists(path):
+            return f"File not found: {path}"
+
+        _, ext = os.path.splitext(path.lower())
+        if ext not in TEXT_EXTENSIONS:
+            return f"Cannot read file type: {ext}. Supported types: {', '.join(TEXT_EXTENSIONS)}"
+
+        if selector is None:
+            if os.path.getsize(path) > summarize_over and summarize_batch is not None:
+                return summarize_file(path, summarize_batch, summarize_over, max_chunks)
+            content, truncated = read_head(path, limit)
+            label = ''
+        elif selector['kind'] == 'lines':
+            content, truncated = read_lines(path, selector['start'], selector['end'], limit)
+            label = f", lines {selector['start']}-{selector['end'] if selector['end'] is not None else 'end'}"
+        elif selector['kind'] == 'bytes':
+            end = None if selector['end'] is None else selector['end'] + 1
+            content, truncated = read_bytes(path, selector['start'], end, limit)
+            label = f", bytes {selector['start']}-{selector['end'] if selector['end'] is not None else 'end'}"
+        elif selector['kind'] == 'head':
+            content, truncated = read_lines(path, 1, selector['count'], limit)
+            label = f", first {selector['count']} lines"
+        elif selector['kind'] == 'tail':
+            content, truncated = read_tail(path, selector['count'], limit)
+            label = f", last {selector['count']} lines"
+        else:
+            content, truncated = grep_file(path, selector['pattern'], limit=limit)
+            label = f", lines matching {selector['pattern']!r}"
+            if not content:
+                return f"No lines in {path} match {selector['pattern']!r}"
+
+        return f"File content ({path}{label}):\n{content}{'...' if truncated else ''}"
+    except re.error as e:
+        return f"Invalid grep pattern: {e}"
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+
+def summarize_file(path, summarize_batch, chunk_bytes=READ_MAX_BYTES, max_chunks=READ_SUMMARY_CHUNKS):
+    """Summaries of the sections of a file too large for one prompt"""
+    size = os.path.getsize(path)
+    chunks = summary_chunks(path, chunk_bytes, max_chunks)
+    prompts = [f"Summarize this section (bytes {start}-{end} of {size}) of {path} in a few sentences:\n{text}"
+               for start, end, text in chunks]
+    summaries = summarize_batch(prompts)
+    sections = "\n\n".join(f"[bytes {start}-{end}] {summary}"
+                           for (start, end, _), summary in zip(chunks, summaries))
+    sampled = " (sampled)" if len(chunks) < -(-size // chunk_bytes) else ""
+    return (f"File summary ({path}, {size} bytes in {len(chunks)} sections{sampled}). "
+            f"Use /read {path}:START-END, :head, :tail or :grep=PATTERN for exact text.\n{sections}")
@@ -0,0 +1,18 @@
+"""
+gunicorn settings for the chatbots (see serving.py)
+
+Usage: gunicorn -c gunicorn.conf.py 'chatbot:create_wsgi_app()'
+"""
+import os
+
+from serving import gunicorn_settings, worker_environment
+
+globals().update(gunicorn_settings())
+
+
+def on_starting(server):
+    """Set up the workers' environment in the master, before they are forked.
+
+    Uses gunicorn's final worker count, so ``-w`` splits the scheduler limits too.
+    """
+    os.environ.update(worker_environment(server.cfg.workers))
@@ -0,0 +1,158 @@
+"""
+Background compaction of long conversation histories
+
+Once a conversation grows past ``COMPACT_THRESHOLD`` messages, a worker
+thread asks the model to fold everything but the newest
+``COMPACT_KEEP_RECENT`` messages into a rolling summary.  The summary is
+handed back to the engine, which swaps it in at the start of its next
+request and has its memory store archive the raw turns (see archive.py),
+so the slow model call never runs on the request path and the history is
+only ever loaded and modified by the request holding the session: the
+worker only reads a history that is already loaded.
+"""
+import os
+import time
+import queue
+import threading
+
+import metrics
+
+# Messages before a conversation is compacted (0 disables compaction)
+COMPACT_THRESHOLD = int(os.getenv('COMPACT_THRESHOLD', '200'))
+COMPACT_KEEP_RECENT = int(os.getenv('COMPACT_KEEP_RECENT', '50'))
+# Longest excerpt of one message sent to the summarizer
+COMPACT_MESSAGE_CHARS = 2000
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+
+def summary_prompt(previous_summary, messages):
+    """Prompt asking the model to fold old turns into the running summary"""
+    lines = []
+    for message in messages:
+        speaker = "User" if message.get("role") == "user" else "Assistant"
+        lines.append(f"{speaker}: {message.get('content', '')[:COMPACT_MESSAGE_CHARS]}")
+    previous = f"Summary so far:\n{previous_summary}\n\n" if previous_summary else ""
+    return ("Summarize this conversation for your own future reference. Keep names, facts, "
+            "decisions, user preferences and open questions, and be concise.\n\n"
+            f"{previous}Conversation:\n" + "\n".join(lines))
+
+
+class Compaction:
+    """A finished summary waiting to replace the first ``cut`` messages of a history"""
+
+    __slots__ = ('history', 'cut', 'summary')
+
+    def __init__(self, history, cut, summary):
+        self.history = history
+        self.cut = cut
+        self.summary = summary
+
+
+class HistoryCompactor:
+    """Worker thread that summarizes old turns of the conversations submitted to it"""
+
+    def __init__(self, threshold=COMPACT_THRESHOLD, keep_recent=COMPACT_KEEP_RECENT):
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.messages_compacted = 0
+        self.bytes_saved = 0
+        self.seconds = 0.0
+
+    def needs_compaction(self, engine):
+        return bool(self.threshold) and len(engine.conversation_history) > self.threshold
+
+    def submit(self, engine):
+        """Queue a conversation for compaction if it is over the threshold"""
+        # Nothing to do until the engine has applied the last summary
+        if not self.needs_compaction(engine) or engine.pending_compaction is not None:
+            return False
+        with self._lock:
+            if id(engine) in self._pending:
+                return False
+            self._pending.add(id(engine))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='history-compactor', daemon=True)
+                self._thread.start()
+        self._queue.put(engine)
+        return True
+
+    def _run(self):
+        while True:
+            engine = self._queue.get()
+            try:
+                self.compact(engine)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Could not compact conversation history: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(id(engine))
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every submitted conversation has been compacted"""
+        self._queue.join()
+
+    def compact(self, engine):
+        """Summarize the old part of a conversation.
+
+        Reads a snapshot of the loaded history; the result is applied, and
+        the summarized turns archived, by the engine itself (see
+        ``ChatEngine.apply_compaction``), so a discarded summary archives nothing.
+        """
+        history = engine.loaded_history()
+        if history is None:
+            # Reloaded since (another worker saved it); the next request submits it again
+            return None
+        cut = len(history) - self.keep_recent
+        old = history[:cut]
+        turns = [m for m in old if m.get("role") != "system"]
+        if not turns:
+            return None
+
+        started = time.perf_counter()
+        summary = engine.provider.generate(summary_prompt(engine.current_summary(old), turns))
+
+        compaction = Compaction(history, cut, summary)
+        engine.pending_compaction = compaction
+        self.runs += 1
+        self.messages_compacted += len(turns)
+        replacement = engine.summary_message(summary)["content"]
+        self.bytes_saved += sum(len(m.get("content", "").encode('utf-8')) for m in old) \
+            - len(replacement.encode('utf-8'))
+        self.seconds += time.perf_counter() - started
+        return compaction
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'queued': self._queue.qsize(),
+            'messages_compacted': self.messages_compacted,
+            'bytes_saved': self.bytes_saved,
+            'seconds': round(self.seconds, 3)
+        }
+
+
+_default_compactor = None
+_default_lock = threading.Lock()
+
+
+def get_compactor():
+    """The process-wide compactor, or None when COMPACT_THRESHOLD is 0"""
+    global _default_compactor
+    if not COMPACT_THRESHOLD:
+        return None
+    with _default_lock:
+        if _default_compactor is None:
+            _default_compactor = HistoryCompactor()
+            metrics.register_stats('chat_compaction', _default_compactor.stats,
+                                   counters=('runs', 'failures', 'messages_compacted', 'bytes_saved', 'seconds'))
+    return _default_compactor
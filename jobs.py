@@ -0,0 +1,484 @@
+"""
+Chat responses generated in the background under a job id
+
+``POST /chat`` with ``"job": true`` answers at once with a job id and the
+response is generated by a worker, so a dropped connection or a reload no
+longer loses it: the client can poll the job, stream it from any chunk
+onwards, fetch the finished result, or cancel it.  Cancelling an async
+job interrupts the provider call at once; a threaded job stops when the
+provider hands over its next chunk (a blocking call can't be interrupted
+from another thread).  Either way the response stream is then closed, which
+frees its scheduler slot.  A job nobody has asked about for
+``JOB_IDLE_TIMEOUT`` seconds (the tab was closed) is cancelled the same way,
+so abandoned requests stop using provider quota.
+
+With ``JOB_DB`` set (multi-worker serving), jobs are mirrored in a SQLite
+table so a job started by one worker process can be polled, streamed and
+cancelled through any other (the owning worker sees a cancel before its
+next chunk).  In async mode the table is read and written on worker
+threads, never on the event loop.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+import metrics
+
+# Worker threads generating responses for the threaded (Flask) server
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '8'))
+# Cancel a job when no client has polled or streamed it for this long
+JOB_IDLE_TIMEOUT = float(os.getenv('JOB_IDLE_TIMEOUT', '60'))
+# How long finished jobs can still be fetched
+JOB_TTL = float(os.getenv('JOB_TTL', '600'))
+# Seconds between keepalive comments on an idle job stream
+JOB_KEEPALIVE = float(os.getenv('JOB_KEEPALIVE', '15'))
+# SQLite file shared by worker processes (empty: jobs stay in this process)
+JOB_DB = os.getenv('JOB_DB', '')
+# How often a worker checks the job table for another worker's new chunks
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.05'))
+
+FINISHED = ('done', 'cancelled', 'error')
+
+
+class Job:
+    """One response being generated; readers wait on it for new chunks"""
+
+    __slots__ = ('id', 'session_id', 'status', 'chunks', 'error', 'created', 'finished',
+                 'last_seen', 'cancel_requested', 'clock', '_cond', '_waiters', '_task')
+
+    def __init__(self, job_id, session_id, clock=time.monotonic):
+        now = clock()
+        self.id = job_id
+        self.session_id = session_id
+        # queued -> running -> done, cancelled or error
+        self.status = 'queued'
+        self.chunks = []
+        self.error = None
+        self.created = now
+        self.finished = None
+        self.last_seen = now
+        self.cancel_requested = False
+        self.clock = clock
+        self._cond = threading.Condition()
+        # (loop, future) of coroutines waiting for the next chunk
+        self._waiters = []
+        self._task = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def touch(self):
+        """Note that a client is still interested in the job"""
+        self.last_seen = self.clock()
+
+    def text(self, start=0):
+        return "".join(self.chunks[start:])
+
+    def info(self, start=0):
+        """Status and the response text from chunk ``start`` on"""
+        return {'job_id': self.id, 'status': self.status, 'chunks': len(self.chunks),
+                'text': self.text(start), 'error': self.error}
+
+    def request_cancel(self):
+        self.cancel_requested = True
+        task = self._task
+        if task is not None:
+            # Interrupts an async provider call right away, not just between chunks
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+        self._notify()
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait(self, start, timeout):
+        """Block until there are chunks past ``start`` or the job ends; returns (new chunks, done)"""
+        self.touch()
+        with self._cond:
+            if len(self.chunks) <= start and not self.done:
+                self._cond.wait(timeout)
+            return self.chunks[start:], self.done
+
+    async def wait_async(self, start, timeout):
+        """Coroutine version of ``wait``"""
+        import asyncio
+
+        self.touch()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if len(self.chunks) > start or self.done:
+                return self.chunks[start:], self.done
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            return self.chunks[start:], self.done
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RemoteJob(Job):
+    """A job another worker process is running, read through the shared job table"""
+
+    __slots__ = ('table',)
+
+    def __init__(self, table, job_id, session_id, clock=time.monotonic):
+        super().__init__(job_id, session_id, clock)
+        self.table = table
+
+    def refresh(self):
+        """Pick up new chunks and the status from the table"""
+        row = self.table.read(self.id, len(self.chunks))
+        if row is not None:
+            self.status, self.error, self.finished, chunks = row
+            self.chunks.extend(chunks)
+
+    def touch(self):
+        self.table.touch(self.id, self.clock())
+
+    def request_cancel(self):
+        # The owning worker sees the flag before its next chunk
+        self.table.request_cancel(self.id)
+
+    def wait(self, start, timeout):
+        self.touch()
+        deadline = time.monotonic() + timeout
+        while True:
+            self.refresh()
+            if len(self.chunks) > start or self.done or time.monotonic() >= deadline:
+                return self.chunks[start:], self.done
+            time.sleep(JOB_POLL_INTERVAL)
+
+    async def wait_async(self, start, timeout):
+        import asyncio
+
+        await asyncio.to_thread(self.touch)
+        deadline = time.monotonic() + timeout
+        while True:
+            await asyncio.to_thread(self.refresh)
+            if len(self.chunks) > start or self.done or time.monotonic() >= deadline:
+                return self.chunks[start:], self.done
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+class JobTable:
+    """Jobs and their chunks in SQLite, shared by the worker processes of one server.
+
+    Times are the job manager's clock; ``time.monotonic`` is the same for
+    every process on a host.
+    """
+
+    def __init__(self, db_path=JOB_DB):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    finished REAL,
+                    last_seen REAL NOT NULL,
+                    cancel INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS job_chunks (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                ) WITHOUT ROWID;
+            ''')
+            self._conn = conn
+        return self._conn
+
+    def _write(self, query, params):
+        with self._lock, self.conn:
+            self.conn.execute(query, params)
+
+    def create(self, job):
+        self._write('INSERT INTO jobs (id, session_id, status, last_seen) VALUES (?, ?, ?, ?)',
+                    (job.id, job.session_id, job.status, job.last_seen))
+
+    def set_status(self, job):
+        self._write('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                    (job.status, job.error, job.finished, job.id))
+
+    def append(self, job_id, index, chunk):
+        self._write('INSERT INTO job_chunks (job_id, idx, text) VALUES (?, ?, ?)', (job_id, index, chunk))
+
+    def touch(self, job_id, now):
+        self._write('UPDATE jobs SET last_seen = MAX(last_seen, ?) WHERE id = ?', (now, job_id))
+
+    def request_cancel(self, job_id):
+        self._write('UPDATE jobs SET cancel = 1 WHERE id = ?', (job_id,))
+
+    def control(self, job_id):
+        """(cancel requested, last time a client asked) as recorded by any worker"""
+        with self._lock:
+            row = self.conn.execute('SELECT cancel, last_seen FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return (bool(row[0]), row[1]) if row else (False, 0.0)
+
+    def session_of(self, job_id):
+        with self._lock:
+            row = self.conn.execute('SELECT session_id FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def read(self, job_id, start=0):
+        """(status, error, finished, chunks from ``start``), or None for an unknown job"""
+        with self._lock:
+            row = self.conn.execute('SELECT status, error, finished FROM jobs WHERE id = ?',
+                                    (job_id,)).fetchone()
+            if row is None:
+                return None
+            chunks = [text for (text,) in self.conn.execute(
+                'SELECT text FROM job_chunks WHERE job_id = ? AND idx >= ? ORDER BY idx', (job_id, start))]
+        return row[0], row[1], row[2], chunks
+
+    def prune(self, before):
+        """Delete jobs that finished, or were last asked about, before ``before``"""
+        with self._lock, self.conn:
+            expired = [job_id for (job_id,) in self.conn.execute(
+                'SELECT id FROM jobs WHERE finished < ? OR (finished IS NULL AND last_seen < ?)',
+                (before, before))]
+            for job_id in expired:
+                self.conn.execute('DELETE FROM job_chunks WHERE job_id = ?', (job_id,))
+                self.conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def result_response(job):
+    """Response body and HTTP status for fetching a job's result"""
+    if not job.done:
+        return {'job_id': job.id, 'status': job.status, 'chunks': len(job.chunks)}, 202
+    if job.status == 'done':
+        return {'job_id': job.id, 'status': job.status, 'response': job.text()}, 200
+    if job.status == 'cancelled':
+        # Whatever was generated before the job stopped
+        return {'job_id': job.id, 'status': job.status, 'error': job.error or 'Job was cancelled',
+                'response': job.text()}, 409
+    return {'job_id': job.id, 'status': job.status, 'error': job.error}, 500
+
+
+class JobManager:
+    """Runs chat responses as jobs and keeps them until they expire"""
+
+    def __init__(self, workers=JOB_WORKERS, idle_timeout=JOB_IDLE_TIMEOUT, ttl=JOB_TTL,
+                 db_path=JOB_DB, clock=time.monotonic):
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.clock = clock
+        # Shared with other worker processes when db_path is set
+        self.table = JobTable(db_path) if db_path else None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.abandoned = 0
+        self.failed = 0
+
+    def _add(self, session_id):
+        job = Job(new_job_id(), session_id, self.clock)
+        with self._lock:
+            self._prune(job.created)
+            self._jobs[job.id] = job
+            self.submitted += 1
+        if self.table is not None:
+            self.table.prune(job.created - self.ttl)
+            self.table.create(job)
+        return job
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.done and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, session_id, chunks):
+        """Generate ``chunks`` (a generator of response text) in the worker pool"""
+        job = self._add(session_id)
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='chat-job')
+        self._executor.submit(self._run, job, chunks)
+        return job
+
+    async def submit_async(self, session_id, chunks):
+        """Generate ``chunks`` (an async generator) as a task on the running event loop"""
+        import asyncio
+
+        job = await self._io(self._add, session_id)
+        job._task = asyncio.get_running_loop().create_task(self._run_async(job, chunks))
+        return job
+
+    async def _io(self, func, *args):
+        """``func(*args)``, on a worker thread when it goes through the shared job table"""
+        if self.table is None:
+            return func(*args)
+        import asyncio
+        return await asyncio.to_thread(func, *args)
+
+    async def get_async(self, job_id, session_id):
+        """``get`` for the event loop"""
+        return await self._io(self.get, job_id, session_id)
+
+    async def cancel_async(self, job_id, session_id):
+        """``cancel`` for the event loop"""
+        return await self._io(self.cancel, job_id, session_id)
+
+    def get(self, job_id, session_id):
+        """The caller's job (None for unknown ids and other sessions' jobs)"""
+        job = self._jobs.get(job_id)
+        if job is None and self.table is not None:
+            # Started by another worker process
+            owner = self.table.session_of(job_id)
+            if owner is not None:
+                job = RemoteJob(self.table, job_id, owner, self.clock)
+                job.refresh()
+        if job is None or job.session_id != session_id:
+            return None
+        job.touch()
+        return job
+
+    def cancel(self, job_id, session_id):
+        """Ask a job to stop; returns the job, or None if it isn't the caller's"""
+        job = self.get(job_id, session_id)
+        if job is not None and not job.done:
+            job.request_cancel()
+        return job
+
+    def _stopping(self, job):
+        """'cancelled' or 'abandoned' if the job should stop, else None"""
+        if self.table is not None:
+            # Other workers record cancels and client activity in the table
+            cancel, last_seen = self.table.control(job.id)
+            job.cancel_requested = job.cancel_requested or cancel
+            job.last_seen = max(job.last_seen, last_seen)
+        if job.cancel_requested:
+            return 'cancelled'
+        if self.clock() - job.last_seen > self.idle_timeout:
+            return 'abandoned'
+        return None
+
+    def _run(self, job, chunks):
+        outcome, error = self._stopping(job), None
+        try:
+            if outcome is None:
+                self._start(job)
+                for chunk in chunks:
+                    self._append(job, chunk)
+                    outcome = self._stopping(job)
+                    if outcome:
+                        break
+        except Exception as e:
+            outcome, error = 'failed', str(e)
+        finally:
+            # Closing the stream stops the provider call and drops the unfinished turn
+            chunks.close()
+        self._finish(job, outcome or 'completed', error)
+
+    async def _run_async(self, job, chunks):
+        import asyncio
+
+        outcome, error = None, None
+        try:
+            outcome = await self._io(self._stopping, job)
+            if outcome is None:
+                await self._io(self._start, job)
+                async for chunk in chunks:
+                    await self._io(self._append, job, chunk)
+                    outcome = await self._io(self._stopping, job)
+                    if outcome:
+                        break
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+        except Exception as e:
+            outcome, error = 'failed', str(e)
+        finally:
+            await chunks.aclose()
+        await self._io(self._finish, job, outcome or 'completed', error)
+
+    def _start(self, job):
+        job.status = 'running'
+        if self.table is not None:
+            self.table.set_status(job)
+
+    def _append(self, job, chunk):
+        if self.table is not None:
+            self.table.append(job.id, len(job.chunks), chunk)
+        job.append(chunk)
+
+    def _finish(self, job, outcome, error=None):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        job.status = {'completed': 'done', 'failed': 'error'}.get(outcome, 'cancelled')
+        job.error = error or ('Job was abandoned' if outcome == 'abandoned' else None)
+        job.finished = self.clock()
+        job._task = None
+        if self.table is not None:
+            self.table.set_status(job)
+        job._notify()
+
+    def stats(self):
+        jobs = list(self._jobs.values())
+        return {
+            'queued': sum(1 for job in jobs if job.status == 'queued'),
+            'running': sum(1 for job in jobs if job.status == 'running'),
+            'stored': len(jobs),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'abandoned': self.abandoned,
+            'failed': self.failed,
+        }
+
+
+_default_jobs = None
+_default_lock = threading.Lock()
+
+
+def get_jobs():
+    """The process-wide job manager"""
+    global _default_jobs
+    with _default_lock:
+        if _default_jobs is None:
+            _default_jobs = JobManager()
+            metrics.register_stats('chat_jobs', _default_jobs.stats,
+                                   counters=('submitted', 'completed', 'cancelled', 'abandoned', 'failed'))
+    return _default_jobs
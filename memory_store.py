@@ -0,0 +1,528 @@
+"""
+Persistence backends for chatbot conversation memory
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+# Storage backend: "journal" (JSON snapshot + JSONL journal) or "sqlite"
+MEMORY_BACKEND = os.getenv('MEMORY_BACKEND', 'journal')
+MEMORY_DB = os.getenv('MEMORY_DB', 'chatbot_memory.db')
+# Number of most recent messages the SQLite backend loads at startup
+MEMORY_LOAD_LIMIT = int(os.getenv('MEMORY_LOAD_LIMIT', '500'))
+# Messages the JSON memory file keeps; older ones move to the archive (0 keeps everything)
+MEMORY_LIVE_MESSAGES = int(os.getenv('MEMORY_LIVE_MESSAGES', '2000'))
+# Messages held in memory at a time by extend() (bulk imports)
+EXTEND_BATCH = 1000
+# Memory files the chatbots use when not split by session (chatbot.py, web_chatbot.py, older setups)
+DEFAULT_MEMORY_FILES = ('chatbot_memory.json', 'web_chatbot_memory.json', 'alt_chatbot_memory.json')
+
+
+class MemoryStore:
+    """Interface shared by the conversation memory backends.
+
+    ``load()`` returns the messages to resume with and ``save(messages)``
+    persists everything appended since the last load/save.  A history that
+    got shorter (e.g. after /clear) replaces what was stored.
+    """
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, messages):
+        raise NotImplementedError
+
+    def replace(self, messages, dropped=()):
+        """Store ``messages`` in place of everything saved so far.
+
+        ``dropped`` are saved messages that ``messages`` leaves out for good
+        (e.g. turns folded into a summary); they are archived, once.
+        """
+        raise NotImplementedError
+
+    def iter_messages(self):
+        """Every stored message, archived ones included, oldest first, read a batch at a time"""
+        raise NotImplementedError
+
+    def extend(self, messages, compression=None):
+        """Append ``messages`` (any iterable, read one at a time) to the stored conversation.
+
+        Holds a bounded number of messages in memory however many there are;
+        ``compression`` is for any archive segments written.  Returns how
+        many were added.  Load again before saving a list loaded earlier.
+        """
+        raise NotImplementedError
+
+    def changed(self):
+        """Whether another process has saved this conversation since our last load or save"""
+        return False
+
+    def close(self):
+        pass
+
+
+class JournalMemoryStore(MemoryStore):
+    """Snapshot + append-only JSONL journal for conversation history.
+
+    The snapshot keeps the original ``{"conversations": [...]}`` layout so
+    older memory files load unchanged.  Every save only appends the new
+    messages to ``<memory_file>.journal``; once the journal grows as large as
+    the snapshot it is folded back in, so the amortized cost of a save stays
+    proportional to the messages being added rather than the whole history.
+    Folding moves all but the newest ``live_messages`` to the compressed
+    archive (see archive.py), so the snapshot stays small however long the
+    conversation gets.
+    """
+
+    def __init__(self, memory_file, min_compact_entries=1000, live_messages=MEMORY_LIVE_MESSAGES):
+        self.memory_file = memory_file
+        self.journal_file = memory_file + '.journal'
+        self.min_compact_entries = min_compact_entries
+        self.live_messages = live_messages
+        self.generation = 0
+        self.snapshot_count = 0
+        self.journal_count = 0
+        self.saved_count = 0
+        # How many messages of the caller's list the snapshot leaves out, and
+        # how far into the list they have been archived
+        self.archived_count = 0
+        self.archived_upto = 0
+
+    def load(self):
+        """Replay snapshot + journal and return the message list"""
+        messages = []
+        self.generation = 0
+        if os.path.exists(self.memory_file):
+            with open(self.memory_file, 'r', encoding='utf-8') as f:
+                memory_data = json.load(f)
+            messages = memory_data.get('conversations', [])
+            self.generation = memory_data.get('generation', 0)
+        self.snapshot_count = len(messages)
+
+        self.journal_count = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn write from an interrupted save - ignore the tail
+                        break
+                    # Entries from an older generation were already compacted
+                    if entry.get('gen') != self.generation:
+                        continue
+                    if entry.get('seq') != len(messages):
+                        continue
+                    messages.append(entry['message'])
+                    self.journal_count += 1
+
+        self.saved_count = len(messages)
+        self.archived_count = self.archived_upto = 0
+        return messages
+
+    def save(self, messages):
+        """Persist whatever part of ``messages`` is not on disk yet"""
+        if len(messages) < self.saved_count:
+            # History was reset (e.g. /clear) - rewrite from scratch
+            self.compact(messages)
+            return
+        pending = messages[self.saved_count:]
+        if not pending:
+            return
+        self._append_journal(pending)
+
+        if self.journal_count >= max(self.min_compact_entries, self.snapshot_count):
+            self.compact(messages)
+
+    def _append_journal(self, pending):
+        """Append messages that follow the saved ones to the journal"""
+        if not pending:
+            return
+        lines = []
+        for seq, message in enumerate(pending, self.saved_count - self.archived_count):
+            entry = {'gen': self.generation, 'seq': seq, 'message': dict(message)}
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+        self.saved_count += len(pending)
+        self.journal_count += len(pending)
+
+    def iter_messages(self):
+        from archive import ConversationArchive
+
+        yield from ConversationArchive(self.memory_file)
+        yield from self.load()
+
+    def extend(self, messages, compression=None):
+        """Only the newest ``live_messages`` of the conversation stay in the live
+        file and the rest stream into the archive; with ``live_messages`` 0
+        everything stays live, so the new messages go to the journal in batches.
+        """
+        from archive import ConversationArchive, ARCHIVE_COMPRESSION
+
+        live = self.load()
+        count = 0
+        if not self.live_messages:
+            batch = []
+            for message in messages:
+                batch.append(message)
+                count += 1
+                if len(batch) >= EXTEND_BATCH:
+                    self._append_journal(batch)
+                    batch = []
+            self._append_journal(batch)
+            return count
+
+        # The system prompt at the top of the live history stays there
+        head = live[:1] if live and live[0].get("role") == "system" else []
+        recent = deque(live[len(head):])
+        with ConversationArchive(self.memory_file, compression or ARCHIVE_COMPRESSION).writer() as writer:
+            for message in messages:
+                recent.append(message)
+                count += 1
+                while len(recent) > self.live_messages:
+                    writer.write(recent.popleft())
+        self.compact(head + list(recent))
+        return count
+
+    def replace(self, messages, dropped=()):
+        if dropped:
+            from archive import ConversationArchive
+
+            # Any that an earlier fold moved out of the snapshot are already in the archive
+            ConversationArchive(self.memory_file).append(
+                m for m in dropped[self.archived_upto:] if m.get("role") != "system")
+        self.compact(messages)
+
+    def compact(self, messages):
+        """Fold the journal into a fresh snapshot"""
+        live = self._rotate(messages)
+        self.generation += 1
+        memory_data = {
+            'conversations': [dict(m) for m in live],
+            'last_updated': datetime.now().isoformat(),
+            'generation': self.generation
+        }
+        tmp_file = self.memory_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(memory_data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.memory_file)
+        # Stale journal entries are skipped by generation if this truncate is lost
+        open(self.journal_file, 'w', encoding='utf-8').close()
+        self.snapshot_count = len(live)
+        self.journal_count = 0
+        self.saved_count = len(messages)
+        self.archived_count = len(messages) - len(live)
+        if live is messages:
+            self.archived_upto = 0
+
+    def _rotate(self, messages):
+        """The messages the snapshot keeps, after archiving the older ones"""
+        if not self.live_messages or len(messages) <= self.live_messages:
+            return messages
+        from archive import ConversationArchive
+
+        cut = len(messages) - self.live_messages
+        # Turns archived by an earlier fold of the same list are already in the archive
+        start = self.archived_upto if len(messages) >= self.saved_count else 0
+        ConversationArchive(self.memory_file).append(
+            m for m in messages[start:cut] if m.get("role") != "system")
+        self.archived_upto = cut
+        # The system prompt (with any summary) stays at the top
+        head = [m for m in messages[:cut] if m.get("role") == "system"][-1:]
+        return head + messages[cut:]
+
+
+class SQLiteMemoryStore(MemoryStore):
+    """Conversation history in a SQLite database (WAL mode).
+
+    All sessions share one ``messages`` table indexed by session and time,
+    so past conversations can be queried without loading them.  ``load()``
+    only reads the newest ``load_limit`` messages of the session.  Messages
+    that ``replace()`` drops from the live history (turns folded into a
+    summary) move to ``archived_messages``, where ``history()`` and
+    ``search()`` still find them.
+    """
+
+    def __init__(self, db_path=MEMORY_DB, session_id='default', load_limit=MEMORY_LOAD_LIMIT):
+        self.db_path = db_path
+        self.session_id = session_id
+        self.load_limit = load_limit
+        # Sequence number of the first message in the caller's list
+        self.base_seq = 0
+        self.saved_count = 0
+        # Bumped on every write, so other processes can tell their copy is stale
+        self.version = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_session_seq
+                    ON messages (session_id, seq);
+                CREATE INDEX IF NOT EXISTS idx_messages_session_time
+                    ON messages (session_id, created_at);
+                CREATE TABLE IF NOT EXISTS session_versions (
+                    session_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS archived_messages (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_archived_session_time
+                    ON archived_messages (session_id, created_at);
+            ''')
+            self._conn = conn
+        return self._conn
+
+    def load(self):
+        """Load the newest messages of this session"""
+        with self._lock:
+            query = 'SELECT seq, role, content FROM messages WHERE session_id = ? ORDER BY seq DESC'
+            params = [self.session_id]
+            if self.load_limit:
+                query += ' LIMIT ?'
+                params.append(self.load_limit)
+            rows = self.conn.execute(query, params).fetchall()
+            self.version = self._stored_version()
+        rows.reverse()
+        self.base_seq = rows[0][0] if rows else 0
+        self.saved_count = len(rows)
+        return [{"role": role, "content": content} for _, role, content in rows]
+
+    def save(self, messages):
+        """Insert the messages that are not stored yet"""
+        with self._lock, self.conn:
+            if len(messages) < self.saved_count:
+                # History was reset (e.g. /clear) - replace the session
+                self._delete_session()
+                self._bump_version()
+            pending = messages[self.saved_count:]
+            if not pending:
+                return
+            now = time.time()
+            start = self.base_seq + self.saved_count
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)',
+                [(self.session_id, seq, msg.get("role", "user"), msg.get("content", ""), now)
+                 for seq, msg in enumerate(pending, start)]
+            )
+            self.saved_count = len(messages)
+            self._bump_version()
+
+    def replace(self, messages, dropped=()):
+        """Make ``messages`` the live history, archiving the stored messages it drops.
+
+        ``dropped`` is not needed: the rows themselves move to ``archived_messages``.
+
+        Stored messages that ``messages`` ends with stay as they are (same
+        sequence numbers and times); the new messages before them (e.g. a
+        summary) take the sequence numbers just below.
+        """
+        with self._lock, self.conn:
+            rows = self.conn.execute('SELECT seq, role, content FROM messages WHERE session_id = ? ORDER BY seq',
+                                     (self.session_id,)).fetchall()
+            kept = 0
+            while kept < min(len(rows), len(messages)):
+                seq, role, content = rows[-1 - kept]
+                message = messages[-1 - kept]
+                if (role, content) != (message.get("role", "user"), message.get("content", "")):
+                    break
+                kept += 1
+            boundary = rows[-kept][0] if kept else (rows[-1][0] + 1 if rows else 0)
+            self.conn.execute(
+                'INSERT INTO archived_messages (session_id, seq, role, content, created_at) '
+                'SELECT session_id, seq, role, content, created_at FROM messages WHERE session_id = ? AND seq < ?',
+                (self.session_id, boundary))
+            self.conn.execute('DELETE FROM messages WHERE session_id = ? AND seq < ?', (self.session_id, boundary))
+            new = messages[:len(messages) - kept]
+            self.base_seq = boundary - len(new)
+            now = time.time()
+            self.conn.executemany(
+                'INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)',
+                [(self.session_id, seq, msg.get("role", "user"), msg.get("content", ""), now)
+                 for seq, msg in enumerate(new, self.base_seq)]
+            )
+            self.saved_count = len(messages)
+            self._bump_version()
+
+    def _stored_version(self):
+        row = self.conn.execute('SELECT version FROM session_versions WHERE session_id = ?',
+                                (self.session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self):
+        self.conn.execute(
+            'INSERT INTO session_versions (session_id, version) VALUES (?, 1) '
+            'ON CONFLICT(session_id) DO UPDATE SET version = version + 1', (self.session_id,))
+        self.version = self._stored_version()
+
+    def changed(self):
+        """Whether another process has written this session since our last load or save"""
+        with self._lock:
+            return self._stored_version() != self.version
+
+    def _delete_session(self):
+        self.conn.execute('DELETE FROM messages WHERE session_id = ?', (self.session_id,))
+        self.conn.execute('DELETE FROM archived_messages WHERE session_id = ?', (self.session_id,))
+        self.base_seq = 0
+        self.saved_count = 0
+
+    # Live and archived messages of a session, for the queries over the whole conversation
+    _ALL_MESSAGES = ('(SELECT seq, role, content, created_at FROM messages WHERE session_id = :session '
+                     'UNION ALL SELECT seq, role, content, created_at FROM archived_messages '
+                     'WHERE session_id = :session)')
+
+    def iter_messages(self):
+        # Summaries take the sequence number just below the turns they were
+        # kept with, which can repeat that of an archived turn: the older goes first
+        with self._lock:
+            cursor = self.conn.execute(f'SELECT role, content FROM {self._ALL_MESSAGES} ORDER BY seq, created_at',
+                                       {'session': self.session_id})
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(EXTEND_BATCH)
+            if not rows:
+                return
+            for role, content in rows:
+                yield {"role": role, "content": content}
+
+    def extend(self, messages, compression=None):
+        """Messages are inserted a batch at a time after the session's newest;
+        there are no archive segments, so ``compression`` is unused.
+        """
+        with self._lock:
+            newest = self.conn.execute(f'SELECT MAX(seq) FROM {self._ALL_MESSAGES}',
+                                       {'session': self.session_id}).fetchone()[0]
+        seq = -1 if newest is None else newest
+        count = 0
+        batch = []
+        for message in messages:
+            seq += 1
+            batch.append((self.session_id, seq, message.get("role", "user"), message.get("content", ""), time.time()))
+            if len(batch) >= EXTEND_BATCH:
+                self._insert(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._insert(batch)
+            count += len(batch)
+        return count
+
+    def _insert(self, rows):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+            self._bump_version()
+
+    def count(self):
+        """Total number of stored messages for this session, archived ones included"""
+        with self._lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM {self._ALL_MESSAGES}',
+                                     {'session': self.session_id}).fetchone()[0]
+
+    def history(self, limit=50, before=None):
+        """Messages of this session, newest first, optionally before a timestamp"""
+        query = f'SELECT role, content, created_at FROM {self._ALL_MESSAGES}'
+        params = {'session': self.session_id, 'limit': limit, 'before': before}
+        if before is not None:
+            query += ' WHERE created_at < :before'
+        query += ' ORDER BY created_at DESC, seq DESC LIMIT :limit'
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [{"role": role, "content": content, "created_at": created_at}
+                for role, content, created_at in rows]
+
+    def search(self, text, limit=20):
+        """Messages of this session containing ``text``, newest first"""
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT role, content, created_at FROM {self._ALL_MESSAGES} '
+                'WHERE content LIKE :text ORDER BY created_at DESC, seq DESC LIMIT :limit',
+                {'session': self.session_id, 'text': f"%{text}%", 'limit': limit}
+            ).fetchall()
+        return [{"role": role, "content": content, "created_at": created_at}
+                for role, content, created_at in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def migrate_json_memory(memory_file, db_path=MEMORY_DB, session_id=None):
+    """One-shot import of a JSON memory file into SQLite.
+
+    Sessions that already have rows are left alone, so this is safe to run
+    repeatedly.  Returns the number of imported messages.
+    """
+    if session_id is None:
+        session_id = os.path.splitext(os.path.basename(memory_file))[0]
+    if not os.path.exists(memory_file):
+        return 0
+
+    store = SQLiteMemoryStore(db_path, session_id, load_limit=None)
+    try:
+        if store.count():
+            return 0
+        messages = JournalMemoryStore(memory_file).load()
+        store.save(messages)
+        return len(messages)
+    finally:
+        store.close()
+
+
+def open_memory_store(memory_file, backend=None, live_messages=MEMORY_LIVE_MESSAGES):
+    """Create the configured memory backend (default ``MEMORY_BACKEND``) for a chatbot memory file.
+
+    ``live_messages`` is how much the JSON backend keeps in the live file.
+    """
+    if (backend or MEMORY_BACKEND) == 'sqlite':
+        session_id = os.path.splitext(os.path.basename(memory_file))[0]
+        migrate_json_memory(memory_file, MEMORY_DB, session_id)
+        return SQLiteMemoryStore(MEMORY_DB, session_id)
+    return JournalMemoryStore(memory_file, live_messages=live_messages)
+
+
+def main():
+    """Migrate JSON memory files: python memory_store.py FILE... [--db PATH]"""
+    args = sys.argv[1:]
+    db_path = MEMORY_DB
+    if '--db' in args:
+        index = args.index('--db')
+        db_path = args[index + 1]
+        del args[index:index + 2]
+    if not args:
+        args = ['chatbot_memory.json', 'alt_chatbot_memory.json']
+
+    for memory_file in args:
+        imported = migrate_json_memory(memory_file, db_path)
+        print(f"📦 {memory_file}: imported {imported} messages into {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compact in-memory representation of conversation messages
+
+A web server can hold many conversations in memory.  As plain
+``{"role": ..., "content": ...}`` dicts every message costs a dict plus its
+own copy of the role string, and every session loaded from disk has its
+own copy of the system prompt.  ``Message`` keeps the two fields in slots,
+interns roles, shares the system prompt string between sessions, and can
+zlib-compress long bodies once they have scrolled out of the prompt.
+"""
+import os
+import sys
+import zlib
+from collections.abc import Mapping
+
+# Bodies at least this long are compressed once they go cold (0 disables)
+MESSAGE_COMPRESS_MIN_CHARS = int(os.getenv('MESSAGE_COMPRESS_MIN_CHARS', '512'))
+# Newest messages of a conversation that are never compressed.  With the
+# default 8000-token prompt budget at most ~62 messages of 512+ characters
+# fit in a prompt, so compressed bodies are not inflated to build prompts.
+MESSAGE_HOT_COUNT = int(os.getenv('MESSAGE_HOT_COUNT', '64'))
+
+
+class Message(Mapping):
+    """One conversation message in two slots.
+
+    Reads like the dict it replaces: ``m["content"]``, ``m.get("role")``,
+    ``dict(m)`` and ``m == {"role": ..., "content": ...}`` all work.
+    """
+
+    __slots__ = ('role', '_body')
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        # str, or zlib-compressed UTF-8 bytes once compressed
+        self._body = content
+
+    @classmethod
+    def from_dict(cls, message, shared=()):
+        """Message from a stored dict, reusing an equal string from ``shared`` for the body"""
+        content = message.get("content", "")
+        for text in shared:
+            if content == text:
+                content = text
+                break
+        return cls(message.get("role", "user"), content)
+
+    @property
+    def content(self):
+        body = self._body
+        if body.__class__ is bytes:
+            return zlib.decompress(body).decode('utf-8')
+        return body
+
+    @property
+    def compressed(self):
+        return self._body.__class__ is bytes
+
+    def compress(self, min_chars=MESSAGE_COMPRESS_MIN_CHARS):
+        """Keep the body zlib-compressed if it is long enough to be worth it"""
+        body = self._body
+        # System messages are shared strings or sit at the top of every prompt
+        if not min_chars or self.role == 'system' or body.__class__ is not str or len(body) < min_chars:
+            return False
+        packed = zlib.compress(body.encode('utf-8'))
+        if len(packed) >= len(body):
+            return False
+        self._body = packed
+        return True
+
+    def __getitem__(self, key):
+        if key == 'role':
+            return self.role
+        if key == 'content':
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == 'role':
+            return self.role
+        if key == 'content':
+            return self.content
+        return default
+
+    def __iter__(self):
+        return iter(('role', 'content'))
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r})"
+
+
+def compress_cold(history, start=0, hot=MESSAGE_HOT_COUNT):
+    """Compress bodies from ``start`` up to the newest ``hot`` messages; returns where to start next time"""
+    end = len(history) - hot
+    for index in range(start, end):
+        message = history[index]
+        if message.__class__ is Message:
+            message.compress()
+    return max(start, end)
@@ -0,0 +1,253 @@
+"""
+Per-stage latency metrics and request traces for the chat pipeline
+
+Stages of a request (command expansion, web search fetch/parse, prompt
+building, the model call, saving memory) are timed into histograms, and
+counters track prompt size, tokens and cache hits.  ``render()`` produces
+the Prometheus text format served at ``/metrics``.
+
+Set ``TRACE_LOG`` to a file path to also append one JSON line per request
+with its stage timings.  With ``METRICS=0`` every hook is a no-op.
+"""
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+
+METRICS_ENABLED = os.getenv('METRICS', '1') != '0'
+TRACE_LOG = os.getenv('TRACE_LOG', '')
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'chat_stage_seconds': 'Time spent in each stage of a chat request',
+    'chat_request_seconds': 'Total time to answer a chat request',
+    'chat_time_to_first_chunk_seconds': 'Time until the first streamed chunk of a response',
+    'chat_requests_total': 'Chat requests handled',
+    'chat_errors_total': 'Chat requests that failed with an error',
+    'chat_prompt_bytes_total': 'Characters of prompt sent to the model',
+    'chat_prompt_tokens_total': 'Estimated prompt tokens sent to the model',
+    'chat_completion_tokens_total': 'Estimated tokens received from the model',
+    'chat_response_cache_total': 'Response cache lookups by result',
+    'chat_queue_wait_seconds': 'Time a model call waited in the scheduler queue',
+    'chat_rejected_total': 'Chat requests turned away by the scheduler',
+    'chat_cancelled_total': 'Streamed chat responses stopped before they finished',
+    'chat_recall_total': 'Long-term recall lookups by result',
+}
+
+_current_trace = contextvars.ContextVar('chat_trace', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}    # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def register_collector(self, collect):
+        """Add a callable returning ``(name, type, value)`` samples at scrape time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(state) for key, state in series.items()}
+                          for name, series in self._histograms.items()}
+
+        for name in sorted(counters):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, state in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ['+Inf'], state):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+
+        for collect in self._collectors:
+            for name, kind, value in collect():
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+def register_stats(prefix, stats, counters=()):
+    """Export a component's ``stats()`` dict; keys in ``counters`` become counters, the rest gauges"""
+    def collect():
+        samples = []
+        for key, value in stats().items():
+            if key in counters:
+                samples.append((f"{prefix}_{key}_total", 'counter', value))
+            else:
+                samples.append((f"{prefix}_{key}", 'gauge', value))
+        return samples
+    registry.register_collector(collect)
+
+
+class _Stage:
+    """Context manager timing one pipeline stage"""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def _record_stage(name, elapsed):
+    registry.observe('chat_stage_seconds', elapsed, stage=name)
+    record = _current_trace.get()
+    if record is not None:
+        stages = record['stages']
+        stages[name] = round(stages.get(name, 0.0) + elapsed, 6)
+
+
+class _NullContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+def stage(name):
+    """Time a block as pipeline stage ``name``"""
+    return _Stage(name) if METRICS_ENABLED else _NULL
+
+
+def record_stage(name, seconds):
+    """Record a stage timed elsewhere (e.g. time spent queued for the model)"""
+    if METRICS_ENABLED:
+        _record_stage(name, seconds)
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter (and to the current request's trace)"""
+    if not METRICS_ENABLED:
+        return
+    registry.inc(name, value, **labels)
+    record = _current_trace.get()
+    if record is not None:
+        field = name + ''.join(f".{v}" for _, v in sorted(labels.items()))
+        record['counters'][field] = record['counters'].get(field, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a histogram observation"""
+    if METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+
+class _Trace:
+    """Context manager collecting the stage timings of one request"""
+
+    __slots__ = ('record', 'token', 'started')
+
+    def __init__(self, kind):
+        self.record = {'kind': kind, 'stages': {}, 'counters': {}}
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.record)
+        self.started = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, *exc):
+        elapsed = time.perf_counter() - self.started
+        try:
+            _current_trace.reset(self.token)
+        except ValueError:
+            # Exited from another context (e.g. a stream closed by the server)
+            _current_trace.set(None)
+        kind = self.record['kind']
+        registry.inc('chat_requests_total', kind=kind)
+        registry.observe('chat_request_seconds', elapsed, kind=kind)
+        if TRACE_LOG:
+            self.record.update(ts=time.time(), seconds=round(elapsed, 6), error=exc_type is not None)
+            write_trace(self.record)
+        return False
+
+
+def trace(kind):
+    """Trace one request (``chat``, ``stream``...) through the pipeline stages"""
+    return _Trace(kind) if METRICS_ENABLED else _NULL
+
+
+_trace_lock = threading.Lock()
+
+
+def write_trace(record, path=None):
+    """Append a trace record to the structured trace log"""
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _trace_lock:
+        with open(path or TRACE_LOG, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+def render():
+    return registry.render()
@@ -0,0 +1,161 @@
+"""
+Speculative web search while the user is still typing
+
+The web page posts the input box to ``/search/prefetch`` once it starts
+with ``/search `` and has stopped changing for a moment.  The queries are
+fetched on a small thread pool into the shared search cache, so by the time
+the user presses Enter the search is cached or already on its way.  Each
+client has one outstanding prefetch: a newer one cancels the queued fetches
+of the one it replaces (a fetch already running finishes and stays cached).
+The search cache accounts for prefetched entries a search used (hits) and
+ones that expired or were evicted unused (wasted).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from web_search import search_cache, fetch_results, split_queries, normalize_query
+from fanout import FANOUT_MAX_ITEMS
+
+# Prefetch searches typed into the web page ("0" turns the endpoint off)
+SEARCH_PREFETCH = os.getenv('SEARCH_PREFETCH', '1') not in ('', '0')
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '2'))
+# Queued prefetches beyond this are turned away, so typing can't pile up fetches
+PREFETCH_MAX_PENDING = int(os.getenv('PREFETCH_MAX_PENDING', '16'))
+# Shortest query worth fetching
+PREFETCH_MIN_CHARS = int(os.getenv('PREFETCH_MIN_CHARS', '3'))
+
+SEARCH_PREFIX = '/search '
+
+
+def prefetch_queries(text, min_chars=PREFETCH_MIN_CHARS):
+    """The queries a half-typed ``/search`` message would run"""
+    if not text.lower().startswith(SEARCH_PREFIX):
+        return []
+    return [q for q in split_queries(text[len(SEARCH_PREFIX):], FANOUT_MAX_ITEMS) if len(q) >= min_chars]
+
+
+class SearchPrefetcher:
+    """Warms the search cache for the queries clients are typing"""
+
+    def __init__(self, cache=search_cache, fetch=fetch_results, workers=PREFETCH_WORKERS,
+                 max_pending=PREFETCH_MAX_PENDING):
+        self.cache = cache
+        self.fetch = fetch
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        # Reentrant: cancelling a future runs its done callback right away
+        self._lock = threading.RLock()
+        # client -> {normalized query: future} of its latest prefetch, while any is unfinished
+        self._clients = {}
+        self._pending = 0
+        self.requests = 0
+        self.fetched = 0
+        self.cached = 0
+        self.cancelled = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch')
+        return self._executor
+
+    def prefetch(self, client, text):
+        """Start fetching what ``text`` would search for, replacing the client's previous prefetch.
+
+        Returns ``{'queries': [...], 'started': n}``.
+        """
+        queries = prefetch_queries(text)
+        keys = {normalize_query(q): q for q in queries}
+        with self._lock:
+            self.requests += 1
+            previous = self._clients.pop(client, {})
+            # Queries the new text no longer has are not worth fetching
+            for key, future in previous.items():
+                if key not in keys and future.cancel():
+                    self.cancelled += 1
+            current, started = {}, []
+            for key, query in keys.items():
+                future = previous.get(key)
+                if future is not None and not future.done():
+                    current[key] = future
+                elif self._pending >= self.max_pending:
+                    self.skipped += 1
+                else:
+                    self._pending += 1
+                    current[key] = self._get_executor().submit(self._run, query)
+                    started.append(key)
+            if current:
+                self._clients[client] = current
+            # Added once the client is recorded: a fetch may already have finished
+            for key in started:
+                current[key].add_done_callback(lambda f, key=key: self._finished(client, key, f))
+        return {'queries': queries, 'started': len(started)}
+
+    def _finished(self, client, key, future):
+        """Forget a finished or cancelled fetch, and the client once it has none left"""
+        with self._lock:
+            self._pending -= 1
+            current = self._clients.get(client)
+            if current is not None and current.get(key) is future:
+                del current[key]
+                if not current:
+                    del self._clients[client]
+
+    def _run(self, query):
+        try:
+            fetched = self.cache.prefetch(query, self.fetch)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            return
+        with self._lock:
+            if fetched:
+                self.fetched += 1
+            else:
+                self.cached += 1
+
+    def close(self):
+        """Wait for the prefetches under way; a later prefetch starts a new pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        usage = self.cache.prefetch_stats()
+        with self._lock:
+            resolved = usage['hits'] + usage['wasted']
+            return {
+                'requests': self.requests,
+                'fetched': self.fetched,
+                'already_cached': self.cached,
+                'cancelled': self.cancelled,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'hits': usage['hits'],
+                'wasted': usage['wasted'],
+                'pending': self._pending,
+                'hit_rate': round(usage['hits'] / resolved, 3) if resolved else 0.0,
+            }
+
+
+_default_prefetcher = None
+_default_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """The process-wide prefetcher, or None when SEARCH_PREFETCH is off"""
+    global _default_prefetcher
+    if not SEARCH_PREFETCH:
+        return None
+    with _default_lock:
+        if _default_prefetcher is None:
+            _default_prefetcher = SearchPrefetcher()
+            metrics.register_stats('chat_search_prefetch', _default_prefetcher.stats,
+                                   counters=('requests', 'fetched', 'already_cached', 'cancelled',
+                                             'skipped', 'failed', 'hits', 'wasted'))
+    return _default_prefetcher
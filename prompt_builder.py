@@ -0,0 +1,117 @@
+"""
+Incremental, token-budgeted prompt assembly for the chatbots
+"""
+import os
+from array import array
+
+# Rough prompt budget; override with the PROMPT_TOKEN_BUDGET environment variable
+DEFAULT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '8000'))
+
+ROLE_LABELS = {'system': 'System', 'user': 'User'}
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+class PromptBuilder:
+    """Render conversation history into a prompt that fits a token budget.
+
+    Token counts (``count_tokens``, a cheap estimate by default) are cached
+    per message, so each turn only measures the messages added since the
+    last call; only the messages that make it
+    into the prompt are rendered.  The newest system message is always
+    kept at the top, the most recent messages are always kept at the bottom,
+    and older turns are dropped once the budget is used up.
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, min_recent_messages=2, count_tokens=estimate_tokens):
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.count_tokens = count_tokens
+        self.last_token_count = 0
+        # Parallel to the history list: token estimate of each rendered message
+        self._tokens = array('I')
+        # First and last message measured, to notice a replaced history
+        self._first = self._last = None
+        self._system_index = None
+
+    def reset(self):
+        """Drop all cached estimates"""
+        self._tokens = array('I')
+        self._first = self._last = None
+        self._system_index = None
+
+    @staticmethod
+    def render(msg):
+        """One message as a line of the text prompt"""
+        return f"{ROLE_LABELS.get(msg.get('role', 'user'), 'Assistant')}: {msg.get('content', '')}"
+
+    def _sync(self, history):
+        """Measure any messages that are not cached yet"""
+        tokens = self._tokens
+        # The history was replaced or truncated (e.g. /clear) - start over
+        if tokens and (len(tokens) > len(history)
+                       or self._first is not history[0]
+                       or self._last is not history[len(tokens) - 1]):
+            self.reset()
+            tokens = self._tokens
+
+        for index in range(len(tokens), len(history)):
+            msg = history[index]
+            tokens.append(self.count_tokens(self.render(msg)))
+            if msg.get("role", "user") == "system":
+                self._system_index = index
+        if history:
+            self._first, self._last = history[0], history[-1]
+
+    def select(self, history):
+        """Return the indexes of the messages that fit in the budget, oldest first"""
+        self._sync(history)
+        tokens = self._tokens
+        system_index = self._system_index
+
+        selected = []
+        used = 0
+        if system_index is not None:
+            used = tokens[system_index]
+            system_content = history[system_index].get("content", "")
+
+        for index in range(len(tokens) - 1, -1, -1):
+            if index == system_index:
+                continue
+            msg = history[index]
+            # Older copies of the system prompt add nothing
+            if system_index is not None and msg.get("role") == "system" \
+                    and msg.get("content", "") == system_content:
+                continue
+            if used + tokens[index] > self.token_budget and len(selected) >= self.min_recent_messages:
+                break
+            selected.append(index)
+            used += tokens[index]
+
+        selected.reverse()
+        if system_index is not None:
+            selected.insert(0, system_index)
+        self.last_token_count = used
+        return selected
+
+    def window(self, history, recalled=(), selected=None):
+        """The messages that fit in the budget, with any ``recalled`` messages right after the system prompt"""
+        if selected is None:
+            selected = self.select(history)
+        window = [history[i] for i in selected]
+        if recalled:
+            at = 1 if window and window[0].get("role") == "system" else 0
+            window[at:at] = recalled
+            self.last_token_count += sum(self.count_tokens(self.render(m)) for m in recalled)
+        return window
+
+    def build(self, history, recalled=(), selected=None):
+        """Render the windowed history as a single text prompt"""
+        return "\n\n".join(self.render(m) for m in self.window(history, recalled, selected))
+
+    def messages(self, history, recalled=(), selected=None):
+        """Return the windowed history as a list of role/content dicts"""
+        return [m if m.__class__ is dict else dict(m) for m in self.window(history, recalled, selected)]
@@ -0,0 +1,252 @@
+"""
+LLM provider backends for the chat engine
+
+Every provider takes the prompt the engine built for it (a single text
+prompt or a list of role/content messages, see ``prompt_style``) and
+declares what it can do, so engine-level features such as streaming are
+written once and apply to every backend.
+"""
+import time
+
+from prompt_builder import estimate_tokens
+
+
+class LLMProvider:
+    """Base class for model backends.
+
+    Subclasses implement ``generate``; streaming, async and batch calls fall
+    back to it unless the backend supports them natively.
+    """
+
+    name = 'base'
+    model_name = ''
+    # "text" providers get one rendered prompt, "messages" providers a message list
+    prompt_style = 'text'
+    supports_streaming = False
+    supports_batching = False
+    supports_token_counting = False
+
+    def capabilities(self):
+        """What this backend supports natively"""
+        return {
+            'streaming': self.supports_streaming,
+            'batching': self.supports_batching,
+            'token_counting': self.supports_token_counting,
+        }
+
+    def cache_params(self):
+        """Generation parameters that change the output, for response cache keys"""
+        return {}
+
+    def warm_up(self):
+        """Import and connect the backend SDK ahead of the first call"""
+
+    def generate(self, prompt):
+        """Return the full response text for a prompt"""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yield response text chunks"""
+        yield self.generate(prompt)
+
+    def generate_batch(self, prompts):
+        """Return one response per prompt"""
+        return [self.generate(prompt) for prompt in prompts]
+
+    async def generate_async(self, prompt):
+        import asyncio
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def stream_async(self, prompt):
+        yield await self.generate_async(prompt)
+
+    def count_tokens(self, prompt):
+        """Token count of a prompt (an estimate unless supports_token_counting)"""
+        if isinstance(prompt, list):
+            return sum(estimate_tokens(m.get("content", "")) for m in prompt)
+        return estimate_tokens(prompt)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through google-generativeai"""
+
+    name = 'gemini'
+    prompt_style = 'text'
+    supports_streaming = True
+    supports_token_counting = True
+
+    def __init__(self, api_key, model_name="gemini-1.5-flash"):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+
+    @property
+    def model(self):
+        """Gemini model client, created on first use (the SDK takes ~0.5s to import)"""
+        if self._model is None:
+            import google.generativeai as genai
+
+            # Configure Gemini client
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def warm_up(self):
+        self.model
+
+    def generate(self, prompt):
+        result = self.model.generate_content(prompt)
+        return getattr(result, 'text', None) or str(result)
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            text = getattr(chunk, 'text', '')
+            if text:
+                yield text
+
+    async def generate_async(self, prompt):
+        result = await self.model.generate_content_async(prompt)
+        return getattr(result, 'text', None) or str(result)
+
+    async def stream_async(self, prompt):
+        async for chunk in await self.model.generate_content_async(prompt, stream=True):
+            text = getattr(chunk, 'text', '')
+            if text:
+                yield text
+
+    def count_tokens(self, prompt):
+        return self.model.count_tokens(prompt).total_tokens
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions"""
+
+    name = 'openai'
+    prompt_style = 'messages'
+    supports_streaming = True
+
+    def __init__(self, api_key=None, model_name="gpt-3.5-turbo", max_tokens=2000, temperature=0.7):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.max_tokens = max_tokens  # Increased for more detailed responses
+        self.temperature = temperature
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use (the SDK takes ~0.5s to import)"""
+        if self._client is None:
+            import openai
+            self._client = openai.OpenAI(api_key=self.api_key)
+        return self._client
+
+    @property
+    def async_client(self):
+        """Async client for the asyncio serving mode, created on first use"""
+        if self._async_client is None:
+            import openai
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key)
+        return self._async_client
+
+    def warm_up(self):
+        self.client
+
+    def cache_params(self):
+        return {'max_tokens': self.max_tokens, 'temperature': self.temperature}
+
+    def _params(self, messages, **extra):
+        return dict(model=self.model_name, messages=messages,
+                    max_tokens=self.max_tokens, temperature=self.temperature, **extra)
+
+    def generate(self, prompt):
+        response = self.client.chat.completions.create(**self._params(prompt))
+        return response.choices[0].message.content
+
+    def stream(self, prompt):
+        for chunk in self.client.chat.completions.create(**self._params(prompt, stream=True)):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def generate_async(self, prompt):
+        response = await self.async_client.chat.completions.create(**self._params(prompt))
+        return response.choices[0].message.content
+
+    async def stream_async(self, prompt):
+        async for chunk in await self.async_client.chat.completions.create(**self._params(prompt, stream=True)):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeProvider(LLMProvider):
+    """Deterministic offline backend for tests and benchmarks.
+
+    Replies echo the last user message.  ``latency`` is the delay before the
+    first token and ``token_rate`` (tokens/second) paces the rest, so
+    latency-sensitive code can be measured without a real model.
+    """
+
+    name = 'fake'
+    model_name = 'fake-echo'
+    supports_streaming = True
+    supports_batching = True
+    supports_token_counting = True
+
+    def __init__(self, latency=0.0, token_rate=None, prompt_style='text'):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.prompt_style = prompt_style
+        self.calls = 0
+
+    def reply(self, prompt):
+        """The deterministic response for a prompt"""
+        if isinstance(prompt, list):
+            users = [m.get("content", "") for m in prompt if m.get("role") == "user"]
+            last = users[-1] if users else ""
+        else:
+            last = prompt.rsplit("User: ", 1)[-1]
+        return f"Echo: {last[:200]}"
+
+    def _chunks(self, text):
+        words = text.split(" ")
+        return [w if i == len(words) - 1 else w + " " for i, w in enumerate(words)]
+
+    def _token_delay(self, text):
+        return estimate_tokens(text) / self.token_rate if self.token_rate else 0.0
+
+    def generate(self, prompt):
+        self.calls += 1
+        text = self.reply(prompt)
+        time.sleep(self.latency + self._token_delay(text))
+        return text
+
+    def stream(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        for chunk in self._chunks(self.reply(prompt)):
+            time.sleep(self._token_delay(chunk))
+            yield chunk
+
+    def generate_batch(self, prompts):
+        # One round trip for the whole batch
+        self.calls += 1
+        texts = [self.reply(prompt) for prompt in prompts]
+        time.sleep(self.latency + max((self._token_delay(t) for t in texts), default=0.0))
+        return texts
+
+    async def generate_async(self, prompt):
+        import asyncio
+
+        self.calls += 1
+        text = self.reply(prompt)
+        await asyncio.sleep(self.latency + self._token_delay(text))
+        return text
+
+    async def stream_async(self, prompt):
+        import asyncio
+
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self.reply(prompt)):
+            await asyncio.sleep(self._token_delay(chunk))
+            yield chunk
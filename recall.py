@@ -0,0 +1,346 @@
+"""
+Long-term recall of past turns through a vector index
+
+Only the newest turns fit in the prompt window: older ones were gone, and
+the ones still in the window cost tokens every turn.  Every completed turn
+is now embedded and appended to a vector index kept next to the
+conversation's memory file.  When a prompt is built, the earlier turns
+most similar to the new message that have left the window come back as
+one short system message.
+
+The index is append-only float32 rows, memory-mapped for search (a NumPy
+matrix-vector product and argpartition), so opening a conversation reads
+nothing and each turn costs one embedding and one append.  ``HashEmbedder``
+is a deterministic feature-hashing embedding that needs no model; set
+``RECALL_EMBEDDER=module:factory`` to plug in a local embedding model.
+NumPy is optional: without it recall is off.
+"""
+import os
+import json
+import zlib
+import shutil
+import threading
+
+from retrieval_index import tokenize
+
+# Recall earlier turns into the prompt ("0" turns it off)
+RECALL = os.getenv('RECALL', '1') not in ('', '0')
+RECALL_TOP_K = int(os.getenv('RECALL_TOP_K', '3'))
+# Cosine similarity a turn needs to be recalled
+RECALL_MIN_SCORE = float(os.getenv('RECALL_MIN_SCORE', '0.25'))
+RECALL_DIM = int(os.getenv('RECALL_DIM', '256'))
+# "module:factory" returning an embedder; empty uses HashEmbedder
+RECALL_EMBEDDER = os.getenv('RECALL_EMBEDDER', '')
+# Characters of each recalled turn put back into the prompt
+RECALL_TURN_CHARS = int(os.getenv('RECALL_TURN_CHARS', '1200'))
+
+RECALL_HEADER = "Relevant earlier conversation (recalled from long-term memory):"
+
+# Words too common to say anything about what a turn is about
+STOP_WORDS = frozenset("""
+    an and are as at be but by can do does for from has have he her his how if in into is it its
+    me my no not of on or our she so that the their them then there these they this to was we
+    were what when where which who why will with would you your yes
+""".split())
+
+
+class HashEmbedder:
+    """Deterministic bag-of-words embedding by feature hashing, no model needed.
+
+    Words and adjacent word pairs are hashed into ``dim`` signed buckets
+    and the vector is L2-normalised, so cosine similarity follows shared
+    vocabulary.  Good enough to find "the turn about X"; also the stub
+    the tests use.
+    """
+
+    name = 'hash'
+
+    def __init__(self, dim=RECALL_DIM):
+        self.dim = dim
+
+    def __call__(self, texts):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [w for w in tokenize(text) if w not in STOP_WORDS]
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in features),
+                                 dtype=np.uint32, count=len(features))
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        # Dampen repeated words, then normalise for cosine similarity
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def load_embedder(spec=RECALL_EMBEDDER):
+    """The configured embedder: a callable from a list of texts to an (n, dim) float32 array"""
+    if not spec:
+        return HashEmbedder()
+    import importlib
+
+    module, _, factory = spec.partition(':')
+    embedder = getattr(importlib.import_module(module), factory)()
+    if not getattr(embedder, 'name', None):
+        embedder.name = spec
+    return embedder
+
+
+class VectorIndex:
+    """Append-only float32 vectors on disk, memory-mapped for top-k search.
+
+    A directory holds ``vectors.f32`` (one row per entry), ``meta.bin`` (the
+    byte offset of each entry's record in ``records.jsonl`` and a 32-bit key
+    the caller can exclude by) and ``info.json`` (dimension and embedder).
+    The entry count is whatever both binary files fully contain, so a write
+    cut short is ignored, and the next append first cuts all three files back
+    to the last complete entry so that new rows line up again.
+    """
+
+    META_FIELDS = [('offset', '<i8'), ('key', '<u4')]
+
+    def __init__(self, path, dim, embedder_name='hash'):
+        self.path = path
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self._lock = threading.Lock()
+        self._checked = False
+        self._vectors = self._meta = None
+        self._mapped = 0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _size(self, name):
+        try:
+            return os.path.getsize(self._file(name))
+        except OSError:
+            return 0
+
+    def __len__(self):
+        import numpy as np
+
+        return min(self._size('vectors.f32') // (4 * self.dim),
+                   self._size('meta.bin') // np.dtype(self.META_FIELDS).itemsize)
+
+    def _check_info(self):
+        """Start over if the index was built with another embedder or dimension"""
+        # Another process may have cleared the index since
+        if self._checked and os.path.exists(self._file('info.json')):
+            return
+        self._checked = True
+        info = {'dim': self.dim, 'embedder': self.embedder_name}
+        try:
+            with open(self._file('info.json'), encoding='utf-8') as f:
+                if json.load(f) == info:
+                    return
+        except (OSError, ValueError):
+            pass
+        self._clear_files()
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file('info.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+
+    def _truncate(self):
+        """Drop whatever a write cut short left past the last complete entry"""
+        import numpy as np
+
+        row = np.dtype(self.META_FIELDS).itemsize
+        count, end = len(self), 0
+        if count:
+            with open(self._file('meta.bin'), 'rb') as meta, open(self._file('records.jsonl'), 'rb') as records:
+                while count:
+                    meta.seek((count - 1) * row)
+                    offset = int(np.frombuffer(meta.read(row), dtype=self.META_FIELDS)['offset'][0])
+                    records.seek(offset)
+                    line = records.readline()
+                    if line.endswith(b'\n'):
+                        end = offset + len(line)
+                        break
+                    count -= 1
+        if count < self._mapped:
+            self._vectors = self._meta = None
+            self._mapped = 0
+        for name, size in (('vectors.f32', count * 4 * self.dim), ('meta.bin', count * row),
+                           ('records.jsonl', end)):
+            if self._size(name) > size:
+                os.truncate(self._file(name), size)
+
+    def add(self, vectors, keys, records):
+        """Append rows of ``vectors`` with their keys and JSON-able records"""
+        import numpy as np
+
+        if not records:
+            return
+        with self._lock:
+            self._check_info()
+            self._truncate()
+            offsets = []
+            with open(self._file('records.jsonl'), 'ab') as f:
+                for record in records:
+                    offsets.append(f.tell())
+                    f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            meta = np.empty(len(records), dtype=self.META_FIELDS)
+            meta['offset'] = offsets
+            meta['key'] = keys
+            with open(self._file('meta.bin'), 'ab') as f:
+                f.write(meta.tobytes())
+            with open(self._file('vectors.f32'), 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+    def _map(self):
+        """Map the entries on disk, remapping when another writer has appended"""
+        import numpy as np
+
+        count = len(self)
+        if count != self._mapped:
+            self._vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r',
+                                      shape=(count, self.dim)) if count else None
+            self._meta = np.memmap(self._file('meta.bin'), dtype=self.META_FIELDS, mode='r',
+                                   shape=(count,)) if count else None
+            self._mapped = count
+        return count
+
+    def search(self, query, k, min_score=-1.0, exclude_keys=()):
+        """The ``k`` entries most similar to ``query`` as (score, record), best first"""
+        import numpy as np
+
+        with self._lock:
+            self._check_info()
+            count = self._map()
+            if not count or k <= 0:
+                return []
+            scores = self._vectors @ np.asarray(query, dtype=np.float32)
+            if exclude_keys:
+                scores[np.isin(self._meta['key'], np.fromiter(exclude_keys, dtype=np.uint32))] = -np.inf
+            k = min(k, count)
+            top = np.argpartition(scores, count - k)[count - k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [(float(scores[i]), self._record(int(self._meta['offset'][i])))
+                    for i in top if scores[i] >= min_score]
+
+    def _record(self, offset):
+        with open(self._file('records.jsonl'), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _clear_files(self):
+        self._vectors = self._meta = None
+        self._mapped = 0
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._clear_files()
+            self._checked = False
+
+
+def turn_key(text):
+    """Key of a turn: its user message, so turns still in the prompt can be left out"""
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def completed_turns(history):
+    """(user, assistant) contents of each answered user message, oldest first"""
+    turns = []
+    for previous, message in zip(history, history[1:]):
+        if previous.get("role") == "user" and message.get("role") == "assistant":
+            turns.append((previous.get("content", ""), message.get("content", "")))
+    return turns
+
+
+class ConversationRecall:
+    """The long-term memory of one conversation"""
+
+    def __init__(self, path, embedder=None, top_k=RECALL_TOP_K, min_score=RECALL_MIN_SCORE,
+                 turn_chars=RECALL_TURN_CHARS):
+        self.path = path
+        self.top_k = top_k
+        self.min_score = min_score
+        self.turn_chars = turn_chars
+        self._embedder = embedder
+        self._index = None
+        # Whether older history has been checked for turns to index
+        self._synced = False
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = load_embedder()
+        return self._embedder
+
+    @property
+    def index(self):
+        if self._index is None:
+            embedder = self.embedder
+            dim = getattr(embedder, 'dim', None) or embedder(["dimension probe"]).shape[1]
+            self._index = VectorIndex(self.path, dim, embedder.name)
+        return self._index
+
+    def _add(self, turns):
+        if turns:
+            # Embed a turn by its opening: enough to say what it was about
+            vectors = self.embedder([f"{user}\n{assistant}"[:4000] for user, assistant in turns])
+            self.index.add(vectors, [turn_key(user) for user, _ in turns],
+                           [{'user': user, 'assistant': assistant} for user, assistant in turns])
+
+    def sync(self, history):
+        """Index the turns of a history saved before there was an index (once)"""
+        if not self._synced:
+            self._synced = True
+            if not len(self.index):
+                self._add(completed_turns(history))
+
+    def remember(self, history):
+        """Index the turn that just completed (the last two messages)"""
+        self.sync(history[:-2])
+        self._add(completed_turns(history[-2:]))
+
+    def recall(self, query, window=()):
+        """Earlier turns most similar to ``query``, leaving out turns in ``window``"""
+        exclude = {turn_key(m.get("content", "")) for m in window if m.get("role") == "user"}
+        exclude.add(turn_key(query))
+        hits = self.index.search(self.embedder([query])[0], self.top_k, self.min_score, exclude)
+        # Oldest first reads like the conversation did
+        return [record for _, record in hits][::-1]
+
+    def message(self, query, window=()):
+        """System message carrying the recalled turns, or None"""
+        from messages import Message
+
+        turns = self.recall(query, window)
+        if not turns:
+            return None
+        limit = self.turn_chars
+        lines = [RECALL_HEADER]
+        for turn in turns:
+            lines.append(f"User: {turn['user'][:limit]}")
+            lines.append(f"Assistant: {turn['assistant'][:limit]}")
+        return Message("system", "\n".join(lines))
+
+    def clear(self):
+        self.index.clear()
+        self._synced = True
+
+
+_warned = False
+
+
+def open_recall(memory_file):
+    """Long-term memory stored next to a memory file, or None when recall is off"""
+    global _warned
+    if not RECALL:
+        return None
+    import importlib.util
+
+    if importlib.util.find_spec('numpy') is None:
+        if not _warned:
+            _warned = True
+            print("⚠️ Long-term recall needs numpy - run: pip install numpy")
+        return None
+    return ConversationRecall(os.path.splitext(memory_file)[0] + '.recall')
@@ -0,0 +1,152 @@
+"""
+Cache of model responses for byte-identical prompts
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# "memory", "disk" (memory + SQLite tier) or empty to disable
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', '')
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB', 'response_cache.db')
+RESPONSE_CACHE_DISK_SIZE = int(os.getenv('RESPONSE_CACHE_DISK_SIZE', '100000'))
+
+
+def prompt_key(provider, prompt):
+    """Hash of the rendered prompt plus the model name and parameters"""
+    material = json.dumps([provider.name, provider.model_name, provider.cache_params(), prompt],
+                          ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU of responses with TTL and an optional SQLite tier.
+
+    Memory misses fall through to the disk tier (when ``db_path`` is set),
+    and disk hits are promoted back into memory, so the cache survives
+    restarts and is shared by every process using the same database.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=None,
+                 max_disk_entries=RESPONSE_CACHE_DISK_SIZE, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self):
+        if self._conn is None and self.db_path:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at)')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Cached response for a key, or None"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self.db_path:
+                row = self.conn.execute(
+                    'SELECT response, expires_at FROM responses WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """Store a response under a key"""
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, response)
+            if self.db_path:
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                                      (key, response, expires_at))
+                self._disk_writes += 1
+                if self._disk_writes % 100 == 0:
+                    self._prune_disk()
+
+    def _remember(self, key, expires_at, response):
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        """Drop expired rows and keep the newest ``max_disk_entries``"""
+        with self.conn:
+            self.conn.execute('DELETE FROM responses WHERE expires_at <= ?', (self.clock(),))
+            self.conn.execute(
+                'DELETE FROM responses WHERE key NOT IN '
+                '(SELECT key FROM responses ORDER BY expires_at DESC LIMIT ?)', (self.max_disk_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.db_path:
+                with self.conn:
+                    self.conn.execute('DELETE FROM responses')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide cache configured by RESPONSE_CACHE, or None when disabled"""
+    global _default_cache
+    if not RESPONSE_CACHE:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            db_path = RESPONSE_CACHE_DB if RESPONSE_CACHE == 'disk' else None
+            _default_cache = ResponseCache(db_path=db_path)
+            metrics.register_stats('chat_response_cache', _default_cache.stats,
+                                   counters=('hits', 'disk_hits', 'misses'))
+    return _default_cache
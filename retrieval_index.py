@@ -0,0 +1,321 @@
+"""
+Local retrieval index over the working directory for /ask
+
+Text files under the index root are split into line-aligned chunks and
+stored in a BM25 inverted index in SQLite.  ``refresh()`` only re-reads
+files whose mtime or size changed since the last run, so keeping the index
+current costs one directory walk plus the changed files.  Walks run in
+a background thread; only the very first build makes a query wait.
+"""
+import os
+import re
+import math
+import time
+import sqlite3
+import fnmatch
+import threading
+from collections import Counter
+
+from file_reader import TEXT_EXTENSIONS
+from session_store import SESSION_DIR
+from memory_store import DEFAULT_MEMORY_FILES
+
+INDEX_DB = os.getenv('INDEX_DB', '.chat_index.db')
+INDEX_ROOT = os.getenv('INDEX_ROOT', '.')
+# Seconds between directory walks triggered by /ask
+INDEX_REFRESH_INTERVAL = float(os.getenv('INDEX_REFRESH_INTERVAL', '30'))
+INDEX_MAX_FILE_BYTES = int(os.getenv('INDEX_MAX_FILE_BYTES', str(1024 * 1024)))
+ASK_TOP_K = int(os.getenv('ASK_TOP_K', '5'))
+CHUNK_LINES = 40
+CHUNK_BYTES = 2000
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+COMMON_TERM_RATIO = 0.5
+
+SKIP_DIRS = {'__pycache__', 'node_modules', 'venv', 'env', 'chat_sessions'}
+# Conversation history (memory files, recall indexes, archives) is private and
+# rewritten every turn, so it is never indexed: nor are the CHAT_SESSION_DIR,
+# the chatbots' default memory files or any file with a memory journal next to it
+SKIP_DIR_PATTERNS = ('*.recall', '*.archive')
+SKIP_FILE_PATTERNS = ('*.archive.jsonl', '*.json.tmp')
+
+_TOKEN_RE = re.compile(r'[a-z0-9]{2,}')
+
+
+def tokenize(text):
+    """Lowercase word tokens (identifiers are split on underscores)"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def chunk_file(path, max_lines=CHUNK_LINES, max_bytes=CHUNK_BYTES):
+    """Yield (start_byte, end_byte, start_line, end_line, text) chunks of a file"""
+    with open(path, 'rb') as f:
+        lines, size, start_byte, start_line, offset, line_no = [], 0, 0, 1, 0, 0
+        for line in f:
+            line_no += 1
+            lines.append(line)
+            size += len(line)
+            offset += len(line)
+            if len(lines) >= max_lines or size >= max_bytes:
+                yield start_byte, offset, start_line, line_no, b''.join(lines).decode('utf-8', errors='replace')
+                lines, size, start_byte, start_line = [], 0, offset, line_no + 1
+        if lines:
+            yield start_byte, offset, start_line, line_no, b''.join(lines).decode('utf-8', errors='replace')
+
+
+def _skipped(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_files(root, session_dir=SESSION_DIR, memory_files=DEFAULT_MEMORY_FILES):
+    """Yield (path, mtime_ns, size) for indexable files under root"""
+    session_dir = os.path.abspath(session_dir)
+    memory_paths = {os.path.abspath(path) for path in memory_files}
+    memory_names = {os.path.basename(path) for path in memory_files}
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS and not _skipped(entry.name, SKIP_DIR_PATTERNS) \
+                            and os.path.abspath(entry.path) != session_dir:
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(TEXT_EXTENSIONS) and not _skipped(entry.name, SKIP_FILE_PATTERNS) \
+                        and entry.name + '.journal' not in names \
+                        and not (entry.name in memory_names and os.path.abspath(entry.path) in memory_paths):
+                    st = entry.stat()
+                    if st.st_size <= INDEX_MAX_FILE_BYTES:
+                        yield os.path.relpath(entry.path, root), st.st_mtime_ns, st.st_size
+            except OSError:
+                continue
+
+
+class RetrievalIndex:
+    """BM25 index of file chunks, persisted in SQLite and updated by mtime"""
+
+    def __init__(self, root=INDEX_ROOT, db_path=INDEX_DB, refresh_interval=INDEX_REFRESH_INTERVAL):
+        self.root = root
+        self.db_path = db_path if os.path.isabs(db_path) else os.path.join(root, db_path)
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+        # Refreshes write through their own connection, so (in WAL mode)
+        # searches keep reading the last committed index meanwhile
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+        self._stats = None  # (chunk count, average chunk length)
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-65536')  # 64 MB for bulk (re)indexing
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                start_byte INTEGER NOT NULL,
+                end_byte INTEGER NOT NULL,
+                start_line INTEGER NOT NULL,
+                end_line INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                terms TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_path ON chunks (path);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                length INTEGER NOT NULL,  -- the chunk's length, kept here to avoid a join when scoring
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+        ''')
+        return conn
+
+    def refresh(self):
+        """Re-index new and changed files and drop deleted ones.
+
+        Returns counts of files added/updated, removed and unchanged.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            known = dict(((path, (mtime, size)) for path, mtime, size
+                          in conn.execute('SELECT path, mtime_ns, size FROM files')))
+            updated = unchanged = 0
+            with conn:
+                for path, mtime, size in walk_files(self.root):
+                    if known.pop(path, None) == (mtime, size):
+                        unchanged += 1
+                        continue
+                    self._remove(conn, path)
+                    self._add(conn, path, mtime, size)
+                    updated += 1
+                for path in known:
+                    self._remove(conn, path)
+            self.last_refresh = time.time()
+            if updated or known:
+                with self._lock:
+                    self._stats = None
+            return {'updated': updated, 'removed': len(known), 'unchanged': unchanged}
+
+    def _add(self, conn, path, mtime, size):
+        try:
+            chunks = list(chunk_file(os.path.join(self.root, path)))
+        except OSError:
+            return
+        conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, mtime, size))
+        postings = []
+        for start_byte, end_byte, start_line, end_line, text in chunks:
+            terms = Counter(tokenize(text))
+            if not terms:
+                continue
+            chunk_id = conn.execute(
+                'INSERT INTO chunks (path, start_byte, end_byte, start_line, end_line, length, terms) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, start_byte, end_byte, start_line, end_line, sum(terms.values()), ' '.join(terms))
+            ).lastrowid
+            length = sum(terms.values())
+            postings.extend((term, chunk_id, tf, length) for term, tf in terms.items())
+        conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', postings)
+
+    def _remove(self, conn, path):
+        # Postings are keyed by term, so delete them through each chunk's term list
+        for chunk_id, terms in conn.execute('SELECT id, terms FROM chunks WHERE path = ?', (path,)).fetchall():
+            conn.executemany('DELETE FROM postings WHERE term = ? AND chunk_id = ?',
+                             ((term, chunk_id) for term in terms.split()))
+        conn.execute('DELETE FROM chunks WHERE path = ?', (path,))
+        conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def maybe_refresh(self):
+        """Start a background refresh if the last walk is older than ``refresh_interval``.
+
+        Returns the refresh thread while one is running, else None.
+        """
+        with self._refresher_lock:
+            if self._refresher is None and time.time() - self.last_refresh >= self.refresh_interval:
+                self._refresher = threading.Thread(target=self._background_refresh, name='index-refresh',
+                                                   daemon=True)
+                self._refresher.start()
+            return self._refresher
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"⚠️ Could not refresh the file index: {e}")
+        finally:
+            with self._refresher_lock:
+                self._refresher = None
+
+    def search(self, query, k=ASK_TOP_K):
+        """Top ``k`` chunks for a query as dicts with path, lines, score and text"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            if self._stats is None:
+                count, avg = self.conn.execute('SELECT COUNT(*), AVG(length) FROM chunks').fetchone()
+                self._stats = (count, avg or 1.0)
+            total, avg_length = self._stats
+            # Document frequencies come from the postings' primary key index
+            placeholders = ','.join('?' * len(terms))
+            dfs = self.conn.execute(
+                f'SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term', list(terms)
+            ).fetchall()
+            # Terms in most chunks (stopwords) barely change the ranking but dominate
+            # the scoring cost, so they are dropped unless nothing else matched
+            dfs = [(term, df) for term, df in dfs if df <= total * COMMON_TERM_RATIO] or dfs
+            if not dfs:
+                return []
+            weights = []
+            for term, df in dfs:
+                weights += [term, math.log(1 + (total - df + 0.5) / (df + 0.5))]
+            # Score in SQLite rather than looping over every posting in Python
+            ranked = self.conn.execute(
+                f'WITH q(term, idf) AS (VALUES {",".join(["(?, ?)"] * len(dfs))}) '
+                'SELECT p.chunk_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * p.length / ?))) AS score '
+                'FROM q JOIN postings p ON p.term = q.term '
+                'GROUP BY p.chunk_id ORDER BY score DESC LIMIT ?',
+                weights + [K1 + 1, K1, B, B, avg_length, k]
+            ).fetchall()
+
+            results = []
+            for chunk_id, score in ranked:
+                path, start_byte, end_byte, start_line, end_line = self.conn.execute(
+                    'SELECT path, start_byte, end_byte, start_line, end_line FROM chunks WHERE id = ?',
+                    (chunk_id,)
+                ).fetchone()
+                results.append({'path': path, 'start_line': start_line, 'end_line': end_line,
+                                'score': score, 'text': self._chunk_text(path, start_byte, end_byte)})
+            return results
+
+    def _chunk_text(self, path, start_byte, end_byte):
+        try:
+            with open(os.path.join(self.root, path), 'rb') as f:
+                f.seek(start_byte)
+                return f.read(end_byte - start_byte).decode('utf-8', errors='replace')
+        except OSError:
+            return ''
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def ask_prompt(question, results):
+    """Prompt for answering a question from retrieved file chunks"""
+    if not results:
+        return f"I couldn't find anything about this in the local files. Please answer if you can: {question}"
+    excerpts = "\n\n".join(f"[{r['path']}:{r['start_line']}-{r['end_line']}]\n{r['text'].strip()}" for r in results)
+    return (f"Answer the question using these excerpts from local files, citing them as path:lines:\n\n"
+            f"{excerpts}\n\nQuestion: {question}")
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_index():
+    """The process-wide index of INDEX_ROOT, refreshed in the background at most every INDEX_REFRESH_INTERVAL.
+
+    Callers wait only while the index is built for the first time (and the
+    commands calling this run under a timeout).
+    """
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = RetrievalIndex()
+    refresher = _default_index.maybe_refresh()
+    if refresher is not None and not _default_index.last_refresh:
+        refresher.join()
+    return _default_index
@@ -0,0 +1,415 @@
+"""
+Admission control between the chat routes and the model provider
+
+Without it, a burst of users is a burst of concurrent provider calls, which
+runs into the backend's rate limits and fails for everyone at once.  Calls
+now go through a ``Scheduler``: at most ``SCHED_CONCURRENCY`` run at a time,
+a token bucket caps them at ``SCHED_RATE`` per second, and the rest wait in
+a bounded queue where short prompts go first.  When the backend can batch,
+generate calls that are queued together go out as one batch.
+
+A full queue, or a call that waited longer than ``SCHED_QUEUE_TIMEOUT``,
+fails fast with ``SchedulerBusy``; the web routes answer it with 503 and
+``Retry-After`` so clients back off instead of piling on.
+"""
+import os
+import time
+import threading
+
+import metrics
+from prompt_builder import estimate_tokens
+
+# Provider calls in flight at once (0 disables the scheduler)
+SCHED_CONCURRENCY = int(os.getenv('SCHED_CONCURRENCY', '4'))
+# Calls allowed to wait for a slot, and for how long
+SCHED_QUEUE_SIZE = int(os.getenv('SCHED_QUEUE_SIZE', '64'))
+SCHED_QUEUE_TIMEOUT = float(os.getenv('SCHED_QUEUE_TIMEOUT', '30'))
+# Provider calls per second (0 = unlimited) and how many may go back to back
+SCHED_RATE = float(os.getenv('SCHED_RATE', '0'))
+SCHED_BURST = int(os.getenv('SCHED_BURST', '0')) or max(1, int(SCHED_RATE))
+# Queue priority a prompt gives up per 1000 tokens: a 4000-token prompt
+# queues as if it had arrived 4 * SCHED_TOKEN_DEFER seconds later
+SCHED_TOKEN_DEFER = float(os.getenv('SCHED_TOKEN_DEFER', '0.5'))
+# Most queued generate calls sent as one batch (1 disables batching)
+SCHED_BATCH_SIZE = int(os.getenv('SCHED_BATCH_SIZE', '8'))
+
+
+class SchedulerBusy(RuntimeError):
+    """A call was turned away; try again after ``retry_after`` seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def prompt_tokens(prompt):
+    """Estimated tokens of a text or message-list prompt"""
+    if isinstance(prompt, list):
+        return sum(estimate_tokens(m.get("content", "")) for m in prompt)
+    return estimate_tokens(prompt)
+
+
+class TokenBucket:
+    """``rate`` takes per second on average, up to ``burst`` at once.
+
+    Not thread-safe on its own; the scheduler only uses it under its lock.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        if not self.rate:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the next take can succeed"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Ticket:
+    """One call waiting for (or holding) a slot"""
+
+    __slots__ = ('priority', 'enqueued', 'prompt', 'batchable', 'state', 'waited',
+                 'result', 'error', '_event', '_loop', '_future')
+
+    def __init__(self, priority, enqueued, prompt, batchable, loop=None, future=None):
+        self.priority = priority
+        self.enqueued = enqueued
+        self.prompt = prompt
+        self.batchable = batchable
+        # queued -> running (holds a slot) or batched (rides on another call's batch); expired
+        self.state = 'queued'
+        self.waited = 0.0
+        self.result = None
+        self.error = None
+        self._event = threading.Event() if future is None else None
+        self._loop = loop
+        self._future = future
+
+    def wake(self):
+        if self._future is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class Scheduler:
+    """Bounded, rate-limited, shortest-prompt-first queue in front of a provider"""
+
+    def __init__(self, concurrency=SCHED_CONCURRENCY, queue_size=SCHED_QUEUE_SIZE,
+                 queue_timeout=SCHED_QUEUE_TIMEOUT, rate=SCHED_RATE, burst=SCHED_BURST,
+                 token_defer=SCHED_TOKEN_DEFER, batch_size=SCHED_BATCH_SIZE, clock=time.monotonic):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.token_defer = token_defer
+        self.batch_size = batch_size
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock)
+        self._waiting = []
+        self._active = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.batches = 0
+        self.batched_calls = 0
+        self.wait_seconds = 0.0
+
+    # -- admission ---------------------------------------------------------
+
+    def _retry_after(self):
+        # Roughly one queue timeout's worth of backlog ahead; at least a second
+        return max(1, round(min(self.queue_timeout, len(self._waiting) / max(1, self.concurrency))))
+
+    def _enqueue(self, tokens, prompt=None, batchable=False, loop=None, future=None):
+        now = self.clock()
+        ticket = _Ticket(now + tokens / 1000 * self.token_defer, now, prompt, batchable, loop, future)
+        with self._lock:
+            self._waiting.append(ticket)
+            self._dispatch()
+            if ticket.state == 'queued' and len(self._waiting) > self.queue_size:
+                self._waiting.remove(ticket)
+                ticket.state = 'expired'
+                self.rejected += 1
+                raise SchedulerBusy("Too many requests are waiting for the model, please retry shortly",
+                                    self._retry_after())
+        return ticket
+
+    def _dispatch(self):
+        """Hand free slots to the best queued calls (lock held)"""
+        while self._waiting and self._active < self.concurrency:
+            if not self.bucket.try_take():
+                self._schedule_refill()
+                return
+            ticket = min(self._waiting, key=lambda t: t.priority)
+            self._waiting.remove(ticket)
+            self._grant(ticket, 'running')
+            self._active += 1
+
+    def _grant(self, ticket, state):
+        ticket.state = state
+        ticket.waited = self.clock() - ticket.enqueued
+        self.admitted += 1
+        self.wait_seconds += ticket.waited
+        if state == 'running':
+            ticket.wake()
+
+    def _schedule_refill(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.bucket.wait_time(), self._refilled)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _refilled(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _expire(self, ticket):
+        """Give up on a call that is still queued after the queue timeout"""
+        with self._lock:
+            if ticket.state != 'queued':
+                return
+            self._waiting.remove(ticket)
+            ticket.state = 'expired'
+            self.timed_out += 1
+            retry_after = self._retry_after()
+        raise SchedulerBusy(f"Timed out after {self.queue_timeout:g}s waiting for the model", retry_after)
+
+    def _abandon(self, ticket):
+        """Undo admission for a caller that went away (e.g. a cancelled task)"""
+        with self._lock:
+            if ticket.state == 'queued':
+                self._waiting.remove(ticket)
+                ticket.state = 'expired'
+            elif ticket.state == 'running':
+                ticket.state = 'expired'
+                self._active -= 1
+                self._dispatch()
+
+    def _admitted(self, ticket):
+        metrics.observe('chat_queue_wait_seconds', ticket.waited)
+        metrics.record_stage('queue', ticket.waited)
+        return ticket
+
+    def acquire(self, tokens=0, prompt=None, batchable=False):
+        """Wait for a slot; the caller must ``release`` the returned ticket"""
+        ticket = self._enqueue(tokens, prompt, batchable)
+        if not ticket._event.wait(self.queue_timeout):
+            self._expire(ticket)
+            # Admitted (or batched) just as we gave up
+            ticket._event.wait()
+        return self._admitted(ticket)
+
+    async def acquire_async(self, tokens=0, prompt=None, batchable=False):
+        """``acquire`` for coroutines: waiting suspends instead of blocking a thread"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket = self._enqueue(tokens, prompt, batchable, loop, future)
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._expire(ticket)
+                await future
+        except BaseException:
+            if ticket.state != 'batched':
+                self._abandon(ticket)
+            raise
+        return self._admitted(ticket)
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.state != 'running':
+                return
+            ticket.state = 'expired'
+            self._active -= 1
+            self._dispatch()
+
+    # -- micro-batching ----------------------------------------------------
+
+    def _take_batch(self, leader):
+        """Queued batchable calls to send along with ``leader``'s"""
+        if not leader.batchable or self.batch_size <= 1:
+            return []
+        with self._lock:
+            followers = sorted((t for t in self._waiting if t.batchable),
+                               key=lambda t: t.priority)[:self.batch_size - 1]
+            for ticket in followers:
+                self._waiting.remove(ticket)
+                self._grant(ticket, 'batched')
+            if followers:
+                self.batches += 1
+                self.batched_calls += len(followers) + 1
+        return followers
+
+    def _run_batch(self, provider, leader, followers):
+        """One generate_batch call for the leader and its followers; returns the leader's result"""
+        try:
+            results = provider.generate_batch([leader.prompt] + [t.prompt for t in followers])
+            for ticket, result in zip(followers, results[1:]):
+                ticket.result = result
+            return results[0]
+        except Exception as e:
+            for ticket in followers:
+                ticket.error = e
+            raise
+        finally:
+            for ticket in followers:
+                ticket.wake()
+            self.release(leader)
+
+    @staticmethod
+    def _follower_result(ticket):
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.result
+
+    # -- provider calls ----------------------------------------------------
+
+    def _batchable(self, provider):
+        return self.batch_size > 1 and provider.supports_batching
+
+    def generate(self, provider, prompt):
+        ticket = self.acquire(prompt_tokens(prompt), prompt, self._batchable(provider))
+        if ticket.state == 'batched':
+            return self._follower_result(ticket)
+        followers = self._take_batch(ticket)
+        if followers:
+            return self._run_batch(provider, ticket, followers)
+        try:
+            return provider.generate(prompt)
+        finally:
+            self.release(ticket)
+
+    async def generate_async(self, provider, prompt):
+        import asyncio
+
+        ticket = await self.acquire_async(prompt_tokens(prompt), prompt, self._batchable(provider))
+        if ticket.state == 'batched':
+            return self._follower_result(ticket)
+        followers = self._take_batch(ticket)
+        if followers:
+            # Releases the slot and wakes the followers even if this task is cancelled
+            return await asyncio.to_thread(self._run_batch, provider, ticket, followers)
+        try:
+            return await provider.generate_async(prompt)
+        finally:
+            self.release(ticket)
+
+    def stream(self, provider, prompt):
+        # The slot is held until the stream is finished or closed
+        ticket = self.acquire(prompt_tokens(prompt))
+        try:
+            yield from provider.stream(prompt)
+        finally:
+            self.release(ticket)
+
+    async def stream_async(self, provider, prompt):
+        ticket = await self.acquire_async(prompt_tokens(prompt))
+        try:
+            async for chunk in provider.stream_async(prompt):
+                yield chunk
+        finally:
+            self.release(ticket)
+
+    def generate_batch(self, provider, prompts):
+        # An explicit batch (e.g. /read summaries) is one provider call
+        ticket = self.acquire(sum(prompt_tokens(p) for p in prompts))
+        try:
+            return provider.generate_batch(prompts)
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        return {
+            'queued': len(self._waiting),
+            'active': self._active,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'batches': self.batches,
+            'batched_calls': self.batched_calls,
+            'wait_seconds': round(self.wait_seconds, 3)
+        }
+
+
+class ScheduledProvider:
+    """A provider whose model calls wait their turn in a Scheduler.
+
+    Everything else (name, prompt_style, capabilities...) is the wrapped
+    provider's, so the engine and the response cache can't tell the
+    difference.
+    """
+
+    def __init__(self, provider, scheduler):
+        self.provider = provider
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def generate(self, prompt):
+        return self.scheduler.generate(self.provider, prompt)
+
+    def stream(self, prompt):
+        return self.scheduler.stream(self.provider, prompt)
+
+    def generate_batch(self, prompts):
+        return self.scheduler.generate_batch(self.provider, prompts)
+
+    async def generate_async(self, prompt):
+        return await self.scheduler.generate_async(self.provider, prompt)
+
+    def stream_async(self, prompt):
+        return self.scheduler.stream_async(self.provider, prompt)
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, or None when SCHED_CONCURRENCY is 0"""
+    global _default_scheduler
+    if not SCHED_CONCURRENCY:
+        return None
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+            metrics.register_stats('chat_scheduler', _default_scheduler.stats,
+                                   counters=('admitted', 'rejected', 'timed_out', 'batches',
+                                             'batched_calls', 'wait_seconds'))
+    return _default_scheduler
+
+
+def scheduled(provider):
+    """Route a provider's calls through the process-wide scheduler (if enabled)"""
+    scheduler = get_scheduler()
+    return provider if scheduler is None else ScheduledProvider(provider, scheduler)
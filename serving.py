@@ -0,0 +1,134 @@
+"""
+Headless production serving in several worker processes
+
+``python chatbot.py --serve`` (or ``web_chatbot.py --serve``) replaces
+Flask's development server with gunicorn, or with uvicorn when ``--async``
+is given, running ``SERVE_WORKERS`` processes and no browser.  Every worker
+builds its own app from a factory such as ``chatbot:create_wsgi_app()``,
+and the state workers have to agree on lives in SQLite files instead of
+process memory:
+
+- conversations use the SQLite memory backend; a per-session file lock
+  keeps one conversation in one worker at a time, and a worker reloads a
+  conversation another worker has changed since
+- background jobs go into ``JOB_DB``, so any worker can poll or cancel them
+- the response cache stays opt-in; ``RESPONSE_CACHE=disk`` shares it
+
+``SCHED_CONCURRENCY`` and ``SCHED_RATE`` stay limits for the whole server:
+each worker gets an equal share, split by the worker count gunicorn
+actually runs (``--workers``/``-w`` included).  Usage:
+    python chatbot.py --serve [--workers N] [--host HOST] [--port PORT] [--async]
+"""
+import os
+import sys
+import argparse
+import importlib.util
+
+SERVE_HOST = os.getenv('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.getenv('SERVE_PORT', '5000'))
+# Worker processes (default: one per CPU) and request threads in each
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '0')) or os.cpu_count() or 1
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', '8'))
+SERVE_TIMEOUT = int(os.getenv('SERVE_TIMEOUT', '120'))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+GUNICORN_CONFIG = os.path.join(APP_DIR, 'gunicorn.conf.py')
+
+# State that has to live outside the worker processes
+SHARED_STATE_DEFAULTS = {
+    'MEMORY_BACKEND': 'sqlite',
+    'JOB_DB': 'chat_jobs.db',
+    'CHAT_SHARED_SESSIONS': '1',
+}
+
+
+def shared_state_environment(workers, environ=None):
+    """Environment with the shared-state defaults for ``workers`` worker processes"""
+    env = dict(os.environ if environ is None else environ)
+    for name, value in SHARED_STATE_DEFAULTS.items():
+        env.setdefault(name, value)
+    if workers > 1:
+        if env['MEMORY_BACKEND'] != 'sqlite':
+            print("⚠️ MEMORY_BACKEND is not sqlite: workers will not see each other's conversations")
+        if env.get('RESPONSE_CACHE') == 'memory':
+            print("⚠️ RESPONSE_CACHE=memory: each worker caches responses separately (disk shares them)")
+    return env
+
+
+def worker_environment(workers, environ=None):
+    """Environment for the worker processes: shared state, and each worker's share of the scheduler limits.
+
+    Only reads the environment (nothing imported here may read it first), and
+    applies once.  gunicorn.conf.py applies it with gunicorn's own worker
+    count; uvicorn gets it from the launcher.
+    """
+    env = dict(os.environ if environ is None else environ)
+    if env.get('SERVE_WORKER_SHARE'):
+        return env
+    env = shared_state_environment(workers, env)
+
+    # Same default as scheduler.py; 0 keeps the scheduler off
+    concurrency = int(env.get('SCHED_CONCURRENCY', '4'))
+    if concurrency:
+        env['SCHED_CONCURRENCY'] = str(max(1, -(-concurrency // workers)))
+    rate = float(env.get('SCHED_RATE', '0'))
+    if rate:
+        env['SCHED_RATE'] = str(rate / workers)
+        if env.get('SCHED_BURST'):
+            env['SCHED_BURST'] = str(max(1, int(env['SCHED_BURST']) // workers))
+    env['SERVE_WORKER_SHARE'] = str(workers)
+    return env
+
+
+def gunicorn_settings(workers=SERVE_WORKERS, host=SERVE_HOST, port=SERVE_PORT):
+    """gunicorn settings: threaded workers, so streams and model calls don't block a process"""
+    return {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': SERVE_THREADS,
+        'timeout': SERVE_TIMEOUT,
+        'accesslog': None,
+    }
+
+
+def server_command(module, workers=SERVE_WORKERS, host=SERVE_HOST, port=SERVE_PORT, use_async=False):
+    """Command line and environment that serve ``module``'s app factory in ``workers`` processes"""
+    # gunicorn.conf.py splits the limits once it knows the final worker count
+    env = worker_environment(workers) if use_async else shared_state_environment(workers)
+    # Workers import the app by module name, wherever the server was started from
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [APP_DIR, env.get('PYTHONPATH')]))
+    if use_async:
+        command = [sys.executable, '-m', 'uvicorn', f"{module}:create_asgi_app", '--factory',
+                   '--workers', str(workers), '--host', host, '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', GUNICORN_CONFIG, '--workers', str(workers),
+                   '--bind', f"{host}:{port}", f"{module}:create_wsgi_app()"]
+    return command, env
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve the chatbot with several worker processes")
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS)
+    parser.add_argument('--host', default=SERVE_HOST)
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    parser.add_argument('--async', dest='use_async', action='store_true')
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def serve(module, argv=None):
+    """Replace this process with the production server for ``module`` (e.g. "chatbot")"""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    server = 'uvicorn' if args.use_async else 'gunicorn'
+    if importlib.util.find_spec(server) is None:
+        print(f"❌ Production mode needs {server} - run: pip install {server}")
+        if server == 'gunicorn':
+            print("   (gunicorn does not run on Windows; use --serve --async with uvicorn there)")
+        raise SystemExit(1)
+
+    command, env = server_command(module, args.workers, args.host, args.port, args.use_async)
+    print(f"🚀 Serving {module} with {server}: {args.workers} workers at http://{args.host}:{args.port}")
+    print("⏹️  Press Ctrl+C to stop the server")
+    sys.stdout.flush()
+    os.execve(sys.executable, command, env)
@@ -0,0 +1,255 @@
+"""
+Per-session conversation state for the web chatbots
+"""
+import os
+import re
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process session locks
+    fcntl = None
+
+SESSION_COOKIE = 'chat_session'
+SESSION_DIR = os.getenv('CHAT_SESSION_DIR', 'chat_sessions')
+MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', '100'))
+# Set when several worker processes serve the same sessions (see serving.py)
+SHARED_SESSIONS = os.getenv('CHAT_SHARED_SESSIONS', '') not in ('', '0')
+
+_SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+# Files kept next to a memory file: its journal and its archive
+MEMORY_FILE_SUFFIXES = ('', '.journal', '.archive', '.archive.jsonl')
+
+
+def new_session_id():
+    """Create a random session id"""
+    return uuid.uuid4().hex
+
+
+def is_valid_session_id(session_id):
+    """Check that a client-supplied session id is safe to use in a file name"""
+    return bool(session_id) and bool(_SESSION_ID_RE.match(session_id))
+
+
+def session_memory_file(session_id, session_dir=SESSION_DIR, legacy_file=None):
+    """Memory file used to persist one session.
+
+    ``legacy_file`` is the single memory file used before conversations were
+    split by session; the first new session takes it over.
+    """
+    os.makedirs(session_dir, exist_ok=True)
+    memory_file = os.path.join(session_dir, f"{session_id}.json")
+    if legacy_file and claim_legacy_memory(legacy_file, memory_file):
+        print(f"📦 Moved the conversation in {legacy_file} to session {session_id}")
+    return memory_file
+
+
+def _memory_paths(memory_file):
+    # The memory file, its journal and archive, and its recall index (see recall.open_recall)
+    return [memory_file + suffix for suffix in MEMORY_FILE_SUFFIXES] + \
+        [os.path.splitext(memory_file)[0] + '.recall']
+
+
+def claim_legacy_memory(legacy_file, memory_file):
+    """Move ``legacy_file`` and the files kept next to it to ``memory_file``.
+
+    Nothing moves if ``memory_file`` already has any of them, and a lock in
+    its directory makes sure only one session across processes gets the
+    conversation.  Returns True if it was moved.
+    """
+    if not any(os.path.exists(path) for path in _memory_paths(legacy_file)):
+        return False
+    lock = _FileLock(os.path.join(os.path.dirname(memory_file) or '.', '.legacy.lock'))
+    lock.acquire()
+    try:
+        sources = _memory_paths(legacy_file)
+        targets = _memory_paths(memory_file)
+        if any(os.path.exists(path) for path in targets):
+            return False
+        moved = False
+        for source, target in zip(sources, targets):
+            if os.path.exists(source):
+                os.replace(source, target)
+                moved = True
+        return moved
+    finally:
+        lock.release()
+
+
+class _FileLock:
+    """Exclusive lock on a file, held across processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def release(self):
+        file, self._file = self._file, None
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_UN)
+        file.close()
+
+
+class _Session:
+    __slots__ = ('lock', 'alock', 'bot', 'users')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alock = None
+        self.bot = None
+        self.users = 0
+
+
+class SessionStore:
+    """Keeps one chatbot per session id with per-session locking.
+
+    Only the session table itself is guarded by a global lock; model calls
+    and memory saves run under the owning session's lock, so different
+    sessions never wait on each other.  Once more than ``max_sessions`` are
+    resident, the least recently used idle sessions are dropped and flushed
+    to disk after the table lock is released; they are reloaded from their
+    memory file on the next request, once that flush has finished.
+
+    With ``shared`` set, other processes serve the same sessions: each
+    request also holds a per-session file lock in ``lock_dir``, and a
+    resident chatbot reloads its history if another process changed it.
+    """
+
+    def __init__(self, factory, max_sessions=MAX_SESSIONS, shared=SHARED_SESSIONS, lock_dir=SESSION_DIR):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.shared = shared
+        self.lock_dir = lock_dir
+        self._sessions = OrderedDict()
+        # Evicted sessions whose memory is still being saved, by id
+        self._flushing = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def _acquire(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = _Session()
+            self._sessions.move_to_end(session_id)
+            entry.users += 1
+            return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            evicted = self._evict()
+        # Saved outside the table lock so other sessions don't wait on the disk
+        for session_id, old in evicted:
+            try:
+                old.bot.save_memory()
+            finally:
+                old.lock.release()
+                with self._lock:
+                    if self._flushing.get(session_id) is old:
+                        del self._flushing[session_id]
+
+    def _file_lock(self, session_id):
+        """The session's cross-process lock, or None when sessions aren't shared"""
+        if not self.shared:
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        return _FileLock(os.path.join(self.lock_dir, f"{session_id}.lock"))
+
+    def _checkout(self, entry, session_id):
+        """The session's chatbot, created or brought up to date (caller holds the locks)"""
+        if entry.bot is None:
+            flushing = self._flushing.get(session_id)
+            if flushing is not None:
+                # Evicted a moment ago: wait until its memory is on disk before reloading it
+                with flushing.lock:
+                    pass
+            entry.bot = self.factory(session_id)
+        elif self.shared:
+            entry.bot.reload_if_changed()
+        return entry.bot
+
+    @contextmanager
+    def session(self, session_id):
+        """Yield the session's chatbot while holding its lock"""
+        entry = self._acquire(session_id)
+        try:
+            with entry.lock:
+                file_lock = self._file_lock(session_id)
+                if file_lock is not None:
+                    file_lock.acquire()
+                try:
+                    yield self._checkout(entry, session_id)
+                finally:
+                    if file_lock is not None:
+                        file_lock.release()
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def async_session(self, session_id):
+        """Async variant of ``session`` for event-loop servers.
+
+        Waiting for a busy session suspends the coroutine instead of blocking
+        the loop; loading a session from disk runs in a worker thread.  A
+        store should be served either through ``session`` or through this,
+        not both, since the two use separate locks.
+        """
+        import asyncio
+
+        entry = self._acquire(session_id)
+        if entry.alock is None:
+            entry.alock = asyncio.Lock()
+        try:
+            async with entry.alock:
+                file_lock = self._file_lock(session_id)
+                if file_lock is not None:
+                    await asyncio.to_thread(file_lock.acquire)
+                try:
+                    if entry.bot is None or self.shared:
+                        # Loading from disk or checking for changes: off the loop
+                        await asyncio.to_thread(self._checkout, entry, session_id)
+                    yield entry.bot
+                finally:
+                    if file_lock is not None:
+                        file_lock.release()
+        finally:
+            self._release(entry)
+
+    def _evict(self):
+        """Drop idle sessions beyond the limit (caller holds _lock).
+
+        Returns the (session id, entry) pairs the caller must save once it
+        has released the lock; their locks are held until then.
+        """
+        excess = len(self._sessions) - self.max_sessions
+        evicted = []
+        if excess <= 0:
+            return evicted
+        for session_id in list(self._sessions):
+            if excess <= 0:
+                break
+            entry = self._sessions[session_id]
+            if entry.users:
+                continue
+            del self._sessions[session_id]
+            excess -= 1
+            if entry.bot is not None:
+                # Idle, so this doesn't wait; a reload of the session waits on it
+                entry.lock.acquire()
+                self._flushing[session_id] = entry
+                evicted.append((session_id, entry))
+        return evicted
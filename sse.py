@@ -0,0 +1,51 @@
+"""
+Server-sent events helpers for streaming chat responses
+"""
+import json
+from flask import Response
+
+
+def format_sse(data, event=None, id=None):
+    """Encode one server-sent event with a JSON payload"""
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    if id is not None:
+        # Sent back as Last-Event-ID when the browser reconnects
+        message = f"id: {id}\n{message}"
+    return message
+
+
+def sse_response(chunks):
+    """Stream text chunks as ``delta`` events followed by a ``done`` event"""
+    def generate():
+        for chunk in chunks:
+            yield format_sse({'delta': chunk})
+        yield format_sse({}, event='done')
+
+    return event_stream(generate())
+
+
+def job_sse_response(job, start=0, keepalive=15):
+    """Stream a job's chunks from index ``start`` as ``delta`` events with ids, then ``done``"""
+    def generate():
+        index = start
+        while True:
+            chunks, done = job.wait(index, keepalive)
+            for chunk in chunks:
+                yield format_sse({'delta': chunk}, id=index)
+                index += 1
+            if done:
+                yield format_sse({'status': job.status, 'error': job.error}, event='done')
+                return
+            if not chunks:
+                yield ": keepalive\n\n"
+
+    return event_stream(generate())
+
+
+def event_stream(events):
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
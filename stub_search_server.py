@@ -0,0 +1,95 @@
+"""
+Local stand-in for the DuckDuckGo HTML endpoint, for offline tests and benchmarks
+"""
+import time
+import html
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def render_results_page(query, count=10, filler=0):
+    """Build a DuckDuckGo-style results page.
+
+    ``filler`` adds that many unrelated blocks of markup around the results
+    to approximate the size of a real page.
+    """
+    query = html.escape(query)
+    parts = ['<!DOCTYPE html><html><head><title>%s at DuckDuckGo</title></head><body>' % query]
+    parts.append('<div id="links" class="results">')
+    for i in range(count):
+        parts.append(
+            '<div class="result results_links results_links_deep web-result">'
+            '<div class="links_main links_deep result__body">'
+            f'<h2 class="result__title"><a rel="nofollow" class="result__a" href="https://example.com/{i}?q={query}">'
+            f'Result {i} for {query}</a></h2>'
+            f'<a class="result__snippet" href="https://example.com/{i}">Snippet {i} about <b>{query}</b>.</a>'
+            '</div></div>'
+        )
+    parts.append('</div>')
+    for i in range(filler):
+        parts.append(f'<div class="nav-link"><form><input type="hidden" name="s" value="{i}"></form>'
+                     f'<span class="filler">filler block {i}</span></div>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+class StubSearchServer:
+    """Threaded HTTP server answering ``/html/?q=...`` with canned results.
+
+    Use as a context manager; ``url`` is the search endpoint and
+    ``request_count`` counts the searches served.  ``latency`` delays every
+    response to simulate the network round trip.
+    """
+
+    def __init__(self, latency=0.0, result_count=10, filler=0):
+        self.latency = latency
+        self.result_count = result_count
+        self.filler = filler
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/html/"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.request_count += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+                body = render_results_page(query, stub.result_count, stub.filler).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -55,12 +55,1595 @@ def test_file_operations():
         except Exception as e:
             print(f"❌ Error reading README.md: {e}")
 
+def test_memory_journal():
+    """Test append-only memory journal and snapshot replay"""
+    import os
+    import tempfile
+    from memory_store import JournalMemoryStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        store = JournalMemoryStore(memory_file, min_compact_entries=4)
+        history = [{"role": "system", "content": "sys"}]
+        store.save(history)
+        for i in range(5):
+            history.append({"role": "user", "content": f"q{i}"})
+            history.append({"role": "assistant", "content": f"a{i}"})
+            store.save(history)
+        assert store.generation > 0, "journal should have been compacted"
+        assert JournalMemoryStore(memory_file).load() == history
+
+        # A reset (e.g. /clear) rewrites the snapshot and drops stale entries
+        history = history[:1]
+        store.save(history)
+        assert JournalMemoryStore(memory_file).load() == history
+
+        # A torn final journal line is ignored on replay
+        history.append({"role": "user", "content": "hi"})
+        store.save(history)
+        with open(store.journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"gen": ')
+        assert JournalMemoryStore(memory_file).load() == history
+
+def test_prompt_builder():
+    """Test token-budgeted prompt window and segment cache"""
+    from prompt_builder import PromptBuilder, estimate_tokens
+
+    system = {"role": "system", "content": "You are helpful."}
+    history = [system]
+    for i in range(50):
+        history.append({"role": "user", "content": f"question {i} " * 20})
+        history.append({"role": "assistant", "content": f"answer {i} " * 20})
+    history.append(system)
+    history.append({"role": "user", "content": "latest"})
+
+    builder = PromptBuilder(token_budget=300)
+    prompt = builder.build(history)
+    assert prompt.startswith("System: You are helpful.")
+    assert prompt.endswith("User: latest")
+    assert prompt.count("System:") == 1
+    assert "question 0 " not in prompt
+    assert builder.last_token_count <= 300
+    assert estimate_tokens("abcd" * 10) == 10
+
+    # Appending only renders the new message; a reset history starts over
+    history.append({"role": "assistant", "content": "done"})
+    assert builder.build(history).endswith("Assistant: done")
+    assert builder.messages([system])[0] is system
+
+def test_streaming_route():
+    """Test that /chat/stream relays chunks as server-sent events"""
+    import json
+    import chatbot
+    from session_store import SessionStore
+
+    class StubBot:
+        def get_response_stream(self, user_input, use_cache=True):
+            if user_input == "fail":
+                raise RuntimeError("model unavailable")
+            yield "Hello, "
+            yield user_input
+
+    chatbot.app.config['CHAT_SESSIONS'] = SessionStore(lambda session_id: StubBot())
+    client = chatbot.app.test_client()
+    response = client.post('/chat/stream', json={'message': 'world'})
+    assert response.mimetype == 'text/event-stream'
+    events = [e for e in response.get_data(as_text=True).split("\n\n") if e]
+    deltas = [json.loads(e[len("data: "):])['delta'] for e in events if e.startswith("data: ")]
+    assert deltas == ["Hello, ", "world"]
+    assert events[-1].startswith("event: done")
+    assert client.post('/chat/stream', json={}).status_code == 400
+    # Errors before the first chunk get the same JSON error as /chat
+    failed = client.post('/chat/stream', json={'message': 'fail'})
+    assert failed.status_code == 500 and failed.get_json() == {'error': 'model unavailable'}
+    assert len(chatbot.app.config['CHAT_SESSIONS']) == 1
+
+def test_session_store():
+    """Test per-session isolation, locking, LRU eviction and the pre-session memory file"""
+    import os
+    import tempfile
+    import threading
+    from session_store import SessionStore, is_valid_session_id, new_session_id, session_memory_file
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+
+    class CountingBot:
+        def __init__(self):
+            self.conversation_history = []
+            self.saved = 0
+
+        def save_memory(self):
+            self.saved += 1
+
+    created = {}
+
+    def factory(session_id):
+        created[session_id] = CountingBot()
+        return created[session_id]
+
+    store = SessionStore(factory, max_sessions=2)
+
+    def worker(session_id):
+        for i in range(200):
+            with store.session(session_id) as bot:
+                bot.conversation_history.append(i)
+
+    threads = [threading.Thread(target=worker, args=("a",)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created["a"].conversation_history) == 800
+
+    with store.session("b"):
+        pass
+    with store.session("c"):
+        pass
+    assert "a" not in store and len(store) == 2
+    assert created["a"].saved == 1
+
+    # Evicted sessions are saved outside the table lock, and reloading one waits for its save
+    saving, finish_save, events = threading.Event(), threading.Event(), []
+
+    class SlowSaveBot(CountingBot):
+        def save_memory(self):
+            saving.set()
+            finish_save.wait(5)
+            events.append("saved")
+
+    def slow_factory(session_id):
+        events.append(f"load {session_id}")
+        return SlowSaveBot()
+
+    slow_store = SessionStore(slow_factory, max_sessions=1)
+    with slow_store.session("a"):
+        pass
+
+    def visit(session_id):
+        with slow_store.session(session_id):
+            pass
+    evicting = threading.Thread(target=visit, args=("b",))
+    evicting.start()
+    assert saving.wait(5)
+    visit("b")  # Not blocked by a's save
+    reloading = threading.Thread(target=visit, args=("a",))
+    reloading.start()
+    reloading.join(0.1)
+    assert events == ["load a", "load b"]
+    finish_save.set()
+    evicting.join()
+    reloading.join()
+    assert events[:4] == ["load a", "load b", "saved", "load a"]
+
+    assert is_valid_session_id(new_session_id())
+    assert not is_valid_session_id("../../etc/passwd")
+
+    # The pre-session conversation moves to the first new session only
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "web_chatbot_memory.json")
+        engine = ChatEngine(FakeProvider(), legacy, "sys")
+        engine.get_response("before sessions")
+        engine.memory_store.close()
+        session_dir = os.path.join(tmp, "sessions")
+        first = session_memory_file("a" * 32, session_dir, legacy_file=legacy)
+        second = session_memory_file("b" * 32, session_dir, legacy_file=legacy)
+        assert not os.path.exists(legacy) and not os.path.exists(legacy + ".journal")
+        engine = ChatEngine(FakeProvider(), first, "sys")
+        assert [m["content"] for m in engine.conversation_history[1:]] == ["before sessions", "Echo: before sessions"]
+        engine.memory_store.close()
+        assert not os.path.exists(second) and not os.path.exists(second + ".journal")
+
+def test_sqlite_memory():
+    """Test SQLite memory backend, tail loading and JSON migration"""
+    import os
+    import json
+    import tempfile
+    from memory_store import SQLiteMemoryStore, migrate_json_memory
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "memory.db")
+        store = SQLiteMemoryStore(db_path, "s1", load_limit=4)
+        history = [{"role": "system", "content": "sys"}]
+        for i in range(5):
+            history.append({"role": "user", "content": f"q{i}"})
+            history.append({"role": "assistant", "content": f"a{i}"})
+            store.save(history)
+        store.close()
+
+        # Only the tail is loaded, and new messages continue the sequence
+        reopened = SQLiteMemoryStore(db_path, "s1", load_limit=4)
+        tail = reopened.load()
+        assert tail == history[-4:]
+        tail.append({"role": "user", "content": "again"})
+        reopened.save(tail)
+        assert reopened.count() == len(history) + 1
+        assert reopened.search("q3")[0]["content"] == "q3"
+        assert reopened.history(limit=1)[0]["content"] == "again"
+        assert SQLiteMemoryStore(db_path, "s2").load() == []
+
+        # Migration imports the legacy JSON layout once
+        legacy = os.path.join(tmp, "legacy.json")
+        with open(legacy, 'w', encoding='utf-8') as f:
+            json.dump({"conversations": history}, f)
+        assert migrate_json_memory(legacy, db_path) == len(history)
+        assert migrate_json_memory(legacy, db_path) == 0
+        assert SQLiteMemoryStore(db_path, "legacy", load_limit=None).load() == history
+
+def test_search_cache():
+    """Test cached, coalesced web search against the local stub server"""
+    import threading
+    from functools import partial
+    from web_search import SearchCache, fetch_results
+    from stub_search_server import StubSearchServer
+
+    with StubSearchServer(latency=0.2) as server:
+        cache = SearchCache(ttl=60, max_entries=2)
+        fetch = partial(fetch_results, search_url=server.url)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch("Python  News", fetch)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert server.request_count == 1
+        assert len(results) == 8 and len(results[0]) == 5
+        assert results[0][0]['title'] == "Result 0 for Python  News"
+
+        assert cache.get_or_fetch("python news", fetch) is results[0]
+        stats = cache.stats()
+        assert stats['misses'] == 1 and stats['hits'] == 1 and stats['coalesced'] == 7
+
+        cache.get_or_fetch("a", fetch)
+        cache.get_or_fetch("b", fetch)
+        assert cache.get("python news") is None and cache.stats()['evictions'] == 1
+
+    # Async lookups coalesce the same way
+    import asyncio
+    calls = []
+
+    async def slow_fetch(query):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return [query]
+
+    async def run_async():
+        cache = SearchCache()
+        return await asyncio.gather(*(cache.get_or_fetch_async("Async Q", slow_fetch) for _ in range(10)))
+
+    assert asyncio.run(run_async()) == [["Async Q"]] * 10 and len(calls) == 1
+
+    # Entries expire after the TTL
+    now = [0.0]
+    cache = SearchCache(ttl=10, clock=lambda: now[0])
+    cache.put("q", ["r"])
+    assert cache.get("Q ") == ["r"]
+    now[0] = 11
+    assert cache.get("q") is None
+
+def test_search_parsing_and_timeouts():
+    """Test lxml result parsing and bounded search timeouts"""
+    import os
+    import time
+    from bs4 import BeautifulSoup
+    from web_search import parse_results, fetch_results
+    from stub_search_server import StubSearchServer
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "results_python_news.html")
+    with open(path, 'r', encoding='utf-8') as f:
+        page = f.read()
+    results = parse_results(page)
+    soup = BeautifulSoup(page, 'html.parser')
+    expected = [r.find('a', class_='result__a').get_text().strip() for r in soup.find_all('div', class_='result')[:5]]
+    assert [r['title'] for r in results] == expected
+    assert results[0]['url'].startswith("https://example.com/0")
+    assert parse_results("") == []
+
+    with StubSearchServer(latency=2) as server:
+        t0 = time.perf_counter()
+        try:
+            fetch_results("slow", search_url=server.url, timeout=(1, 0.2))
+            assert False, "expected a read timeout"
+        except Exception:
+            pass
+        assert time.perf_counter() - t0 < 1.5
+        assert server.request_count == 1
+
+def test_asgi_app():
+    """Test the asyncio serving mode with concurrent stub conversations"""
+    import json
+    import time
+    import asyncio
+    from asgi_app import ASGIChatApp
+    from session_store import SessionStore, new_session_id
+
+    class StubBot:
+        system_prompt = "sys"
+
+        def __init__(self):
+            self.conversation_history = []
+
+        async def get_response_async(self, user_input, use_cache=True):
+            await asyncio.sleep(0.1)
+            self.conversation_history.append(user_input)
+            return f"echo {user_input}"
+
+        async def get_response_stream_async(self, user_input, use_cache=True):
+            if user_input == "fail":
+                raise RuntimeError("model unavailable")
+            for word in ("a", "b"):
+                yield word
+
+    sessions = SessionStore(lambda session_id: StubBot())
+    app = ASGIChatApp(sessions)
+
+    async def call(path, message, session_id):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': json.dumps({'message': message}).encode()}
+
+        async def send(event):
+            sent.append(event)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': path,
+                 'headers': [(b'cookie', f'chat_session={session_id}'.encode())]}
+        await app(scope, receive, send)
+        return sent[0]['status'], b''.join(e.get('body', b'') for e in sent[1:])
+
+    async def run():
+        session_ids = [new_session_id() for _ in range(50)]
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(call('/chat', 'hi', s) for s in session_ids))
+        elapsed = time.perf_counter() - t0
+        stream = await call('/chat/stream', 'hi', session_ids[0])
+        missing = await call('/chat', '', session_ids[0])
+        failed = await call('/chat/stream', 'fail', session_ids[0])
+        return results, elapsed, stream, missing, failed
+
+    results, elapsed, stream, missing, failed = asyncio.run(run())
+    assert all(status == 200 and json.loads(body) == {'response': 'echo hi'} for status, body in results)
+    # 50 conversations overlap instead of running one after another
+    assert elapsed < 2
+    assert b'"delta": "a"' in stream[1] and b'event: done' in stream[1]
+    assert missing[0] == 400
+    assert failed[0] == 500 and json.loads(failed[1]) == {'error': 'model unavailable'}
+
+def test_chat_engine_with_fake_provider():
+    """Test the shared engine end to end with the offline fake provider"""
+    import os
+    import asyncio
+    import tempfile
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        for style in ('text', 'messages'):
+            provider = FakeProvider(prompt_style=style)
+            assert provider.capabilities()['streaming']
+            engine = ChatEngine(provider, memory_file, "You are a test bot.")
+            assert engine.get_response("hello there") == "Echo: hello there"
+            assert "".join(engine.get_response_stream("stream me")) == "Echo: stream me"
+            assert asyncio.run(engine.get_response_async("async hi")) == "Echo: async hi"
+            assert engine.conversation_history[-1] == {"role": "assistant", "content": "Echo: async hi"}
+            engine.clear()
+
+        # Declared capabilities: no native streaming means one plain call, and
+        # a backend's own token counts set the prompt budget
+        class PlainProvider(FakeProvider):
+            supports_streaming = False
+            counted = []
+
+            def stream(self, prompt):
+                raise AssertionError("stream() on a backend that can't stream")
+
+            def stream_async(self, prompt):
+                raise AssertionError("stream_async() on a backend that can't stream")
+
+            def count_tokens(self, prompt):
+                self.counted.append(prompt)
+                return 3000
+
+        plain = ChatEngine(PlainProvider(), os.path.join(tmp, "plain.json"), "You are a test bot.")
+        assert "".join(plain.get_response_stream("one")) == "Echo: one"
+
+        async def stream_async():
+            return [chunk async for chunk in plain.get_response_stream_async("two")]
+        assert asyncio.run(stream_async()) == ["Echo: two"]
+        assert plain.get_response("three") == "Echo: three"
+        # 3000 per message is over the 8000 budget: only the system prompt and
+        # the two newest messages, which are always kept
+        assert plain.prompt_builder.last_token_count == 9000 and "User: three" in PlainProvider.counted
+        plain.memory_store.close()
+
+        # /read is expanded before it reaches the model
+        readme = os.path.join(tmp, "notes.txt")
+        with open(readme, 'w', encoding='utf-8') as f:
+            f.write("secret notes")
+        reply = engine.get_response(f"/read {readme}")
+        assert reply.startswith("Echo: Please analyze this file content")
+
+        # A reloaded engine keeps its history and doesn't duplicate the system prompt
+        reloaded = ChatEngine(FakeProvider(), memory_file, "You are a test bot.")
+        assert reloaded.conversation_history == engine.conversation_history
+
+def test_response_cache():
+    """Test cached responses for identical prompts, bypass, TTL and the disk tier"""
+    import os
+    import tempfile
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from response_cache import ResponseCache, prompt_key
+
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "responses.db")
+        cache = ResponseCache(max_entries=1, ttl=60, db_path=db_path, clock=lambda: now[0])
+        provider = FakeProvider()
+
+        def engine(name):
+            return ChatEngine(provider, os.path.join(tmp, name), "You are a test bot.", response_cache=cache)
+
+        # Two fresh conversations asking the same thing share one model call
+        assert engine("a.json").get_response("hello") == "Echo: hello"
+        assert "".join(engine("b.json").get_response_stream("hello")) == "Echo: hello"
+        assert provider.calls == 1
+
+        # The per-request bypass always reaches the model
+        assert engine("c.json").get_response("hello", use_cache=False) == "Echo: hello"
+        assert provider.calls == 2
+
+        # Evicted from memory (max_entries=1) but still found on disk
+        engine("d.json").get_response("other")
+        assert engine("e.json").get_response("hello") == "Echo: hello"
+        assert provider.calls == 3 and cache.stats()['disk_hits'] == 1
+
+        # Model parameters are part of the key
+        assert prompt_key(provider, "x") != prompt_key(FakeProvider(prompt_style='messages'), ["x"])
+
+        # Entries expire in both tiers
+        now[0] += 61
+        engine("f.json").get_response("hello")
+        assert provider.calls == 4
+
+def test_file_reader():
+    """Test ranged, sliced and summarized /read without loading whole files"""
+    import os
+    import tempfile
+    import file_reader
+    from file_reader import parse_read_spec, read_file, read_lines, read_tail, grep_file
+
+    assert parse_read_spec("app.log:10-20") == ("app.log", {'kind': 'lines', 'start': 10, 'end': 20})
+    assert parse_read_spec("app.log:b0-99")[1]['kind'] == 'bytes'
+    # A single position, even 0, is one line or byte; only "N-" runs to the end
+    assert parse_read_spec("app.log:b0")[1] == {'kind': 'bytes', 'start': 0, 'end': 0}
+    assert parse_read_spec("app.log:0")[1] == {'kind': 'lines', 'start': 1, 'end': 1}
+    assert parse_read_spec("app.log:5-")[1]['end'] is None
+    assert parse_read_spec("app.log:grep=a:b") == ("app.log", {'kind': 'grep', 'pattern': 'a:b'})
+    assert parse_read_spec("C:\\notes.txt") == ("C:\\notes.txt", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "app.log")
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(1, 5001):
+                f.write(f"line {i} {'ERROR' if i % 1000 == 0 else 'ok'}\n")
+
+        assert read_lines(path, 10, 11) == ("line 10 ok\nline 11 ok\n", False)
+        assert read_tail(path, 2) == ("line 4999 ok\nline 5000 ERROR\n", False)
+        matches, truncated = grep_file(path, "ERROR")
+        assert matches.splitlines() == [f"{i}: line {i} ERROR" for i in range(1000, 5001, 1000)]
+
+        # Line numbers stay right when lines straddle block boundaries
+        block_size = file_reader.BLOCK_SIZE
+        file_reader.BLOCK_SIZE = 37
+        try:
+            assert grep_file(path, "ERROR") == (matches, truncated)
+            assert read_lines(path, 3000, 3000) == ("line 3000 ERROR\n", False)
+        finally:
+            file_reader.BLOCK_SIZE = block_size
+
+        assert "bytes 0-3" in read_file(f"{path}:b0-3") and read_file(f"{path}:b0-3").endswith("\nline")
+        assert read_file(f"{path}:head=1").endswith("line 1 ok\n")
+        assert read_file(f"{path}:b0").endswith(":\nl")
+        assert read_file(f"{path}:0") == f"File content ({path}, lines 1-1):\nline 1 ok\n"
+        assert read_file(f"{path}:0-2") == f"File content ({path}, lines 1-2):\nline 1 ok\nline 2 ok\n"
+        assert read_file(f"{path}:3000") == f"File content ({path}, lines 3000-3000):\nline 3000 ERROR\n"
+
+        # Too large for the budget: summarized section by section in one batch
+        batches = []
+        summary = read_file(path, summarize_batch=lambda prompts: batches.append(prompts) or ["ok"] * len(prompts),
+                            limit=10000)
+        assert summary.startswith("File summary") and len(batches) == 1 and len(batches[0]) == 7
+        assert read_file(path, limit=100).endswith("...")
+
+def test_retrieval_index():
+    """Test the BM25 file index, its incremental refresh and /ask"""
+    import os
+    import tempfile
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from retrieval_index import RetrievalIndex, ask_prompt
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "docs"))
+        files = {
+            "docs/deploy.md": "# Deploying\nRun the server behind nginx with gunicorn workers.\n",
+            "docs/memory.md": "Conversation memory is journaled to disk.\nCompaction rewrites the snapshot.\n",
+            "notes.txt": "Shopping list: eggs, milk\n",
+            "image.png": "not text",
+        }
+        for name, text in files.items():
+            with open(os.path.join(tmp, name), 'w', encoding='utf-8') as f:
+                f.write(text)
+
+        index = RetrievalIndex(root=tmp)
+        assert index.refresh() == {'updated': 3, 'removed': 0, 'unchanged': 0}
+        results = index.search("how does memory compaction work")
+        assert results[0]['path'] == os.path.join("docs", "memory.md")
+        assert results[0]['text'].startswith("Conversation memory")
+        assert index.search("nothing matches this") == []
+
+        # Only changed files are re-indexed, and the index survives a restart
+        with open(os.path.join(tmp, "notes.txt"), 'w', encoding='utf-8') as f:
+            f.write("Deploy checklist: nginx config, gunicorn restart\n")
+        os.remove(os.path.join(tmp, "docs/deploy.md"))
+        index.close()
+        index = RetrievalIndex(root=tmp)
+        assert index.refresh() == {'updated': 1, 'removed': 1, 'unchanged': 1}
+        assert [r['path'] for r in index.search("gunicorn")] == ["notes.txt"]
+
+        prompt = ask_prompt("gunicorn?", index.search("gunicorn"))
+        assert "[notes.txt:1-1]" in prompt and prompt.endswith("Question: gunicorn?")
+
+        # /ask goes through the engine like the other commands
+        engine = ChatEngine(FakeProvider(), os.path.join(tmp, "memory.json"), "You are a test bot.")
+        engine.ask_files = index.search
+        assert "Deploy checklist" in engine.expand_commands("/ask gunicorn restart")
+
+        # Conversation history is never indexed: memory files, archives, recall and session files.
+        # A user's own file that merely looks like one still is
+        engine.get_response("my secret gunicorn password")
+        for name in ("web_chatbot_memory.json", os.path.join("chat_sessions", "abc.json"),
+                     os.path.join("memory.recall", "records.jsonl"), "team_memory.json"):
+            os.makedirs(os.path.dirname(os.path.join(tmp, name)) or tmp, exist_ok=True)
+            with open(os.path.join(tmp, name), 'w', encoding='utf-8') as f:
+                f.write("my secret gunicorn password\n")
+        cwd = os.getcwd()
+        os.chdir(tmp)  # where the chatbots keep their memory files
+        try:
+            index.refresh()
+        finally:
+            os.chdir(cwd)
+        assert sorted(r['path'] for r in index.search("gunicorn")) == ["notes.txt", "team_memory.json"]
+        engine.memory_store.close()
+        index.close()
+
+        # Walks run in the background; only the first build is waited for
+        import threading
+        import retrieval_index
+        background = RetrievalIndex(root=tmp, db_path=os.path.join(tmp, "bg.db"), refresh_interval=0)
+        background.refresh()
+        started = threading.Event()
+        finish = threading.Event()
+        walk = retrieval_index.walk_files
+
+        def slow_walk(root):
+            started.set()
+            finish.wait(5)
+            return walk(root)
+        retrieval_index.walk_files = slow_walk
+        try:
+            refresher = background.maybe_refresh()
+            assert refresher is not None and started.wait(5)
+            # The next query doesn't wait for the walk in progress
+            assert background.search("gunicorn")
+            assert background.maybe_refresh() is refresher
+            finish.set()
+            refresher.join(5)
+            assert not refresher.is_alive()
+        finally:
+            finish.set()
+            retrieval_index.walk_files = walk
+        background.close()
+
+def test_history_compaction():
+    """Test background summarization of old turns with the fake provider"""
+    import os
+    import json
+    import tempfile
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from history_compactor import HistoryCompactor, SUMMARY_HEADER
+    from archive import ConversationArchive
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        provider = FakeProvider()
+        compactor = HistoryCompactor(threshold=10, keep_recent=4)
+        engine = ChatEngine(provider, memory_file, "You are a test bot.", compactor=compactor)
+        filler = " lorem ipsum" * 100
+        for i in range(5):
+            engine.get_response(f"message {i}{filler}")
+
+        # The 11-message history was queued; the summary is computed off the request path
+        compactor.join()
+        assert engine.pending_compaction is not None and len(engine.conversation_history) == 11
+        assert compactor.stats()['runs'] == 1 and compactor.stats()['bytes_saved'] > 0
+
+        # ...and swapped in when the next request starts
+        engine.get_response("message 5")
+        history = engine.conversation_history
+        assert len(history) == 7
+        assert history[0]["role"] == "system" and SUMMARY_HEADER in history[0]["content"]
+        assert engine.current_summary().startswith("Echo: ")
+        assert history[1]["content"] == f"message 3{filler}"
+        assert SUMMARY_HEADER in engine.build_prompt()
+
+        # Raw turns are archived and the compacted history is what gets reloaded
+        archived = list(ConversationArchive(memory_file))
+        assert len(archived) == 6 and archived[0] == {"role": "user", "content": f"message 0{filler}"}
+        reloaded = ChatEngine(FakeProvider(), memory_file, "You are a test bot.", compactor=compactor)
+        assert reloaded.conversation_history == history
+
+        # A summary that finishes after /clear is dropped
+        engine.get_response("more 0")
+        archived = list(ConversationArchive(memory_file))
+        engine.get_response("more 1")
+        compactor.join()
+        assert engine.pending_compaction is not None
+        engine.clear()
+        engine.get_response("fresh start")
+        assert len(engine.conversation_history) == 3
+        # ...and archives nothing: turns are archived only when a summary is applied
+        assert list(ConversationArchive(memory_file)) == archived
+
+        # The worker never loads a history itself (only the request holding the session does)
+        unloaded = ChatEngine(FakeProvider(), memory_file, "You are a test bot.", compactor=compactor)
+        assert compactor.compact(unloaded) is None and unloaded.loaded_history() is None
+        unloaded.memory_store.close()
+
+        # With SQLite memory the compacted turns stay queryable
+        from memory_store import SQLiteMemoryStore
+        sqlite_engine = ChatEngine(FakeProvider(), os.path.join(tmp, "s.json"), "You are a test bot.",
+                                   compactor=compactor, recall=False)
+        sqlite_engine.memory_store = SQLiteMemoryStore(os.path.join(tmp, "memory.db"), "s")
+        for i in range(6):
+            sqlite_engine.get_response(f"turn {i}")
+        compactor.join()
+        sqlite_engine.get_response("turn 6")
+        stored = sqlite_engine.memory_store
+        assert stored.load() == [dict(m) for m in sqlite_engine.conversation_history]
+        assert SUMMARY_HEADER in stored.load()[0]["content"]
+        originals = [m["content"] for m in reversed(stored.history(limit=100)) if m["role"] == "user"]
+        assert originals == [f"turn {i}" for i in range(7)]
+        assert [m["content"] for m in stored.search("turn 0")] == ["Echo: turn 0", "turn 0"]
+        # The rows are the archive there; nothing is written twice to an archive file
+        assert list(ConversationArchive(os.path.join(tmp, "s.json"))) == []
+        stored.close()
+
+def test_parallel_fanout():
+    """Test that multi-query /search and multi-file /read run concurrently"""
+    import os
+    import time
+    import asyncio
+    import tempfile
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from fanout import fan_out, fan_out_async
+    from web_search import split_queries
+
+    assert split_queries("python news | Python News | weather |  ") == ["python news", "weather"]
+
+    def slow(item):
+        time.sleep(item)
+        if item == 0.2:
+            raise ValueError("boom")
+        return item
+
+    t0 = time.perf_counter()
+    assert fan_out(slow, [0.1, 0.2, 1.0], timeout=0.5) == [0.1, "Error: boom", "Timed out after 0.5s"]
+    assert time.perf_counter() - t0 < 0.9
+
+    async def slow_async(item):
+        await asyncio.sleep(item)
+        return item
+    assert asyncio.run(fan_out_async(slow_async, [0.1, 1.0], timeout=0.3)) == [0.1, "Timed out after 0.3s"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = ChatEngine(FakeProvider(), os.path.join(tmp, "memory.json"), "You are a test bot.")
+
+        def fake_search(query):
+            time.sleep(0.3)
+            return [{'title': f"About {query}", 'snippet': "...", 'url': "https://example.com"}]
+        engine.web_search = fake_search
+
+        # Three 0.3s searches take about as long as one
+        t0 = time.perf_counter()
+        prompt = engine.expand_commands("/search alpha | beta | gamma")
+        assert time.perf_counter() - t0 < 0.6
+        assert prompt.index("About alpha") < prompt.index("About beta") < prompt.index("About gamma")
+        assert prompt.endswith("covering: alpha; beta; gamma")
+
+        paths = []
+        for name in ("a.md", "b.py"):
+            paths.append(os.path.join(tmp, name))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(f"contents of {name}\n")
+        prompt = engine.expand_commands(f"/read {paths[0]} {paths[1]} {paths[1]}:1-1 missing.txt")
+        assert prompt.startswith("Please analyze these files:")
+        assert "contents of a.md" in prompt and f"({paths[1]}, lines 1-1)" in prompt
+        assert "File not found: missing.txt" in prompt
+
+        # Files that fit the whole budget are previewed, not summarized, however many are read
+        import file_reader
+        medium = os.path.join(tmp, "medium.md")
+        with open(medium, 'w', encoding='utf-8') as f:
+            f.write("medium line\n" * (file_reader.READ_MAX_BYTES // 24))
+        prompts = []
+        engine.provider.generate_batch = lambda batch: prompts.extend(batch) or ["summary"] * len(batch)
+        prompt = engine.expand_commands(f"/read {medium} {paths[0]} {paths[1]}")
+        assert not prompts and "medium line" in prompt
+        large = os.path.join(tmp, "large.md")
+        with open(large, 'w', encoding='utf-8') as f:
+            f.write("large line\n" * (file_reader.READ_MAX_BYTES // 3))
+        engine.expand_commands(f"/read {large} {medium} {paths[0]}")
+        assert 0 < len(prompts) <= file_reader.READ_SUMMARY_CHUNKS // 3
+
+def test_metrics():
+    """Test per-stage metrics, the /metrics route and the trace log"""
+    import os
+    import json
+    import tempfile
+    import metrics
+    from web_app import create_app
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from session_store import SessionStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        trace_log = os.path.join(tmp, "trace.jsonl")
+        metrics.registry.reset()
+        metrics.TRACE_LOG = trace_log
+        try:
+            sessions = SessionStore(lambda session_id: ChatEngine(
+                FakeProvider(), os.path.join(tmp, f"{session_id}.json"), "You are a test bot."))
+            client = create_app(sessions).test_client()
+            assert client.post('/chat', json={'message': 'hello'}).get_json() == {'response': 'Echo: hello'}
+            client.post('/chat/stream', json={'message': 'stream please'}).get_data()
+        finally:
+            metrics.TRACE_LOG = ''
+
+        page = client.get('/metrics')
+        assert page.mimetype == 'text/plain'
+        text = page.get_data(as_text=True)
+        for stage in ('commands', 'prompt', 'model', 'save'):
+            assert f'chat_stage_seconds_count{{stage="{stage}"}} 2' in text
+        assert 'chat_requests_total{kind="chat"} 1' in text
+        assert 'chat_requests_total{kind="stream"} 1' in text
+        assert 'chat_time_to_first_chunk_seconds_count 1' in text
+        assert 'chat_search_cache_hits_total' in text
+
+        with open(trace_log, encoding='utf-8') as f:
+            traces = [json.loads(line) for line in f]
+        assert [t['kind'] for t in traces] == ['chat', 'stream']
+        assert set(traces[0]['stages']) == {'commands', 'prompt', 'recall', 'model', 'save'}
+        assert traces[0]['counters']['chat_prompt_tokens_total'] > 0 and not traces[0]['error']
+
+    # Disabled, the hooks are shared no-ops
+    enabled = metrics.METRICS_ENABLED
+    metrics.METRICS_ENABLED = False
+    try:
+        assert metrics.stage('model') is metrics.stage('save')
+        with metrics.trace('chat'), metrics.stage('model'):
+            metrics.inc('chat_prompt_bytes_total', 10)
+    finally:
+        metrics.METRICS_ENABLED = enabled
+
+def test_lazy_startup():
+    """Test that terminal mode imports no web or SDK modules and memory loads on first use"""
+    import os
+    import sys
+    import json
+    import tempfile
+    import subprocess
+    from chat_engine import ChatEngine
+    from providers import FakeProvider, GeminiProvider
+
+    heavy = ['flask', 'requests', 'lxml', 'asyncio', 'webbrowser', 'google.generativeai', 'openai']
+    code = f"import sys, chatbot; print([m for m in {heavy!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+    # Providers don't touch their SDK until the first call
+    provider = GeminiProvider("test-key")
+    assert provider._model is None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        with open(memory_file, 'w', encoding='utf-8') as f:
+            json.dump({'conversations': [{"role": "user", "content": "remembered"}]}, f)
+        engine = ChatEngine(FakeProvider(), memory_file, "You are a test bot.")
+        assert engine._history is None
+        assert [m["content"] for m in engine.conversation_history] == ["remembered", "You are a test bot."]
+        engine.memory_store.close()
+
+def test_scheduler():
+    """Test concurrency limits, short-prompt priority, rejection, rate limiting and micro-batching"""
+    import os
+    import time
+    import asyncio
+    import tempfile
+    import threading
+    from providers import FakeProvider
+    from scheduler import Scheduler, ScheduledProvider, SchedulerBusy, TokenBucket
+    from session_store import SessionStore
+    from web_app import create_app
+    from asgi_app import ASGIChatApp
+    from chat_engine import ChatEngine
+
+    def wait_queued(scheduler, n):
+        deadline = time.monotonic() + 5
+        while scheduler.stats()['queued'] < n and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    # Never more than `concurrency` calls in flight
+    class CountingProvider(FakeProvider):
+        supports_batching = False
+
+        def __init__(self):
+            super().__init__(latency=0.02)
+            self.running = self.peak = 0
+            self.lock = threading.Lock()
+
+        def generate(self, prompt):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            try:
+                return super().generate(prompt)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    counting = CountingProvider()
+    provider = ScheduledProvider(counting, Scheduler(concurrency=2))
+    threads = [threading.Thread(target=provider.generate, args=(f"User: q{i}",)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counting.calls == 8 and counting.peak == 2
+    assert provider.name == 'fake' and provider.scheduler.stats()['admitted'] == 8
+
+    # Short prompts overtake long ones; a full queue fails fast
+    scheduler = Scheduler(concurrency=1, queue_size=2, token_defer=10, batch_size=1)
+    order = []
+    held = scheduler.acquire()
+    for queued, (name, tokens) in enumerate((("long", 4000), ("short", 10)), 1):
+        def call(name=name, tokens=tokens):
+            ticket = scheduler.acquire(tokens)
+            order.append(name)
+            scheduler.release(ticket)
+        threading.Thread(target=call).start()
+        wait_queued(scheduler, queued)
+    try:
+        scheduler.acquire()
+        assert False, "queue should be full"
+    except SchedulerBusy as e:
+        assert e.retry_after >= 1
+    scheduler.release(held)
+    wait_queued(scheduler, 0)
+    deadline = time.monotonic() + 5
+    while len(order) < 2 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert order == ["short", "long"]
+    assert scheduler.stats()['rejected'] == 1
+
+    # Waiting past the queue timeout gives up
+    scheduler = Scheduler(concurrency=1, queue_timeout=0.05)
+    held = scheduler.acquire()
+    try:
+        scheduler.acquire()
+        assert False, "should time out"
+    except SchedulerBusy:
+        assert scheduler.stats()['timed_out'] == 1 and scheduler.stats()['queued'] == 0
+    scheduler.release(held)
+
+    # Token bucket: burst, then one take per 1/rate seconds
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    assert bucket.try_take() and bucket.try_take() and not bucket.try_take()
+    assert abs(bucket.wait_time() - 0.1) < 1e-9
+    now[0] += 0.1
+    assert bucket.try_take()
+
+    # Calls queued together go to a batching backend as one batch
+    fake = FakeProvider(latency=0.01)
+    scheduler = Scheduler(concurrency=1, batch_size=8)
+    provider = ScheduledProvider(fake, scheduler)
+    held = scheduler.acquire()
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, provider.generate(f"User: b{i}")))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    wait_queued(scheduler, 4)
+    scheduler.release(held)
+    for t in threads:
+        t.join()
+    assert results == {i: f"Echo: b{i}" for i in range(4)}
+    assert fake.calls == 1 and scheduler.stats()['batches'] == 1
+
+    async def many():
+        return await asyncio.gather(*(provider.generate_async(f"User: a{i}") for i in range(5)))
+    assert asyncio.run(many()) == [f"Echo: a{i}" for i in range(5)]
+    assert "".join(provider.stream("User: s")) == "Echo: s"
+
+    # An overloaded /chat answers 503 + Retry-After and forgets the turn
+    scheduler = Scheduler(concurrency=1, queue_size=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = ChatEngine(ScheduledProvider(FakeProvider(), scheduler), os.path.join(tmp, "m.json"), "sys")
+        client = create_app(SessionStore(lambda session_id: engine)).test_client()
+        assert client.post('/chat', json={'message': 'hi'}).get_json() == {'response': 'Echo: hi'}
+        before = list(engine.conversation_history)
+        held = scheduler.acquire()
+        response = client.post('/chat', json={'message': 'busy?'})
+        assert response.status_code == 503 and int(response.headers['Retry-After']) >= 1
+        assert engine.conversation_history == before
+        # /chat/stream checks admission before the 200 goes out, in both serving modes
+        response = client.post('/chat/stream', json={'message': 'busy?'})
+        assert response.status_code == 503 and int(response.headers['Retry-After']) >= 1
+        assert engine.conversation_history == before
+
+        async def asgi_stream():
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'{"message": "busy?"}'}
+
+            async def send(event):
+                sent.append(event)
+            await ASGIChatApp(SessionStore(lambda session_id: engine))(
+                {'type': 'http', 'method': 'POST', 'path': '/chat/stream', 'headers': []}, receive, send)
+            return sent[0]
+        start = asyncio.run(asgi_stream())
+        assert start['status'] == 503 and int(dict(start['headers'])[b'retry-after']) >= 1
+        assert engine.conversation_history == before
+        scheduler.release(held)
+        response = client.post('/chat/stream', json={'message': 'free'})
+        assert response.status_code == 200 and '"free"' in response.get_data(as_text=True)
+        engine.memory_store.close()
+
+def test_compact_messages():
+    """Test Message records, the shared system prompt and compression of cold bodies"""
+    import os
+    import json
+    import tempfile
+    from messages import Message, compress_cold
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from history_compactor import HistoryCompactor
+
+    message = Message("assistant", "x" * 2000)
+    assert message == {"role": "assistant", "content": "x" * 2000} and dict(message) == message
+    assert message["role"] == message.get("role") == "assistant" and message.get("missing", 1) == 1
+    assert message.role is Message("".join(["assis", "tant"]), "").role
+    assert message.compress() and message.compressed and message["content"] == "x" * 2000
+    assert not Message("system", "y" * 2000).compress() and not Message("user", "short").compress()
+
+    history = [Message("user", f"{i} " + "words " * 200) for i in range(10)]
+    assert compress_cold(history, hot=4) == 6
+    assert [m.compressed for m in history] == [True] * 6 + [False] * 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        prompt = "You are a test bot."
+        engine = ChatEngine(FakeProvider(), memory_file, prompt, compactor=HistoryCompactor(threshold=0))
+        for i in range(40):
+            engine.get_response(f"question {i} " + "detail " * 100)
+        assert any(m.compressed for m in engine.conversation_history[:-64])
+        assert not any(m.compressed for m in engine.conversation_history[-64:])
+        # Compressed or not, prompts and saved files see plain text
+        assert "question 39" in engine.build_prompt()
+        engine.memory_store.compact(engine.conversation_history)
+        with open(memory_file, encoding='utf-8') as f:
+            saved = json.load(f)['conversations']
+        assert saved[1] == {"role": "user", "content": "question 0 " + "detail " * 100}
+
+        reloaded = ChatEngine(FakeProvider(), memory_file, "".join(["You are ", "a test bot."]))
+        assert reloaded.conversation_history[0]["content"] is reloaded.system_prompt
+        assert reloaded.conversation_history == engine.conversation_history
+        engine.memory_store.close()
+        reloaded.memory_store.close()
+
+def test_jobs():
+    """Test background chat jobs: polling, resumable streams, cancellation and abandonment"""
+    import os
+    import json
+    import time
+    import asyncio
+    import threading
+    import tempfile
+    from providers import FakeProvider
+    from scheduler import Scheduler, ScheduledProvider
+    from session_store import SessionStore, new_session_id
+    from web_app import create_app
+    from asgi_app import ASGIChatApp
+    from chat_engine import ChatEngine
+    from jobs import JobManager
+
+    class EndlessProvider(FakeProvider):
+        """Streams until it is closed, counting the chunks it produced"""
+
+        def __init__(self):
+            super().__init__()
+            self.produced = 0
+
+        def stream(self, prompt):
+            while True:
+                time.sleep(0.005)
+                self.produced += 1
+                yield "word "
+
+        async def stream_async(self, prompt):
+            while True:
+                await asyncio.sleep(0.005)
+                self.produced += 1
+                yield "word "
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert condition()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A job answers at once; its result can be polled, streamed and resumed
+        engine = ChatEngine(FakeProvider(), os.path.join(tmp, "a.json"), "sys")
+        jobs = JobManager(workers=2)
+        client = create_app(SessionStore(lambda session_id: engine), jobs).test_client()
+        response = client.post('/chat', json={'message': 'hello there', 'job': True})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        wait_for(lambda: client.get(f'/jobs/{job_id}/result').status_code == 200)
+        assert client.get(f'/jobs/{job_id}/result').get_json()['response'] == "Echo: hello there"
+        assert client.get(f'/jobs/{job_id}').get_json()['status'] == 'done'
+        events = client.get(f'/jobs/{job_id}/stream').get_data(as_text=True)
+        assert 'id: 0\n' in events and 'id: 2\n' in events and 'event: done' in events
+        resumed = client.get(f'/jobs/{job_id}/stream', headers={'Last-Event-ID': '1'}).get_data(as_text=True)
+        assert 'id: 1\n' not in resumed and '"delta": "there"' in resumed
+        assert engine.conversation_history[-1]["content"] == "Echo: hello there"
+        # Other sessions can't see the job
+        assert create_app(SessionStore(lambda session_id: engine), jobs).test_client() \
+            .get(f'/jobs/{job_id}').status_code == 404
+        engine.memory_store.close()
+
+        # Cancelling stops the provider stream, frees its slot and forgets the turn
+        provider = EndlessProvider()
+        scheduler = Scheduler(concurrency=1)
+        engine = ChatEngine(ScheduledProvider(provider, scheduler), os.path.join(tmp, "b.json"), "sys")
+        before = list(engine.conversation_history)
+        client = create_app(SessionStore(lambda session_id: engine), jobs).test_client()
+        job_id = client.post('/chat', json={'message': 'go on', 'job': True}).get_json()['job_id']
+        wait_for(lambda: client.get(f'/jobs/{job_id}').get_json()['chunks'] >= 3)
+        assert client.post(f'/jobs/{job_id}/cancel').status_code == 200
+        wait_for(lambda: client.get(f'/jobs/{job_id}').get_json()['status'] == 'cancelled')
+        produced = provider.produced
+        time.sleep(0.05)
+        assert provider.produced == produced
+        assert scheduler.stats()['active'] == 0
+        assert engine.conversation_history == before
+        result = client.get(f'/jobs/{job_id}/result')
+        assert result.status_code == 409 and result.get_json()['response'].startswith("word ")
+
+        # A job nobody asks about is abandoned
+        idle_jobs = JobManager(workers=1, idle_timeout=0.05)
+        client = create_app(SessionStore(lambda session_id: engine), idle_jobs).test_client()
+        job_id = client.post('/chat', json={'message': 'anyone?', 'job': True}).get_json()['job_id']
+        wait_for(lambda: idle_jobs.stats()['abandoned'] == 1)
+        assert scheduler.stats()['active'] == 0 and engine.conversation_history == before
+
+        # The asyncio server runs jobs as tasks and cancels them mid-call;
+        # the shared job table is only used off the event loop
+        async_jobs = JobManager(db_path=os.path.join(tmp, "jobs.db"))
+        table_threads = set()
+        for name in ('_write', 'control', 'read', 'session_of'):
+            method = getattr(async_jobs.table, name)
+            setattr(async_jobs.table, name, lambda *args, method=method: (
+                table_threads.add(threading.current_thread()), method(*args))[1])
+        app = ASGIChatApp(SessionStore(lambda session_id: engine), async_jobs)
+        cookie = f'chat_session={new_session_id()}'.encode()
+
+        async def call(method, path, body=None):
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': json.dumps(body or {}).encode()}
+
+            async def send(event):
+                sent.append(event)
+
+            scope = {'type': 'http', 'method': method, 'path': path,
+                     'headers': [(b'cookie', cookie)]}
+            await app(scope, receive, send)
+            return sent[0]['status'], json.loads(b''.join(e.get('body', b'') for e in sent[1:]))
+
+        async def run():
+            status, body = await call('POST', '/chat', {'message': 'go on', 'job': True})
+            assert status == 202
+            job_id = body['job_id']
+            while (await call('GET', f'/jobs/{job_id}'))[1]['chunks'] < 3:
+                await asyncio.sleep(0.005)
+            await call('POST', f'/jobs/{job_id}/cancel')
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                status, body = await call('GET', f'/jobs/{job_id}/result')
+                if status != 202:
+                    break
+            return status, (await call('GET', '/jobs/unknown'))[0]
+
+        status, missing = asyncio.run(run())
+        assert status == 409 and missing == 404
+        assert table_threads and threading.main_thread() not in table_threads
+        async_jobs.table.close()
+        assert scheduler.stats()['active'] == 0 and engine.conversation_history == before
+        engine.memory_store.close()
+
+def test_shared_state():
+    """Test what lets several worker processes serve the same sessions and jobs"""
+    import os
+    import time
+    import tempfile
+    import threading
+    from providers import FakeProvider
+    from chat_engine import ChatEngine
+    from memory_store import SQLiteMemoryStore
+    from session_store import SessionStore, new_session_id
+    from jobs import JobManager, RemoteJob
+    from serving import worker_environment, server_command
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "memory.db")
+
+        def factory(session_id):
+            engine = ChatEngine(FakeProvider(), os.path.join(tmp, f"{session_id}.json"), "sys")
+            engine.memory_store = SQLiteMemoryStore(db_path, session_id)
+            return engine
+
+        # Two stores stand in for two workers; each sees the other's turns
+        worker_a = SessionStore(factory, shared=True, lock_dir=tmp)
+        worker_b = SessionStore(factory, shared=True, lock_dir=tmp)
+        session_id = new_session_id()
+        for store, message in ((worker_a, "one"), (worker_b, "two"), (worker_a, "three")):
+            with store.session(session_id) as bot:
+                bot.get_response(message)
+        with worker_b.session(session_id) as bot:
+            assert [m["content"] for m in bot.conversation_history if m["role"] == "user"] == ["one", "two", "three"]
+        store = SQLiteMemoryStore(db_path, session_id, load_limit=None)
+        assert len(store.load()) == 7
+        store.close()
+
+        # The session lock is held across stores (processes)
+        entered = threading.Event()
+
+        def other_worker():
+            with worker_b.session(session_id):
+                entered.set()
+
+        with worker_a.session(session_id):
+            thread = threading.Thread(target=other_worker)
+            thread.start()
+            assert not entered.wait(0.1)
+        assert entered.wait(5)
+        thread.join()
+
+        # A job started by one worker is streamed and cancelled through another
+        jobs_a = JobManager(db_path=os.path.join(tmp, "jobs.db"))
+        jobs_b = JobManager(db_path=os.path.join(tmp, "jobs.db"))
+
+        def endless():
+            while True:
+                time.sleep(0.005)
+                yield "word "
+
+        job = jobs_a.submit(session_id, endless())
+        remote = jobs_b.get(job.id, session_id)
+        assert isinstance(remote, RemoteJob)
+        chunks, done = remote.wait(0, 5)
+        assert chunks and chunks[0] == "word " and not done
+        assert jobs_b.get(job.id, new_session_id()) is None
+        jobs_b.cancel(job.id, session_id)
+        deadline = time.monotonic() + 5
+        while not job.done and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert job.status == 'cancelled'
+        assert jobs_b.get(job.id, session_id).status == 'cancelled'
+        jobs_a.table.close()
+        jobs_b.table.close()
+        for store in (worker_a, worker_b):
+            with store.session(session_id) as bot:
+                bot.memory_store.close()
+
+    # Workers share the scheduler limits and default to shared state
+    env = worker_environment(4, {'SCHED_CONCURRENCY': '8', 'SCHED_RATE': '10'})
+    assert env['SCHED_CONCURRENCY'] == '2' and env['SCHED_RATE'] == '2.5'
+    assert env['MEMORY_BACKEND'] == 'sqlite' and env['JOB_DB'] and env['CHAT_SHARED_SESSIONS'] == '1'
+    assert worker_environment(4, env) == env
+    # The response cache stays opt-in
+    assert 'RESPONSE_CACHE' not in env
+    command, env = server_command('chatbot', workers=3)
+    assert command[-1] == 'chatbot:create_wsgi_app()' and '3' in command
+    assert 'SERVE_WORKER_SHARE' not in env
+
+    # gunicorn splits the limits by the worker count it actually runs, -w included
+    import runpy
+    from types import SimpleNamespace
+    saved = dict(os.environ)
+    try:
+        os.environ.pop('SERVE_WORKER_SHARE', None)
+        os.environ['SCHED_CONCURRENCY'] = '8'
+        config = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+        config['on_starting'](SimpleNamespace(cfg=SimpleNamespace(workers=8)))
+        assert os.environ['SCHED_CONCURRENCY'] == '1' and os.environ['SERVE_WORKER_SHARE'] == '8'
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+def test_recall():
+    """Test the vector index and recall of turns that left the prompt window"""
+    import os
+    import tempfile
+    import numpy as np
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from prompt_builder import PromptBuilder
+    from history_compactor import HistoryCompactor
+    from recall import HashEmbedder, VectorIndex, ConversationRecall, RECALL_HEADER
+
+    embed = HashEmbedder(dim=64)
+    vectors = embed(["the cat sat", "the cat sat", ""])
+    assert vectors.dtype == np.float32 and vectors.shape == (3, 64)
+    assert np.array_equal(vectors[0], vectors[1]) and not vectors[2].any()
+    assert abs(float(vectors[0] @ vectors[0]) - 1) < 1e-5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Top-k over the mapped rows matches a brute-force ranking, across appends and reopening
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((500, 64)).astype(np.float32)
+        index = VectorIndex(os.path.join(tmp, "index"), 64)
+        index.add(data[:300], list(range(300)), [{'row': i} for i in range(300)])
+        assert len(index.search(data[0], 5)) == 5
+        index.add(data[300:], list(range(300, 500)), [{'row': i} for i in range(300, 500)])
+        query = rng.standard_normal(64).astype(np.float32)
+        expected = list(np.argsort(data @ query)[::-1][:5])
+        reopened = VectorIndex(os.path.join(tmp, "index"), 64)
+        assert len(reopened) == 500
+        assert [r['row'] for _, r in reopened.search(query, 5)] == expected
+        assert expected[0] not in [r['row'] for _, r in reopened.search(query, 5, exclude_keys={int(expected[0])})]
+        # A write cut short is dropped before the next append, so later rows still line up
+        with open(os.path.join(tmp, "index", "vectors.f32"), 'ab') as f:
+            f.write(b"\0" * 100)
+        with open(os.path.join(tmp, "index", "records.jsonl"), 'ab') as f:
+            f.write(b'{"row": 50')
+        reopened.add(data[:1], [500], [{'row': 500}])
+        assert len(reopened) == 501
+        assert {r['row'] for _, r in reopened.search(data[0], 2)} == {0, 500}
+        # Another embedder's index is not reused
+        assert VectorIndex(os.path.join(tmp, "index"), 32).search(query[:32], 5) == []
+
+        # A turn that left the small prompt window comes back when it is relevant
+        memory_file = os.path.join(tmp, "memory.json")
+        engine = ChatEngine(FakeProvider(), memory_file, "You are a test bot.",
+                            compactor=HistoryCompactor(threshold=0),
+                            recall=ConversationRecall(os.path.join(tmp, "memory.recall"), embedder=embed))
+        engine.prompt_builder = PromptBuilder(token_budget=120)
+        engine.get_response("My cat is named Whiskers and she likes tuna")
+        for topic in ["weather in Paris", "python generators", "train timetables", "chess openings"]:
+            engine.get_response(f"Tell me about {topic} please")
+        assert len(engine.recall.index) == 5
+        engine.add_message("user", "What does my cat Whiskers like to eat?")
+        prompt = engine.build_prompt()
+        assert RECALL_HEADER in prompt and "tuna" in prompt
+        assert prompt.index(RECALL_HEADER) < prompt.index("What does my cat")
+        # Turns still in the window are not repeated
+        assert prompt.count("User: Tell me about chess openings") == 1
+
+        # A conversation saved before recall existed is indexed on first use
+        backfilled = ConversationRecall(os.path.join(tmp, "old.recall"), embedder=embed)
+        backfilled.sync(engine.conversation_history[:-1])
+        assert len(backfilled.index) == 5
+        assert backfilled.recall("Whiskers cat tuna")[-1]['user'].startswith("My cat")
+
+        engine.conversation_history.pop()
+        engine.clear()
+        assert len(engine.recall.index) == 0
+
+        # The async paths recall and index off the event loop
+        import asyncio
+        import threading
+        threads = set()
+        recall_embed = engine.recall.embedder
+        engine.recall._embedder = lambda texts: threads.add(threading.current_thread()) or recall_embed(texts)
+        engine.recall._embedder.name = recall_embed.name
+
+        async def chat():
+            await engine.get_response_async("Tell me about cats")
+            return [chunk async for chunk in engine.get_response_stream_async("And dogs?")]
+        asyncio.run(chat())
+        assert threads and threading.main_thread() not in threads
+        engine.memory_store.close()
+
+def test_commands():
+    """Test the command registry: dispatch, result caching, timeouts and concurrency limits"""
+    import os
+    import time
+    import asyncio
+    import tempfile
+    import threading
+    from chat_engine import ChatEngine
+    from providers import FakeProvider
+    from commands import COMMANDS, CommandRegistry, files_version
+
+    registry = CommandRegistry()
+    calls = []
+
+    @registry.command('/echo', help="/echo <text> - Echo")
+    def echo(engine, args):
+        calls.append(args)
+        return f"Echo {args}"
+
+    @registry.command('/slow', args='none', timeout=0.1, concurrency=1)
+    def slow(engine, args):
+        time.sleep(0.3)
+        return "done"
+
+    async def tick_async(engine, args):
+        await asyncio.sleep(0.3)
+        return "tock"
+
+    registry.command('/tick', args='none', timeout=0.1, async_handler=tick_async)(lambda engine, args: "tock")
+
+    assert registry.expand(None, "/ECHO hi") == "Echo hi" and calls == ["hi"]
+    assert registry.expand(None, "/echo") == "/echo" and registry.expand(None, "/slow now") == "/slow now"
+    assert registry.expand(None, "hello /echo") == "hello /echo"
+    assert registry.help_lines() == ["/echo <text> - Echo"]
+    assert registry.expand(None, "/slow") == "Error: /slow timed out after 0.1s"
+    # The timed-out run still holds the only slot until it finishes
+    assert registry.expand(None, "/slow") == "Error: /slow is busy, please try again"
+    time.sleep(0.3)
+    assert asyncio.run(registry.expand_async(None, "/tick")) == "Error: /tick timed out after 0.1s"
+    assert registry.stats()['timeouts'] == 2 and registry.stats()['busy'] == 1
+
+    # A slow command holding all of its slots leaves threads for the others
+    release = threading.Event()
+    registry.command('/hang', args='none', timeout=0.02, concurrency=16)(lambda engine, args: release.wait())
+    registry.command('/quick', args='none', timeout=1)(lambda engine, args: "quick")
+    try:
+        for _ in range(16):
+            assert registry.expand(None, "/hang") == "Error: /hang timed out after 0.02s"
+        assert registry.expand(None, "/quick") == "quick"
+    finally:
+        release.set()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = ChatEngine(FakeProvider(), os.path.join(tmp, "memory.json"), "You are a test bot.")
+        listings = []
+        list_files = engine.list_files
+        engine.list_files = lambda: listings.append(1) or list_files()
+        with open(os.path.join(tmp, "a.txt"), 'w', encoding='utf-8') as f:
+            f.write("a")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            COMMANDS.clear_cache()
+            # Just changed: listed every time, since a change in the same clock tick would be missed
+            assert "a.txt" in engine.expand_commands("/files")
+            assert "a.txt" in engine.expand_commands("/files") and len(listings) == 2
+
+            # Settled: listed once, then answered from the cache until the directory changes
+            past = time.time() - 60
+            os.utime(tmp, (past, past))
+            hits = COMMANDS.stats()['cache_hits']
+            first = engine.expand_commands("/files")
+            assert all(engine.expand_commands("/files") == first for _ in range(100))
+            assert len(listings) == 3 and COMMANDS.stats()['cache_hits'] == hits + 100
+
+            with open(os.path.join(tmp, "b.txt"), 'w', encoding='utf-8') as f:
+                f.write("b")
+            assert "b.txt" in engine.expand_commands("/files") and len(listings) == 4
+        finally:
+            os.chdir(cwd)
+
+        path = os.path.join(tmp, "a.txt")
+        os.utime(path, (past, past))
+        assert files_version([path]) and files_version([path, "missing.txt"]) is None
+        assert engine.expand_commands(f"/read {path}") is engine.expand_commands(f"/read {path}")
+
+def test_archive():
+    """Test rotating compressed archives, live-file retention and streaming export/import"""
+    import os
+    import json
+    import time
+    import tempfile
+    from memory_store import JournalMemoryStore
+    from archive import ConversationArchive, export_conversation, import_conversation, iter_jsonl
+
+    def msg(i):
+        return {"role": "user" if i % 2 else "assistant", "content": f"message {i} " + "words " * 20}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Segments rotate by size and by period, and expire after the retention period
+        now = [time.mktime((2026, 1, 31, 12, 0, 0, 0, 0, -1))]
+        archive = ConversationArchive(os.path.join(tmp, "a.json"), segment_bytes=300,
+                                      partition='day', clock=lambda: now[0])
+        archive.append(msg(i) for i in range(20))
+        now[0] += 86400
+        archive.append([msg(20)])
+        names = [os.path.basename(p) for p in archive.segments()]
+        assert len(names) > 2 and names[0] == "2026-01-31.0000.jsonl.gz" and names[-1] == "2026-02-01.0000.jsonl.gz"
+        assert list(archive) == [msg(i) for i in range(21)]
+        archive.retention_days = 1
+        old = now[0] - 3 * 86400
+        for path in archive.segments()[:-1]:
+            os.utime(path, (old, old))
+        assert archive.expire() == len(names) - 1 and list(archive) == [msg(20)]
+
+        # The live file keeps the newest messages; older ones move to the archive as it folds
+        memory_file = os.path.join(tmp, "memory.json")
+        store = JournalMemoryStore(memory_file, min_compact_entries=5, live_messages=10)
+        messages = [{"role": "system", "content": "sys"}]
+        for i in range(40):
+            messages.append(msg(i))
+            store.save(messages)
+        live = JournalMemoryStore(memory_file, live_messages=10).load()
+        assert live[0] == messages[0] and live[-1] == messages[-1] and len(live) < 25
+        archived = list(ConversationArchive(memory_file))
+        assert archived + live[1:] == messages[1:]
+
+        # Export streams archive + live history; import appends and keeps the live file small
+        exported = os.path.join(tmp, "export.jsonl.gz")
+        # What an interrupted export left behind is not carried into the next one
+        with open(exported + '.tmp', 'wb') as f:
+            f.write(b"leftover")
+        assert export_conversation(memory_file, exported) == len(messages)
+        assert list(iter_jsonl(exported)) == archived + live
+        target = os.path.join(tmp, "imported.json")
+        JournalMemoryStore(target).save([{"role": "system", "content": "sys"}])
+        assert import_conversation(exported, target, live_messages=8) == len(messages)
+        imported = JournalMemoryStore(target).load()
+        assert imported[0] == {"role": "system", "content": "sys"} and imported[1:] == messages[-8:]
+        assert list(ConversationArchive(target)) + imported[1:] == archived + live
+
+        # With everything kept live, an import goes to the journal a batch at a time
+        import tracemalloc
+        big = os.path.join(tmp, "big.jsonl")
+        with open(big, 'w', encoding='utf-8') as f:
+            for i in range(20000):
+                f.write(json.dumps({"role": "user", "content": f"{i} " + "x" * 1000}) + "\n")
+        everything = os.path.join(tmp, "everything.json")
+        tracemalloc.start()
+        try:
+            assert import_conversation(big, everything, live_messages=0) == 20000
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # 20MB of messages, held a batch at a time
+        assert peak < 10_000_000
+        loaded = JournalMemoryStore(everything, live_messages=0).load()
+        assert len(loaded) == 20000 and loaded[-1]["content"].startswith("19999 ")
+        assert list(ConversationArchive(everything)) == []
+
+        # Export and import go through the configured backend
+        import memory_store
+        backend, db = memory_store.MEMORY_BACKEND, memory_store.MEMORY_DB
+        memory_store.MEMORY_BACKEND, memory_store.MEMORY_DB = 'sqlite', os.path.join(tmp, "memory.db")
+        try:
+            sqlite_file = os.path.join(tmp, "s.json")
+            assert import_conversation(exported, sqlite_file) == len(messages)
+            assert import_conversation(exported, sqlite_file) == len(messages)
+            assert not os.path.exists(sqlite_file) and list(ConversationArchive(sqlite_file)) == []
+            stored = memory_store.open_memory_store(sqlite_file)
+            stored.replace(stored.load()[-3:])  # part of it archived, as compaction does
+            stored.close()
+            again = os.path.join(tmp, "s.jsonl")
+            assert export_conversation(sqlite_file, again) == 2 * len(messages)
+            assert list(iter_jsonl(again)) == 2 * (archived + live)
+        finally:
+            memory_store.MEMORY_BACKEND, memory_store.MEMORY_DB = backend, db
+
+def test_search_prefetch():
+    """Test speculative searches: hit/waste accounting and cancelling superseded prefetches"""
+    import threading
+    from web_search import SearchCache
+    from prefetch import SearchPrefetcher, prefetch_queries
+    from web_app import create_app
+    from session_store import SessionStore
+
+    assert prefetch_queries("/search python news | rust ") == ["python news", "rust"]
+    assert prefetch_queries("/search py | rust news") == ["rust news"]
+    assert prefetch_queries("hello there") == [] and prefetch_queries("/sear") == []
+
+    fetched = []
+
+    def fetch(query):
+        fetched.append(query)
+        return [query]
+
+    # A prefetched entry that a search then uses is a hit; the search doesn't fetch again
+    now = [0.0]
+    cache = SearchCache(ttl=10, clock=lambda: now[0])
+    prefetcher = SearchPrefetcher(cache, fetch, workers=1)
+    assert prefetcher.prefetch("alice", "/search Python News")['started'] == 1
+    prefetcher.close()
+    assert cache.get_or_fetch("python  news", fetch) == ["Python News"] and fetched == ["Python News"]
+    # One expires unused and counts as waste
+    prefetcher.prefetch("alice", "/search never sent")
+    prefetcher.close()
+    now[0] = 20
+    stats = prefetcher.stats()
+    assert stats['hits'] == 1 and stats['wasted'] == 1 and stats['hit_rate'] == 0.5
+    # Already cached: nothing to fetch
+    cache.put("cached", ["r"])
+    prefetcher.prefetch("bob", "/search cached")
+    prefetcher.close()
+    assert prefetcher.stats()['already_cached'] == 1 and "cached" not in fetched
+
+    # Queued prefetches of text the client has typed past are cancelled
+    release = threading.Event()
+
+    def slow_fetch(query):
+        release.wait(5)
+        fetched.append(query)
+        return [query]
+
+    fetched.clear()
+    prefetcher = SearchPrefetcher(SearchCache(), slow_fetch, workers=1)
+    prefetcher.prefetch("carol", "/search first")
+    prefetcher.prefetch("carol", "/search first | second")
+    prefetcher.prefetch("carol", "/search first | third")
+    release.set()
+    prefetcher.close()
+    assert fetched == ["first", "third"] and prefetcher.stats()['cancelled'] == 1
+    # Clients are forgotten once their prefetches are over
+    assert prefetcher._clients == {} and prefetcher.stats()['pending'] == 0
+
+    # A search already running on an event loop is not fetched a second time
+    import asyncio
+
+    async def search_while_prefetching():
+        async def slow_async_fetch(query):
+            await asyncio.sleep(0.1)
+            return [query]
+        search = asyncio.ensure_future(cache.get_or_fetch_async("async query", slow_async_fetch))
+        await asyncio.sleep(0.01)
+        started = await asyncio.to_thread(cache.prefetch, "Async  Query", fetch)
+        return started, await search
+    fetched.clear()
+    assert asyncio.run(search_while_prefetching()) == (False, ["async query"]) and fetched == []
+
+    # The web endpoint starts a prefetch, or is a 404 when prefetching is off
+    prefetcher = SearchPrefetcher(SearchCache(), fetch, workers=1)
+    client = create_app(SessionStore(lambda session_id: None), prefetcher=prefetcher).test_client()
+    response = client.post('/search/prefetch', json={'text': '/search flask routing'})
+    assert response.status_code == 202 and response.get_json() == {'queries': ['flask routing'], 'started': 1}
+    prefetcher.close()
+    assert prefetcher.stats()['fetched'] == 1
+
 def main():
     print("🧪 Testing Enhanced Chatbot Features")
     print("=" * 50)
     
     test_imports()
     test_file_operations()
+    test_memory_journal()
+    print("\n✅ Memory journal replay works")
+    test_prompt_builder()
+    print("✅ Prompt builder keeps history within budget")
+    test_sqlite_memory()
+    print("✅ SQLite memory store and migration work")
     
     print("\n🚀 To install missing packages, run:")
     print("pip install -r requirements.txt")
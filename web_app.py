@@ -0,0 +1,187 @@
+"""
+Flask web interface shared by the chatbots
+"""
+import sys
+import time
+import itertools
+import threading
+from flask import Flask, Response, render_template, request, jsonify, current_app
+
+import metrics
+
+from sse import sse_response, job_sse_response
+from jobs import get_jobs, result_response, JOB_KEEPALIVE
+from prefetch import get_prefetcher
+from scheduler import SchedulerBusy
+from session_store import SESSION_COOKIE, new_session_id, is_valid_session_id
+
+
+def current_session_id():
+    """Return the caller's session id, issuing a new one if needed"""
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not is_valid_session_id(session_id):
+        session_id = new_session_id()
+    return session_id
+
+
+def with_session_cookie(response, session_id):
+    """Attach the session cookie to a response"""
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+
+def stream_turn(sessions, session_id, user_message, use_cache):
+    """Generate one streamed response, holding the session lock until it ends or is closed"""
+    with sessions.session(session_id) as bot:
+        yield from bot.get_response_stream(user_message, use_cache=use_cache)
+
+
+def create_app(sessions=None, jobs=None, prefetcher=None):
+    """Create the Flask app serving conversations from a SessionStore.
+
+    ``sessions`` can also be set later through ``app.config['CHAT_SESSIONS']``;
+    background jobs and search prefetching default to the process-wide
+    ``JobManager`` and ``SearchPrefetcher``.
+    """
+    app = Flask(__name__)
+    app.config['CHAT_SESSIONS'] = sessions
+    app.config['CHAT_JOBS'] = jobs
+    app.config['SEARCH_PREFETCHER'] = prefetcher
+
+    def job_manager():
+        return current_app.config['CHAT_JOBS'] or get_jobs()
+
+    def find_job(job_id):
+        return job_manager().get(job_id, request.cookies.get(SESSION_COOKIE))
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    @app.route('/chat', methods=['POST'])
+    def chat():
+        try:
+            data = request.json
+            user_message = data.get('message', '')
+            if not user_message:
+                return jsonify({'error': 'No message provided'}), 400
+
+            session_id = current_session_id()
+            if data.get('job'):
+                # Answer now; the response is generated in the background
+                chunks = stream_turn(current_app.config['CHAT_SESSIONS'], session_id,
+                                     user_message, not data.get('no_cache'))
+                job = job_manager().submit(session_id, chunks)
+                return with_session_cookie(jsonify({'job_id': job.id, 'status': job.status}), session_id), 202
+
+            with current_app.config['CHAT_SESSIONS'].session(session_id) as bot:
+                response = bot.get_response(user_message, use_cache=not data.get('no_cache'))
+            return with_session_cookie(jsonify({'response': response}), session_id)
+
+        except SchedulerBusy as e:
+            # Overloaded: tell the client when to retry instead of failing
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/chat/stream', methods=['POST'])
+    def chat_stream():
+        data = request.json or {}
+        user_message = data.get('message', '')
+        if not user_message:
+            return jsonify({'error': 'No message provided'}), 400
+
+        session_id = current_session_id()
+        chunks = stream_turn(current_app.config['CHAT_SESSIONS'], session_id,
+                             user_message, not data.get('no_cache'))
+        # Wait for the model's first chunk before the 200 goes out, so an
+        # overloaded server can still answer 503 like /chat does
+        try:
+            first = [next(chunks)]
+        except StopIteration:
+            first = []
+        except SchedulerBusy as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        return with_session_cookie(sse_response(itertools.chain(first, chunks)), session_id)
+
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        job = find_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job.info(request.args.get('since', 0, type=int)))
+
+    @app.route('/jobs/<job_id>/stream')
+    def job_stream(job_id):
+        job = find_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        # Resume after the last chunk the client saw
+        last_id = request.headers.get('Last-Event-ID', type=int)
+        start = last_id + 1 if last_id is not None else request.args.get('from', 0, type=int)
+        return job_sse_response(job, start, JOB_KEEPALIVE)
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def job_cancel(job_id):
+        job = job_manager().cancel(job_id, request.cookies.get(SESSION_COOKIE))
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'job_id': job.id, 'status': job.status})
+
+    @app.route('/jobs/<job_id>/result')
+    def job_result(job_id):
+        job = find_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        body, status = result_response(job)
+        return jsonify(body), status
+
+    @app.route('/search/prefetch', methods=['POST'])
+    def search_prefetch():
+        prefetcher = current_app.config['SEARCH_PREFETCHER'] or get_prefetcher()
+        if prefetcher is None:
+            return jsonify({'error': 'Search prefetch is off'}), 404
+        data = request.json or {}
+        client = request.cookies.get(SESSION_COOKIE) or request.remote_addr
+        return jsonify(prefetcher.prefetch(client, data.get('text', ''))), 202
+
+    @app.route('/clear', methods=['POST'])
+    def clear_chat():
+        try:
+            session_id = current_session_id()
+            with current_app.config['CHAT_SESSIONS'].session(session_id) as bot:
+                bot.clear()
+            return with_session_cookie(jsonify({'success': True}), session_id)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/metrics')
+    def metrics_route():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+def open_browser():
+    """Open browser after a short delay"""
+    import webbrowser
+
+    time.sleep(1.5)
+    webbrowser.open('http://localhost:5000')
+
+
+def serve(app):
+    """Open the browser and run the Flask app, or the asyncio server with --async"""
+    # Open browser in a separate thread
+    browser_thread = threading.Thread(target=open_browser)
+    browser_thread.daemon = True
+    browser_thread.start()
+
+    if '--async' in sys.argv[1:]:
+        from asgi_app import ASGIChatApp, run as run_asgi
+        run_asgi(ASGIChatApp(app.config['CHAT_SESSIONS']))
+    else:
+        app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,420 @@
+"""
+DuckDuckGo web search with a shared TTL/LRU result cache
+"""
+import os
+import time
+import threading
+import weakref
+from collections import OrderedDict
+
+import metrics
+
+# Using DuckDuckGo search (no API key required); override to point at a stub server
+SEARCH_URL = os.getenv('SEARCH_URL', 'https://html.duckduckgo.com/html/')
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+# (connect, read) timeouts in seconds so a hung search can't pin a worker
+SEARCH_TIMEOUT = (float(os.getenv('SEARCH_CONNECT_TIMEOUT', '3.05')),
+                  float(os.getenv('SEARCH_READ_TIMEOUT', '10')))
+SEARCH_RETRIES = int(os.getenv('SEARCH_RETRIES', '2'))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+def normalize_query(query):
+    """Cache key for a query: case- and whitespace-insensitive"""
+    return " ".join(query.lower().split())
+
+
+def _has_class(name):
+    """XPath predicate matching one class token, like BeautifulSoup's class_="""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_RESULT_XPATH = f"(//div[{_has_class('result')}])[position() <= 5]"  # Top 5 results
+_TITLE_XPATH = f".//a[{_has_class('result__a')}]"
+_SNIPPET_XPATH = f".//a[{_has_class('result__snippet')}]"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared connection-pooled HTTP session for search requests.
+
+    Connection failures and 429/5xx responses are retried with backoff;
+    read timeouts are not, so a hung server costs at most one read timeout.
+    """
+    global _session
+    if _session is None:
+        # requests/urllib3 are imported here so that importing this module stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        with _session_lock:
+            if _session is None:
+                retry = Retry(total=SEARCH_RETRIES, read=0, backoff_factor=0.3,
+                              status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=frozenset(['GET']))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def parse_results(page):
+    """Extract title/snippet/url of the top 5 results from a results page"""
+    import lxml.html
+
+    if not page.strip():
+        return []
+    tree = lxml.html.fromstring(page)
+
+    results = []
+    for result in tree.xpath(_RESULT_XPATH):
+        title_elem = result.xpath(_TITLE_XPATH)
+        snippet_elem = result.xpath(_SNIPPET_XPATH)
+
+        if title_elem and snippet_elem:
+            results.append({
+                'title': title_elem[0].text_content().strip(),
+                'snippet': snippet_elem[0].text_content().strip(),
+                'url': title_elem[0].get('href', '')
+            })
+
+    return results
+
+
+def fetch_results(query, search_url=None, timeout=None):
+    """Fetch and parse the top 5 results for a query"""
+    with metrics.stage('search_fetch'):
+        response = get_session().get(search_url or SEARCH_URL, params={'q': query},
+                                     timeout=timeout or SEARCH_TIMEOUT)
+        response.raise_for_status()
+    with metrics.stage('search_parse'):
+        return parse_results(response.text)
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _get_async_client():
+    """Pooled async HTTP client for the running event loop (needs httpx)"""
+    import asyncio
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        timeout = httpx.Timeout(SEARCH_TIMEOUT[1], connect=SEARCH_TIMEOUT[0])
+        transport = httpx.AsyncHTTPTransport(retries=SEARCH_RETRIES)
+        client = _async_clients[loop] = httpx.AsyncClient(
+            headers=HEADERS, timeout=timeout, transport=transport,
+            limits=httpx.Limits(max_connections=32)
+        )
+    return client
+
+
+async def fetch_results_async(query, search_url=None):
+    """Fetch and parse the top 5 results without blocking the event loop"""
+    with metrics.stage('search_fetch'):
+        response = await _get_async_client().get(search_url or SEARCH_URL, params={'q': query})
+        response.raise_for_status()
+    with metrics.stage('search_parse'):
+        return parse_results(response.text)
+
+
+class _InFlight:
+    __slots__ = ('event', 'results', 'error', 'prefetch')
+
+    def __init__(self, prefetch=False):
+        self.event = threading.Event()
+        self.results = None
+        self.error = None
+        # Started by a prefetch that no real search has used yet
+        self.prefetch = prefetch
+
+
+class SearchCache:
+    """TTL + LRU cache for search results with in-flight request coalescing.
+
+    Concurrent lookups of the same normalized query share a single fetch:
+    the first caller fetches, the others wait for its result.  Failed
+    fetches are not cached.  Entries filled by ``prefetch`` are tracked
+    until a real lookup uses them (a prefetch hit) or they expire or are
+    evicted unused (a wasted prefetch).
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, results)
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._prefetched = set()
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def get(self, query):
+        """Cached results for a query, or None"""
+        key = normalize_query(query)
+        with self._lock:
+            return self._lookup(key)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self._unused(key)
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def put(self, query, results):
+        """Store results for a query"""
+        key = normalize_query(query)
+        with self._lock:
+            self._store(key, results)
+
+    def _store(self, key, results):
+        self._entries[key] = (self.clock() + self.ttl, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._unused(self._entries.popitem(last=False)[0])
+            self.evictions += 1
+
+    def _unused(self, key):
+        """A prefetched entry left the cache without being used"""
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+            self.prefetch_wasted += 1
+
+    def _used(self, key, pending=None):
+        """A real lookup was answered by a prefetched entry or fetch"""
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+            self.prefetch_hits += 1
+        elif pending is not None and pending.prefetch:
+            pending.prefetch = False
+            self.prefetch_hits += 1
+
+    def get_or_fetch(self, query, fetch):
+        """Return cached results or call ``fetch(query)`` once for all waiters"""
+        key = normalize_query(query)
+        with self._lock:
+            results = self._lookup(key)
+            if results is not None:
+                self.hits += 1
+                self._used(key)
+                return results
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                self._used(key, pending)
+                leader = False
+            else:
+                self.misses += 1
+                pending = self._in_flight[key] = _InFlight()
+                leader = True
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.results
+
+        try:
+            pending.results = fetch(query)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if pending.error is None:
+                    self._store(key, pending.results)
+                del self._in_flight[key]
+            pending.event.set()
+        return pending.results
+
+    def prefetch(self, query, fetch):
+        """Fetch a query ahead of a search that may come.
+
+        Returns False without fetching if the query is cached or being
+        fetched already, by a thread or on an event loop.  Lookups arriving
+        meanwhile wait for this fetch.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            if self._lookup(key) is not None or key in self._in_flight \
+                    or any(flight_key == key for _, flight_key in self._async_in_flight):
+                return False
+            pending = self._in_flight[key] = _InFlight(prefetch=True)
+        try:
+            pending.results = fetch(query)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if pending.error is None:
+                    self._store(key, pending.results)
+                    # Unless a lookup already waited for it, it is still to be used
+                    if pending.prefetch:
+                        self._prefetched.add(key)
+                del self._in_flight[key]
+            pending.event.set()
+        return True
+
+    async def get_or_fetch_async(self, query, fetch):
+        """Async ``get_or_fetch``: ``await fetch(query)`` once for all waiters"""
+        import asyncio
+
+        key = normalize_query(query)
+        flight_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            results = self._lookup(key)
+            if results is not None:
+                self.hits += 1
+                self._used(key)
+                return results
+            threaded = self._in_flight.get(key)
+            pending = self._async_in_flight.get(flight_key)
+            if threaded is not None:
+                # e.g. a prefetch running on a thread: wait for it off the loop
+                self.coalesced += 1
+                self._used(key, threaded)
+            elif pending is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                pending = self._async_in_flight[flight_key] = flight_key[0].create_future()
+                leader = True
+
+        if threaded is not None:
+            await asyncio.to_thread(threaded.event.wait)
+            if threaded.error is not None:
+                raise threaded.error
+            return threaded.results
+        if not leader:
+            # Shield so a cancelled waiter doesn't cancel the shared fetch
+            return await asyncio.shield(pending)
+
+        try:
+            results = await fetch(query)
+        except BaseException as e:
+            with self._lock:
+                del self._async_in_flight[flight_key]
+            pending.set_exception(e)
+            # Mark retrieved so an unawaited failure isn't logged
+            pending.exception()
+            raise
+        with self._lock:
+            self._store(key, results)
+            del self._async_in_flight[flight_key]
+        pending.set_result(results)
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._prefetched.clear()
+
+    def prefetch_stats(self):
+        """Prefetch hits and waste, counting prefetched entries that have expired by now"""
+        with self._lock:
+            now = self.clock()
+            for key in [k for k in self._prefetched if k not in self._entries or self._entries[k][0] <= now]:
+                self._unused(key)
+            return {'hits': self.prefetch_hits, 'wasted': self.prefetch_wasted,
+                    'unused': len(self._prefetched)}
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
+
+
+# Shared by every chatbot instance and session in the process
+search_cache = SearchCache()
+metrics.register_stats('chat_search_cache', search_cache.stats,
+                       counters=('hits', 'misses', 'coalesced', 'evictions'))
+
+
+def search_web(query):
+    """Perform a cached web search; returns results or an error string"""
+    try:
+        with metrics.stage('search'):
+            return search_cache.get_or_fetch(query, fetch_results)
+    except Exception as e:
+        return f"Search error: {str(e)}"
+
+
+async def search_web_async(query):
+    """Async cached web search; returns results or an error string"""
+    try:
+        with metrics.stage('search'):
+            return await search_cache.get_or_fetch_async(query, fetch_results_async)
+    except Exception as e:
+        return f"Search error: {str(e)}"
+
+
+def split_queries(text, max_queries=None):
+    """Split ``q1 | q2 | q3`` into distinct, non-empty queries"""
+    queries = []
+    seen = set()
+    for query in text.split('|'):
+        query = query.strip()
+        if query and normalize_query(query) not in seen:
+            seen.add(normalize_query(query))
+            queries.append(query)
+    return queries[:max_queries] if max_queries else queries
+
+
+def _format_results(query, search_results):
+    search_info = f"Web search results for '{query}':\n"
+    for i, result in enumerate(search_results, 1):
+        search_info += f"{i}. {result['title']}\n   {result['snippet']}\n   {result['url']}\n\n"
+    return search_info
+
+
+def search_prompt(query, search_results):
+    """Turn search results (or a search error) into a prompt for the model"""
+    if isinstance(search_results, list):
+        search_info = _format_results(query, search_results)
+        return f"Based on these search results: {search_info}\nPlease provide a comprehensive answer about: {query}"
+    return f"Search failed: {search_results}. Please answer: {query}"
+
+
+def multi_search_prompt(queries, results):
+    """Merge the results of several searches into one prompt"""
+    sections = []
+    for query, search_results in zip(queries, results):
+        if isinstance(search_results, list):
+            sections.append(_format_results(query, search_results))
+        else:
+            sections.append(f"Web search for '{query}' failed: {search_results}\n")
+    topics = "; ".join(queries)
+    return f"Based on these search results:\n\n" + "\n".join(sections) + \
+        f"\nPlease provide a comprehensive answer covering: {topics}"